@@ -1,17 +1,131 @@
 from __future__ import annotations
 
+import asyncio
+import math
+import os
+import secrets
+from contextlib import asynccontextmanager
 from datetime import date
-from typing import List, Optional
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
 
 from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 
-from parser.spa_client import OptionItem, SpaScheduleClient
+from parser.async_client import AsyncSpaScheduleClient, create_transport
+from parser.cache_builder import SLOTS_PATH, STORE_PATH
+from parser.compression import BodyCache, body_headers, negotiate
+from parser.conditional import Validators, options_validators, result_validators
+from parser.export import MEDIA_TYPE as NDJSON_MEDIA_TYPE
+from parser.export import PER_LESSON, export_records, ndjson_chunks
+from parser.governor import CircuitOpen, UpstreamGovernor
+from parser.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from parser.metrics import REGISTRY, MetricsMiddleware
+from parser.options_cache import OptionsCache
+from parser.room_index import RoomIndex
+from parser.serialization import schedule_body
+from parser.session_pool import AsyncClientPool
+from parser.shared_slots import DEFAULT_LIMIT as DEFAULT_SHARED_LIMIT
+from parser.shared_slots import SharedSlots
+from parser.singleflight import AsyncSingleFlight
+from parser.snapshot import Snapshot, load_snapshot
+from parser.spa_client import BASE_URL, OptionItem
+from parser.teacher_index import TeacherIndex
+from parser.timing import CACHE, SERIALIZE, ServerTimingMiddleware, timed
+from parser.week_cache import DEFAULT_MAX_WEEKS, DEFAULT_TTLS, WeekCache
 
-app = FastAPI(title="MSU Schedule Proxy")
+# SQLite store (or a legacy .json snapshot) written by parser/cache_builder.py.
+# Set to an empty string to disable snapshot reads and always go upstream.
+SNAPSHOT_PATH = os.environ.get("SCHEDULE_SNAPSHOT_PATH", str(STORE_PATH))
+
+# Timetable form to scrape; point it at parser/upstream_sim.py for local runs.
+UPSTREAM_URL = os.environ.get("SCHEDULE_UPSTREAM_URL", BASE_URL)
+POOL_SIZE = int(os.environ.get("SCHEDULE_POOL_SIZE", "8"))
+# Upstream answers slower than this (seconds) shrink the concurrency limit;
+# while upstream keeps failing, requests to it pause for OPEN_SECONDS.
+UPSTREAM_LATENCY_TARGET = float(os.environ.get("SCHEDULE_UPSTREAM_LATENCY_TARGET", "5"))
+UPSTREAM_OPEN_SECONDS = float(os.environ.get("SCHEDULE_UPSTREAM_OPEN_SECONDS", "30"))
+# Slot table shared with the other servers and cache_builder runs on this
+# host, capping their upstream requests together (parser/shared_slots.py).
+# An empty path leaves this process uncoordinated.
+UPSTREAM_SLOTS_PATH = os.environ.get("SCHEDULE_UPSTREAM_SLOTS_PATH", str(SLOTS_PATH))
+UPSTREAM_SHARED_LIMIT = int(
+    os.environ.get("SCHEDULE_UPSTREAM_SHARED_LIMIT", str(DEFAULT_SHARED_LIMIT))
+)
+OPTIONS_TTL = float(os.environ.get("SCHEDULE_OPTIONS_TTL", "3600"))
+# Bearer token for the admin endpoints (cache invalidation). Without one
+# they only accept requests from localhost.
+ADMIN_TOKEN = os.environ.get("SCHEDULE_ADMIN_TOKEN", "")
+BODY_CACHE_MB = float(os.environ.get("SCHEDULE_BODY_CACHE_MB", "64"))
+# Schedules are encoded straight from the parsed lesson dicts; strict mode
+# validates them through the response models instead (for debugging).
+STRICT_SERIALIZATION = os.environ.get("SCHEDULE_STRICT_SERIALIZATION", "") not in ("", "0")
+# Live schedules with explicit dates are cached per ISO week; 0 disables.
+WEEK_CACHE_WEEKS = int(os.environ.get("SCHEDULE_WEEK_CACHE_WEEKS", str(DEFAULT_MAX_WEEKS)))
+WEEK_TTLS = {
+    tier: float(os.environ.get(f"SCHEDULE_WEEK_TTL_{tier.upper()}", str(ttl)))
+    for tier, ttl in DEFAULT_TTLS.items()
+}
+
+T = TypeVar("T")
+
+_snapshot: Optional[Snapshot] = None
+# Clients are checked out exclusively, which keeps form/CSRF state isolated,
+# while the shared transport reuses keep-alive connections to upstream.
+_transport = create_transport()
+# Adaptive limit and circuit breaker for every request to upstream; user
+# requests are admitted ahead of background option refreshes here and of
+# cache_builder crawls sharing the slot table.
+_governor = UpstreamGovernor(
+    limit=POOL_SIZE,
+    max_limit=POOL_SIZE,
+    latency_target=UPSTREAM_LATENCY_TARGET,
+    open_seconds=UPSTREAM_OPEN_SECONDS,
+    crawl_reserve=1,
+    shared=(
+        SharedSlots(Path(UPSTREAM_SLOTS_PATH), limit=UPSTREAM_SHARED_LIMIT)
+        if UPSTREAM_SLOTS_PATH
+        else None
+    ),
+)
+_pool = AsyncClientPool(
+    lambda: AsyncSpaScheduleClient(UPSTREAM_URL, transport=_transport, governor=_governor),
+    size=POOL_SIZE,
+)
+_options_cache = OptionsCache(ttl=OPTIONS_TTL)
+# Identical concurrent schedule requests share one upstream fetch and parse.
+_schedule_flights = AsyncSingleFlight()
+# Serialized and compressed bodies of snapshot schedules and option lists,
+# keyed by ETag, so repeat requests skip rendering and compression.
+_bodies = BodyCache(max_bytes=int(BODY_CACHE_MB * 1024 * 1024))
+_weeks: Optional[WeekCache] = (
+    WeekCache(ttls=WEEK_TTLS, max_weeks=WEEK_CACHE_WEEKS) if WEEK_CACHE_WEEKS > 0 else None
+)
+
+REGISTRY.register_stats("pool", _pool.stats)
+REGISTRY.register_stats("options_cache", _options_cache.stats)
+REGISTRY.register_stats("schedule_coalescing", _schedule_flights.stats)
+REGISTRY.register_stats("response_bodies", _bodies.stats)
+REGISTRY.register_stats("week_cache", lambda: _weeks.stats() if _weeks is not None else None)
+REGISTRY.register_stats("upstream_governor", _governor.stats)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    global _snapshot
+    _snapshot = await asyncio.to_thread(load_snapshot, Path(SNAPSHOT_PATH)) if SNAPSHOT_PATH else None
+    await _pool.warm()
+    yield
+    await _pool.aclose()
+    await _transport.aclose()
+
+
+app = FastAPI(title="MSU Schedule Proxy", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,10 +134,26 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Upstream-served and other uncached responses are compressed on the fly;
+# stored bodies already carry Content-Encoding and pass through untouched.
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+# Per-route latency for /metrics; outermost, so it includes compression.
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ServerTimingMiddleware)
 
 templates = Jinja2Templates(directory="app/templates")
 
 
+@app.exception_handler(CircuitOpen)
+async def circuit_open(_: Request, exc: CircuitOpen) -> JSONResponse:
+    # Upstream is failing: only cached answers are served until it recovers.
+    return JSONResponse(
+        {"detail": str(exc)},
+        status_code=503,
+        headers={"Retry-After": str(max(math.ceil(exc.retry_after), 1))},
+    )
+
+
 class OptionResponse(BaseModel):
     id: str
     name: str
@@ -53,58 +183,411 @@ class ScheduleResponse(BaseModel):
     lessons: List[Lesson]
 
 
+class SyncLesson(Lesson):
+    key: str
+
+
+class RemovedLesson(BaseModel):
+    key: str
+    id: Optional[str] = None
+
+
+class ScheduleChangesResponse(BaseModel):
+    group: GroupInfo
+    version: str
+    full: bool
+    lessons: List[SyncLesson]
+    added: List[SyncLesson]
+    modified: List[SyncLesson]
+    removed: List[RemovedLesson]
+
+
+class TeacherResponse(BaseModel):
+    name: str
+    lessons: int
+
+
+class TeacherScheduleResponse(BaseModel):
+    teacher: str
+    lessons: List[Lesson]
+
+
+class RoomScheduleResponse(BaseModel):
+    room: str
+    lessons: List[Lesson]
+
+
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request) -> HTMLResponse:
     return templates.TemplateResponse("index.html", {"request": request})
 
 
 @app.get("/api/options/faculties", response_model=List[OptionResponse])
-async def list_faculties() -> List[OptionResponse]:
-    client = SpaScheduleClient()
-    faculties = client.list_faculties()
-    return _serialize_options(faculties)
+async def list_faculties(request: Request) -> Response:
+    with timed(CACHE):
+        faculties = await _snapshot_call(lambda snapshot: snapshot.list_faculties())
+        if faculties is None:
+            faculties = await _options_cache.aget(
+                ("faculties",), lambda: _upstream_options(lambda c: c.list_faculties())
+            )
+    return await _conditional_options(request, faculties)
 
 
 @app.get("/api/options/courses", response_model=List[OptionResponse])
-async def list_courses(faculty_id: str = Query(..., alias="faculty")) -> List[OptionResponse]:
-    client = SpaScheduleClient()
-    courses = client.list_courses(faculty_id)
-    return _serialize_options(courses)
+async def list_courses(
+    request: Request,
+    faculty_id: str = Query(..., alias="faculty"),
+) -> Response:
+    with timed(CACHE):
+        courses = await _snapshot_call(lambda snapshot: snapshot.list_courses(faculty_id))
+        if courses is None:
+            courses = await _options_cache.aget(
+                ("courses", faculty_id),
+                lambda: _upstream_options(lambda c: c.list_courses(faculty_id)),
+            )
+    return await _conditional_options(request, courses)
 
 
 @app.get("/api/options/groups", response_model=List[OptionResponse])
 async def list_groups(
+    request: Request,
     faculty_id: str = Query(..., alias="faculty"),
     course: str = Query(...),
-) -> List[OptionResponse]:
-    client = SpaScheduleClient()
-    groups = client.list_groups(faculty_id, course)
-    return _serialize_options(groups)
+) -> Response:
+    with timed(CACHE):
+        groups = await _snapshot_call(lambda snapshot: snapshot.list_groups(faculty_id, course))
+        if groups is None:
+            groups = await _options_cache.aget(
+                ("groups", faculty_id, course),
+                lambda: _upstream_options(lambda c: c.list_groups(faculty_id, course)),
+            )
+    return await _conditional_options(request, groups)
 
 
 @app.get("/api/schedule", response_model=ScheduleResponse)
 async def get_schedule(
+    request: Request,
     faculty_id: str = Query(..., alias="faculty"),
     course: str = Query(...),
     group_id: str = Query(..., alias="group"),
     date_from: Optional[date] = Query(None, alias="from"),
     date_to: Optional[date] = Query(None, alias="to"),
-) -> ScheduleResponse:
+) -> Response:
     if date_from and date_to and date_from > date_to:
         raise HTTPException(status_code=400, detail="'from' date must be before 'to' date")
 
-    client = SpaScheduleClient()
-    result = client.fetch_schedule(
-        faculty_id=faculty_id,
-        course=course,
-        group_id=group_id,
-        date_from=date_from,
-        date_to=date_to,
+    snapshot = _snapshot
+    if snapshot:
+        # Snapshot validators come from the group row alone, so a revalidation
+        # is answered before any lesson is read.
+        with timed(CACHE):
+            validators = await asyncio.to_thread(
+                lambda: snapshot.schedule_validators(
+                    faculty_id, course, group_id, date_from=date_from, date_to=date_to
+                )
+            )
+        if validators is not None:
+            if validators.not_modified(request.headers):
+                return _not_modified(validators.encoded(_encoding(request)))
+
+            def render() -> Optional[bytes]:
+                with timed(CACHE):
+                    result = snapshot.fetch_schedule(
+                        faculty_id, course, group_id, date_from=date_from, date_to=date_to
+                    )
+                return _schedule_body(group_id, result)
+
+            stored = await _stored_response(request, validators, render)
+            if stored is not None:
+                return stored
+
+    if _weeks is not None and date_from and date_to:
+        result = await _week_schedule(_weeks, faculty_id, course, group_id, date_from, date_to)
+    else:
+        result = await _schedule_flights.do(
+            (faculty_id, course, group_id, date_from, date_to),
+            lambda: _upstream_schedule(faculty_id, course, group_id, date_from, date_to),
+        )
+    # GZipMiddleware may compress this body on the fly, hence a weak tag.
+    validators = result_validators(result).weak()
+    if validators.not_modified(request.headers):
+        return _not_modified(validators)
+    with timed(SERIALIZE):
+        body = _schedule_body(group_id, result)
+    return Response(body, media_type="application/json", headers=validators.headers())
+
+
+@app.get("/api/schedule/changes", response_model=ScheduleChangesResponse)
+async def get_schedule_changes(
+    faculty_id: str = Query(..., alias="faculty"),
+    course: str = Query(...),
+    group_id: str = Query(..., alias="group"),
+    since: Optional[str] = Query(None),
+) -> ScheduleChangesResponse:
+    snapshot = _snapshot
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="Schedule snapshot is not available")
+    payload = await asyncio.to_thread(
+        snapshot.schedule_changes, faculty_id, course, group_id, since
     )
+    if payload is None:
+        raise HTTPException(status_code=404, detail="Unknown group")
+    return ScheduleChangesResponse(**payload)
+
+
+@app.get("/api/teachers", response_model=List[TeacherResponse])
+async def list_teachers() -> List[TeacherResponse]:
+    index = await _teacher_index()
+    return [TeacherResponse(**item) for item in index.teachers()]
+
+
+@app.get("/api/teacher/{name}/schedule", response_model=TeacherScheduleResponse)
+async def get_teacher_schedule(
+    name: str,
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+) -> TeacherScheduleResponse:
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="'from' date must be before 'to' date")
+    entry = (await _teacher_index()).get(name)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown teacher")
+    lessons = [Lesson(**lesson) for lesson in entry.lessons_between(date_from, date_to)]
+    return TeacherScheduleResponse(teacher=entry.name, lessons=lessons)
+
+
+@app.get("/api/rooms/free", response_model=List[str])
+async def find_free_rooms(
+    day: date = Query(..., alias="date"),
+    pairs: List[int] = Query(..., alias="pair"),
+) -> List[str]:
+    return (await _room_index()).free_rooms(day, pairs)
+
+
+@app.get("/api/room/{name}/schedule", response_model=RoomScheduleResponse)
+async def get_room_schedule(
+    name: str,
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+) -> RoomScheduleResponse:
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="'from' date must be before 'to' date")
+    entry = (await _room_index()).get(name)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown room")
+    lessons = [Lesson(**lesson) for lesson in entry.lessons_between(date_from, date_to)]
+    return RoomScheduleResponse(room=entry.name, lessons=lessons)
+
+
+@app.get("/api/export", response_class=StreamingResponse)
+async def export_schedules(
+    per: str = Query(PER_LESSON, pattern="^(lesson|group)$"),
+    faculty_id: Optional[str] = Query(None, alias="faculty"),
+    course: Optional[str] = Query(None),
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    cursor: Optional[str] = Query(None),
+) -> StreamingResponse:
+    """Stream every snapshot group's lessons as NDJSON (see parser/export.py)."""
+    snapshot = _snapshot
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="Schedule snapshot is not available")
+    try:
+        # Listing the groups reads the store; the records themselves are
+        # produced lazily in Starlette's threadpool as the body streams.
+        records = await asyncio.to_thread(
+            lambda: export_records(
+                snapshot,
+                per=per,
+                faculty_id=faculty_id,
+                course=course,
+                date_from=date_from,
+                date_to=date_to,
+                cursor=cursor,
+            )
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(ndjson_chunks(records), media_type=NDJSON_MEDIA_TYPE)
+
+
+@app.post("/api/options/invalidate")
+async def invalidate_options(request: Request) -> dict:
+    # Each invalidation sends the next option requests upstream.
+    _require_admin(request)
+    return {"invalidated": _options_cache.invalidate()}
+
+
+@app.get("/api/stats")
+async def get_stats() -> dict:
+    return {
+        "pool": _pool.stats(),
+        "options_cache": _options_cache.stats(),
+        "schedule_coalescing": _schedule_flights.stats(),
+        "response_bodies": _bodies.stats(),
+        "week_cache": _weeks.stats() if _weeks is not None else None,
+        "upstream_governor": _governor.stats(),
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    """Prometheus text format: upstream, parser, cache and per-route series."""
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+async def _upstream_options(
+    fetch: Callable[[AsyncSpaScheduleClient], Awaitable[List[OptionItem]]],
+) -> List[OptionItem]:
+    async with _pool.checkout() as client:
+        return await fetch(client)
+
+
+async def _upstream_schedule(
+    faculty_id: str,
+    course: str,
+    group_id: str,
+    date_from: Optional[date],
+    date_to: Optional[date],
+) -> Dict[str, object]:
+    async with _pool.checkout() as client:
+        return await client.fetch_schedule(
+            faculty_id=faculty_id,
+            course=course,
+            group_id=group_id,
+            date_from=date_from,
+            date_to=date_to,
+        )
+
+
+async def _week_schedule(
+    weeks: WeekCache,
+    faculty_id: str,
+    course: str,
+    group_id: str,
+    date_from: date,
+    date_to: date,
+) -> Dict[str, object]:
+    """Assemble a range from cached weeks, fetching only the missing ones.
+
+    Each run of consecutive missing weeks is one upstream request, made
+    concurrently with the others on its own pooled client. While the
+    upstream circuit is open, expired weeks are served instead if the cache
+    still holds the whole range.
+    """
+    group = (faculty_id, course, group_id)
+    with timed(CACHE):
+        plan = weeks.lookup(group, date_from, date_to)
+
+    async def fetch(run_from: date, run_to: date) -> None:
+        result = await _schedule_flights.do(
+            (faculty_id, course, group_id, run_from, run_to),
+            lambda: _upstream_schedule(faculty_id, course, group_id, run_from, run_to),
+        )
+        with timed(CACHE):
+            plan.fresh.update(weeks.store(group, (run_from, run_to), result))
+
+    try:
+        await asyncio.gather(*(fetch(*run) for run in plan.missing))
+    except CircuitOpen:
+        with timed(CACHE):
+            stale = weeks.stale(group, date_from, date_to)
+        if stale is None:
+            raise
+        plan.fresh = stale
+    with timed(CACHE):
+        return weeks.assemble(group_id, plan.fresh, date_from, date_to)
+
+
+async def _teacher_index() -> TeacherIndex:
+    return await _derived_index(lambda snapshot: snapshot.teacher_index())
+
+
+async def _room_index() -> RoomIndex:
+    return await _derived_index(lambda snapshot: snapshot.room_index())
+
+
+async def _snapshot_call(get: Callable[[Snapshot], Optional[T]]) -> Optional[T]:
+    # A SQLite snapshot reads the database (at least its version row) on every
+    # lookup, and reloads the options tree after a rebuild; keep both off the loop.
+    snapshot = _snapshot
+    if snapshot is None:
+        return None
+    return await asyncio.to_thread(get, snapshot)
+
+
+async def _derived_index(get: Callable[[Snapshot], T]) -> T:
+    snapshot = _snapshot
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="Schedule snapshot is not available")
+    # The first call after a crawl builds the index; keep that off the loop.
+    return await asyncio.to_thread(get, snapshot)
+
+
+async def _conditional_options(request: Request, items: List[OptionItem]) -> Response:
+    validators = options_validators(items)
+    if validators.not_modified(request.headers):
+        return _not_modified(validators.encoded(_encoding(request)))
+    stored = await _stored_response(
+        request, validators, lambda: _render(_serialize_options(items))
+    )
+    assert stored is not None
+    return stored
+
+
+def _schedule_body(group_id: str, result: Optional[Dict[str, object]]) -> Optional[bytes]:
+    """Render a ``ScheduleResponse`` body for a ``fetch_schedule`` result."""
+    if result is None:
+        return None
     group_name = result["group"].get("name") if result.get("group") else None
-    lessons = [Lesson(**lesson) for lesson in result.get("lessons", [])]
-    return ScheduleResponse(group=GroupInfo(id=group_id, name=group_name), lessons=lessons)
+    lessons = result.get("lessons", [])
+    if STRICT_SERIALIZATION:
+        return _render(ScheduleResponse(
+            group=GroupInfo(id=group_id, name=group_name),
+            lessons=[Lesson(**lesson) for lesson in lessons],
+        ))
+    return schedule_body(group_id, group_name, lessons)
+
+
+async def _stored_response(
+    request: Request, validators: Validators, render: Callable[[], Optional[bytes]]
+) -> Optional[Response]:
+    """Serve a body from ``_bodies``, producing it with ``render`` on a miss.
+
+    Returns None when ``render`` has nothing to render.
+    """
+    encoding = _encoding(request)
+    with timed(CACHE):
+        body = _bodies.get(validators.etag, encoding)
+    if body is None:
+        # Rendering and compressing take milliseconds; keep them off the loop.
+        with timed(SERIALIZE):
+            body = await asyncio.to_thread(_bodies.fill, validators.etag, encoding, render)
+        if body is None:
+            return None
+    return Response(body, media_type="application/json", headers=body_headers(validators, encoding))
+
+
+def _render(content: object) -> bytes:
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def _not_modified(validators: Validators) -> Response:
+    return Response(status_code=304, headers=validators.headers())
+
+
+def _encoding(request: Request) -> str:
+    return negotiate(request.headers.get("accept-encoding"))
 
 
 def _serialize_options(items: List[OptionItem]) -> List[OptionResponse]:
     return [OptionResponse(id=item.id, name=item.name) for item in items]
+
+
+def _require_admin(request: Request) -> None:
+    if ADMIN_TOKEN:
+        supplied = request.headers.get("authorization", "")
+        if not secrets.compare_digest(supplied.encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+            raise HTTPException(status_code=401, detail="Admin token required")
+    elif request.client is None or request.client.host not in ("127.0.0.1", "::1", "localhost"):
+        raise HTTPException(status_code=403, detail="Set SCHEDULE_ADMIN_TOKEN to allow remote admin requests")
@@ -1,13 +1,17 @@
 """Parser package for CACS SPA MSU schedule."""
 from .spa_client import SpaScheduleClient, OptionItem
+from .async_client import AsyncSpaScheduleClient
 from .parse_html_schedule import parse_html_schedule
 from .api_client import ScheduleApiClient, ApiResult, to_json
+from .snapshot import ScheduleSnapshot
 
 __all__ = [
     "SpaScheduleClient",
     "OptionItem", 
+    "AsyncSpaScheduleClient",
     "parse_html_schedule",
     "ScheduleApiClient",
     "ApiResult",
     "to_json",
+    "ScheduleSnapshot",
 ]
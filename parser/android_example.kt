@@ -175,6 +175,63 @@ class ScheduleApiClient {
         }
     }
     
+    /**
+     * Синхронизировать расписание группы по изменениям (/schedule/changes)
+     *
+     * [lessons] - локальная копия занятий по полю key; передайте version из
+     * прошлого вызова (null при первом запуске). Возвращает новую версию.
+     */
+    suspend fun syncSchedule(
+        facultyId: String,
+        course: String,
+        groupId: String,
+        lessons: MutableMap<String, JSONObject>,
+        since: String?
+    ): ApiResult = withContext(Dispatchers.IO) {
+        try {
+            val url = StringBuilder("$baseUrl/schedule/changes?")
+                .append("faculty_id=$facultyId&course=$course&group_id=$groupId")
+            if (since != null) {
+                url.append("&since=$since")
+            }
+
+            val request = Request.Builder()
+                .url(url.toString())
+                .build()
+
+            httpClient.newCall(request).execute().use { response ->
+                if (!response.isSuccessful) {
+                    return@withContext ApiResult(false, null, "HTTP ${response.code}")
+                }
+
+                val json = JSONObject(response.body?.string() ?: "")
+                if (!json.getBoolean("success")) {
+                    return@withContext ApiResult(false, null, json.getString("error"))
+                }
+
+                val data = json.getJSONObject("data")
+                if (data.getBoolean("full")) {
+                    lessons.clear()
+                }
+                for (name in listOf("lessons", "added", "modified")) {
+                    val items = data.getJSONArray(name)
+                    for (i in 0 until items.length()) {
+                        val lesson = items.getJSONObject(i)
+                        lessons[lesson.getString("key")] = lesson
+                    }
+                }
+                val removed = data.getJSONArray("removed")
+                for (i in 0 until removed.length()) {
+                    lessons.remove(removed.getJSONObject(i).getString("key"))
+                }
+                ApiResult(true, data.getString("version"), null)
+            }
+        } catch (e: Exception) {
+            Log.e("ScheduleAPI", "Error syncing schedule", e)
+            ApiResult(false, null, e.message)
+        }
+    }
+    
     /**
      * Поиск группы по названию
      */
@@ -3,11 +3,22 @@ from __future__ import annotations
 
 import json
 from dataclasses import dataclass, asdict
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Hashable, List, Optional
 
 import requests
 
-from .spa_client import SpaScheduleClient, OptionItem
+from .conditional import Validators
+from .governor import CRAWL, GOVERNOR, UpstreamGovernor, lane
+from .options_cache import DEFAULT_TTL, OptionsCache
+from .search_index import SearchIndexRefresher
+from .session_pool import ClientPool
+from .singleflight import SingleFlight
+from .snapshot import Snapshot
+from .spa_client import BASE_URL, SpaScheduleClient, OptionItem
+from .timing import CACHE, timed
+
+
+_NO_SNAPSHOT = "This lookup requires a crawled snapshot (see parser/cache_builder.py)"
 
 
 @dataclass
@@ -51,13 +62,45 @@ class ScheduleApiClient:
         )
     """
 
-    def __init__(self, base_url: str = "https://cacs.spa.msu.ru/time-table/group?type=0"):
-        self._client = SpaScheduleClient(base_url=base_url)
+    def __init__(
+        self,
+        base_url: str = BASE_URL,
+        pool_size: int = 1,
+        options_ttl: float = DEFAULT_TTL,
+        snapshot: Optional[Snapshot] = None,
+        governor: UpstreamGovernor = GOVERNOR,
+    ):
+        # Every call checks a client out of the pool, so the instance can be
+        # shared between threads (e.g. FastAPI's sync endpoint threadpool).
+        self._pool = ClientPool(
+            lambda: SpaScheduleClient(base_url=base_url, governor=governor), size=pool_size
+        )
+        # Option lists change a few times a semester; serve them from memory
+        # and refresh expired ones in the background.
+        self.options_cache = OptionsCache(ttl=options_ttl)
+        # Identical concurrent schedule requests share one upstream fetch.
+        self.schedule_flights = SingleFlight()
+        # Crawled snapshot (see cache_builder) answered before going upstream.
+        self.snapshot = snapshot
+        self._search = SearchIndexRefresher(self._crawl_options_tree)
+
+    def warm(self) -> None:
+        """Pre-create pooled clients so the first requests skip the initial GET."""
+        self._pool.warm()
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Checkout and wait-time statistics of the client pool."""
+        return self._pool.stats()
 
     def get_faculties(self) -> ApiResult:
         """Get list of all faculties (факультеты)."""
         try:
-            items = self._client.list_faculties()
+            with timed(CACHE):
+                items = self.snapshot.list_faculties() if self.snapshot else None
+                if items is None:
+                    items = self._list_options(
+                        ("faculties",), lambda client: client.list_faculties()
+                    )
             return ApiResult(
                 success=True,
                 data=[{"id": item.id, "name": item.name} for item in items]
@@ -68,7 +111,12 @@ class ScheduleApiClient:
     def get_courses(self, faculty_id: str) -> ApiResult:
         """Get list of courses (курсы) for a faculty."""
         try:
-            items = self._client.list_courses(faculty_id)
+            with timed(CACHE):
+                items = self.snapshot.list_courses(faculty_id) if self.snapshot else None
+                if items is None:
+                    items = self._list_options(
+                        ("courses", faculty_id), lambda client: client.list_courses(faculty_id)
+                    )
             return ApiResult(
                 success=True,
                 data=[{"id": item.id, "name": item.name} for item in items]
@@ -79,7 +127,13 @@ class ScheduleApiClient:
     def get_groups(self, faculty_id: str, course: str) -> ApiResult:
         """Get list of groups (группы) for a faculty and course."""
         try:
-            items = self._client.list_groups(faculty_id, course)
+            with timed(CACHE):
+                items = self.snapshot.list_groups(faculty_id, course) if self.snapshot else None
+                if items is None:
+                    items = self._list_options(
+                        ("groups", faculty_id, course),
+                        lambda client: client.list_groups(faculty_id, course),
+                    )
             return ApiResult(
                 success=True,
                 data=[{"id": item.id, "name": item.name} for item in items]
@@ -120,31 +174,187 @@ class ScheduleApiClient:
             if date_to:
                 dt = datetime.strptime(date_to, "%d.%m.%Y").date()
             
-            result = self._client.fetch_schedule(
+            def fetch() -> Dict[str, Any]:
+                with self._pool.checkout() as client:
+                    return client.fetch_schedule(
+                        faculty_id=faculty_id,
+                        course=course,
+                        group_id=group_id,
+                        date_from=df,
+                        date_to=dt,
+                    )
+
+            result = None
+            if self.snapshot:
+                with timed(CACHE):
+                    result = self.snapshot.fetch_schedule(
+                        faculty_id, course, group_id, date_from=df, date_to=dt
+                    )
+            if result is None:
+                result = self.schedule_flights.do(
+                    (faculty_id, course, group_id, df, dt), fetch
+                )
+            return ApiResult(success=True, data=result)
+        except ValueError as e:
+            return ApiResult(success=False, error=f"Invalid date format: {e}")
+        except Exception as e:
+            return ApiResult(success=False, error=str(e))
+
+    def get_schedule_changes(
+        self,
+        faculty_id: str,
+        course: str,
+        group_id: str,
+        since: Optional[str] = None,
+    ) -> ApiResult:
+        """Get lesson-level changes of a group since a version token.
+
+        Omit ``since`` on the first call to get every lesson, then pass the
+        returned ``version`` back. Lessons are matched by their ``key``,
+        which, unlike ``id``, does not change when only ``notes`` do.
+
+        Returns:
+            ApiResult with data containing:
+            - group: {"id": str, "name": str}
+            - version: token for the next call
+            - full: true when ``lessons`` replaces the client's copy
+            - lessons: all lessons (full resync only)
+            - added / modified: lessons to upsert by ``key``
+            - removed: [{"key": str, "id": str}] to delete
+        """
+        if not self.snapshot:
+            return ApiResult(success=False, error=_NO_SNAPSHOT)
+        try:
+            data = self.snapshot.schedule_changes(faculty_id, course, group_id, since)
+            if data is None:
+                return ApiResult(success=False, error=f"Unknown group: {group_id}")
+            return ApiResult(success=True, data=data)
+        except Exception as e:
+            return ApiResult(success=False, error=str(e))
+
+    def export(
+        self,
+        per: str = "lesson",
+        faculty_id: Optional[str] = None,
+        course: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        cursor: Optional[str] = None,
+    ) -> ApiResult:
+        """Export every cached group's lessons, optionally filtered.
+
+        Args:
+            per: "lesson" for one record per lesson, "group" for one per group
+            faculty_id: Optional faculty filter
+            course: Optional course filter
+            date_from: Optional start date in DD.MM.YYYY format
+            date_to: Optional end date in DD.MM.YYYY format
+            cursor: ``cursor`` of the last record received, to resume after it
+
+        Returns:
+            ApiResult whose data is a lazy iterator of record dicts (see
+            parser/export.py); pass it to ``ndjson_chunks`` to stream it.
+        """
+        if not self.snapshot:
+            return ApiResult(success=False, error=_NO_SNAPSHOT)
+        from datetime import datetime
+        from .export import export_records
+
+        try:
+            df = datetime.strptime(date_from, "%d.%m.%Y").date() if date_from else None
+            dt = datetime.strptime(date_to, "%d.%m.%Y").date() if date_to else None
+        except ValueError as e:
+            return ApiResult(success=False, error=f"Invalid date format: {e}")
+        try:
+            records = export_records(
+                self.snapshot,
+                per=per,
                 faculty_id=faculty_id,
                 course=course,
-                group_id=group_id,
                 date_from=df,
                 date_to=dt,
+                cursor=cursor,
             )
-            return ApiResult(success=True, data=result)
-        except ValueError as e:
-            return ApiResult(success=False, error=f"Invalid date format: {e}")
+            return ApiResult(success=True, data=records)
         except Exception as e:
             return ApiResult(success=False, error=str(e))
 
-    def search_group(self, query: str) -> ApiResult:
+    def schedule_validators(
+        self,
+        faculty_id: str,
+        course: str,
+        group_id: str,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+    ) -> Optional[Validators]:
+        """ETag/Last-Modified of a snapshot-served get_schedule() result.
+
+        Returns None when the schedule would come from upstream (or the
+        dates are invalid); those results are validated by their lesson ids
+        with :func:`parser.conditional.result_validators`.
+        """
+        if not self.snapshot:
+            return None
+        from datetime import datetime
+
+        try:
+            df = datetime.strptime(date_from, "%d.%m.%Y").date() if date_from else None
+            dt = datetime.strptime(date_to, "%d.%m.%Y").date() if date_to else None
+        except ValueError:
+            return None
+        return self.snapshot.schedule_validators(
+            faculty_id, course, group_id, date_from=df, date_to=dt
+        )
+
+    def options_tree(self) -> List[Dict[str, Any]]:
+        """Walk all faculties, courses and groups into a nested options tree.
+
+        The shape matches ``options.faculties`` in ``data/cache.json``; when a
+        snapshot is attached its tree is returned without going upstream.
+        """
+        if self.snapshot and self.snapshot.options_tree():
+            return self.snapshot.options_tree()
+        tree = []
+        for faculty in self._checked(self.get_faculties()):
+            courses = []
+            for course in self._checked(self.get_courses(faculty["id"])):
+                groups = self._checked(self.get_groups(faculty["id"], course["id"]))
+                courses.append({**course, "groups": groups})
+            tree.append({**faculty, "courses": courses})
+        return tree
+
+    def start_search_index(self, interval: float = 6 * 3600) -> None:
+        """Build the group search index in the background and keep it fresh.
+
+        Until the first build completes, search_group() walks upstream live.
+        """
+        self._search = SearchIndexRefresher(self._crawl_options_tree, interval=interval)
+        self._search.start()
+
+    def stop_search_index(self) -> None:
+        self._search.stop()
+
+    def search_group(self, query: str, limit: Optional[int] = 50) -> ApiResult:
         """Search for groups by name substring.
         
         This is a convenience method that searches across all faculties
-        and courses to find matching groups.
+        and courses to find matching groups. Once the search index is built
+        (see start_search_index) results come from memory, ranked exact >
+        prefix > substring > similar names, so typos still match.
         
         Args:
             query: Substring to search for in group names (case-insensitive)
+            limit: Maximum number of matches returned by the index
             
         Returns:
             ApiResult with list of matching groups including their path
         """
+        index = self._search.index
+        if index is not None:
+            return ApiResult(
+                success=True,
+                data=[ref.to_dict() for ref in index.search(query, limit=limit)],
+            )
         try:
             matches = []
             query_lower = query.lower()
@@ -178,6 +388,141 @@ class ScheduleApiClient:
         except Exception as e:
             return ApiResult(success=False, error=str(e))
 
+    def list_teachers(self) -> ApiResult:
+        """List every teacher found in the crawled snapshot.
+
+        Returns:
+            ApiResult with a list of {"name": str, "lessons": int}
+        """
+        if not self.snapshot:
+            return ApiResult(success=False, error=_NO_SNAPSHOT)
+        try:
+            return ApiResult(success=True, data=self.snapshot.teacher_index().teachers())
+        except Exception as e:
+            return ApiResult(success=False, error=str(e))
+
+    def get_teacher_schedule(
+        self,
+        name: str,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+    ) -> ApiResult:
+        """Get lessons of one teacher across all groups of the snapshot.
+
+        Args:
+            name: Teacher name as listed by list_teachers() (case, spacing
+                and punctuation are ignored)
+            date_from: Optional start date in DD.MM.YYYY format
+            date_to: Optional end date in DD.MM.YYYY format
+
+        Returns:
+            ApiResult with schedule data containing:
+            - teacher: str
+            - lessons: List of lesson dictionaries sorted by date and time
+        """
+        if not self.snapshot:
+            return ApiResult(success=False, error=_NO_SNAPSHOT)
+        try:
+            from datetime import datetime
+
+            df = datetime.strptime(date_from, "%d.%m.%Y").date() if date_from else None
+            dt = datetime.strptime(date_to, "%d.%m.%Y").date() if date_to else None
+            entry = self.snapshot.teacher_index().get(name)
+            if entry is None:
+                return ApiResult(success=False, error=f"Unknown teacher: {name}")
+            return ApiResult(
+                success=True,
+                data={"teacher": entry.name, "lessons": entry.lessons_between(df, dt)},
+            )
+        except ValueError as e:
+            return ApiResult(success=False, error=f"Invalid date format: {e}")
+        except Exception as e:
+            return ApiResult(success=False, error=str(e))
+
+    def find_free_rooms(self, date: str, pairs: List[int]) -> ApiResult:
+        """Find rooms with no lessons at the given pairs of a day.
+
+        Only rooms that appear somewhere in the crawled snapshot are known;
+        online "rooms" (Zoom etc.) are never reported as free.
+
+        Args:
+            date: Day in DD.MM.YYYY format
+            pairs: Pair numbers that must all be free
+
+        Returns:
+            ApiResult with a sorted list of room names
+        """
+        if not self.snapshot:
+            return ApiResult(success=False, error=_NO_SNAPSHOT)
+        try:
+            from datetime import datetime
+
+            day = datetime.strptime(date, "%d.%m.%Y").date()
+            return ApiResult(success=True, data=self.snapshot.room_index().free_rooms(day, pairs))
+        except ValueError as e:
+            return ApiResult(success=False, error=f"Invalid date format: {e}")
+        except Exception as e:
+            return ApiResult(success=False, error=str(e))
+
+    def get_room_schedule(
+        self,
+        name: str,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+    ) -> ApiResult:
+        """Get all lessons held in one room.
+
+        Args:
+            name: Room name; "ауд. Г 608", "Г-608" and "г608" are the same room
+            date_from: Optional start date in DD.MM.YYYY format
+            date_to: Optional end date in DD.MM.YYYY format
+
+        Returns:
+            ApiResult with schedule data containing:
+            - room: str
+            - lessons: List of lesson dictionaries sorted by date and time
+        """
+        if not self.snapshot:
+            return ApiResult(success=False, error=_NO_SNAPSHOT)
+        try:
+            from datetime import datetime
+
+            df = datetime.strptime(date_from, "%d.%m.%Y").date() if date_from else None
+            dt = datetime.strptime(date_to, "%d.%m.%Y").date() if date_to else None
+            entry = self.snapshot.room_index().get(name)
+            if entry is None:
+                return ApiResult(success=False, error=f"Unknown room: {name}")
+            return ApiResult(
+                success=True,
+                data={"room": entry.name, "lessons": entry.lessons_between(df, dt)},
+            )
+        except ValueError as e:
+            return ApiResult(success=False, error=f"Invalid date format: {e}")
+        except Exception as e:
+            return ApiResult(success=False, error=str(e))
+
+    def _list_options(
+        self,
+        key: Hashable,
+        fetch: Callable[[SpaScheduleClient], List[OptionItem]],
+    ) -> List[OptionItem]:
+        def load() -> List[OptionItem]:
+            with self._pool.checkout() as client:
+                return fetch(client)
+
+        return self.options_cache.get(key, load)
+
+    def _crawl_options_tree(self) -> List[Dict[str, Any]]:
+        # Search index rebuilds walk every course; keep them behind user requests.
+        with lane(CRAWL):
+            return self.options_tree()
+
+    @staticmethod
+    def _checked(result: ApiResult) -> Any:
+        if not result.success:
+            raise RuntimeError(result.error)
+        return result.data
+
 
 def to_json(result: ApiResult) -> str:
     """Convert ApiResult to JSON string."""
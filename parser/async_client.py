@@ -0,0 +1,139 @@
+"""asyncio counterpart of SpaScheduleClient built on httpx."""
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+from typing import Dict, List, Optional
+
+import httpx
+
+from .form_page import FormPage, parse_form_page
+from .governor import GOVERNOR, UpstreamGovernor
+from .metrics import upstream_request
+from .spa_client import BASE_URL, _HEADERS, OptionItem, _SpaFormState
+from .timing import UPSTREAM, timed
+
+_TIMEOUT = httpx.Timeout(30.0)
+
+
+def create_transport(max_connections: int = 50, max_keepalive: int = 20) -> httpx.AsyncHTTPTransport:
+    """Build a keep-alive connection pool that many clients can share."""
+    return httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+        ),
+        retries=1,
+    )
+
+
+class AsyncSpaScheduleClient(_SpaFormState):
+    """Non-blocking version of the SPA timetable form workflow.
+
+    Each instance keeps its own cookies and CSRF state, so it must not be used
+    by two coroutines at once. Pass a shared ``transport`` (see
+    :func:`create_transport`) to reuse pooled keep-alive connections across
+    instances; in that case the transport's owner is responsible for closing it.
+    """
+
+    def __init__(
+        self,
+        base_url: str = BASE_URL,
+        *,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        governor: UpstreamGovernor = GOVERNOR,
+        backend: Optional[str] = None,
+    ) -> None:
+        super().__init__(base_url, governor, backend)
+        self._owns_transport = transport is None
+        self.session = httpx.AsyncClient(
+            transport=transport or create_transport(),
+            timeout=_TIMEOUT,
+            follow_redirects=True,
+        )
+
+    async def __aenter__(self) -> "AsyncSpaScheduleClient":
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        # Closing the httpx client also closes its transport, which must
+        # survive when it is shared with other clients.
+        if self._owns_transport:
+            await self.session.aclose()
+
+    # -- public API -----------------------------------------------------
+
+    async def list_faculties(self) -> List[OptionItem]:
+        page = await self._ensure_initial_state()
+        return page.options("facultyid")
+
+    async def list_courses(self, faculty_id: str) -> List[OptionItem]:
+        await self._select_faculty(faculty_id)
+        page = await self._submit_form()
+        return page.options("course")
+
+    async def list_groups(self, faculty_id: str, course: str) -> List[OptionItem]:
+        await self._select_faculty(faculty_id)
+        self._select_course(course)
+        page = await self._submit_form()
+        return page.options("groupid")
+
+    async def fetch_schedule(
+        self,
+        faculty_id: str,
+        course: str,
+        group_id: str,
+        *,
+        date_from: Optional[dt.date] = None,
+        date_to: Optional[dt.date] = None,
+    ) -> Dict[str, object]:
+        await self._select_faculty(faculty_id)
+        self._select_course(course)
+        self._select_dates(date_from, date_to)
+        self._select_group(group_id)
+        page = await self._submit_form()
+        # Lesson extraction is CPU-bound; keep it off the event loop.
+        return await asyncio.to_thread(
+            self._schedule_result, page, group_id, date_from, date_to
+        )
+
+    async def warm(self) -> None:
+        """Drop any form state and fetch a fresh CSRF token from upstream."""
+        self._reset_state()
+        await self._ensure_initial_state()
+
+    # -- internal helpers ----------------------------------------------
+
+    async def _ensure_initial_state(self) -> FormPage:
+        if self._last_page is None:
+            async with self.governor.arequest():
+                with upstream_request("initial_get"), timed(UPSTREAM):
+                    resp = await self.session.get(self.base_url)
+                    resp.raise_for_status()
+            self._update_state(await self._parse(resp.text))
+        assert self._last_page is not None
+        return self._last_page
+
+    async def _select_faculty(self, faculty_id: str) -> None:
+        await self._ensure_initial_state()
+        self._set_faculty(faculty_id)
+
+    async def _submit_form(self) -> FormPage:
+        page = self._last_page or await self._ensure_initial_state()
+        payload = self._form_payload(page)
+        async with self.governor.arequest():
+            with upstream_request("submit_form"), timed(UPSTREAM):
+                resp = await self.session.post(self.base_url, data=payload, headers=_HEADERS)
+                resp.raise_for_status()
+        page = await self._parse(resp.text)
+        self._update_state(page)
+        return page
+
+    async def _parse(self, html: str) -> FormPage:
+        return await asyncio.to_thread(parse_form_page, html, self.backend)
+
+
+__all__ = ["AsyncSpaScheduleClient", "create_transport"]
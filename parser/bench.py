@@ -0,0 +1,458 @@
+"""Offline benchmarks for the HTML parsing path.
+
+Each benchmark runs against a corpus of timetable pages: ``small`` (one
+day), ``week`` and ``semester`` (eight months, lectures shared by several
+groups). The corpus is either synthetic (:mod:`parser.synthetic`, the
+default, identical on every machine) or pages recorded from the real site
+with ``--record``. The benchmarks are:
+
+* ``parse``: ``parse_html_schedule`` on markup, per backend;
+* ``options``: ``FormPage.options`` on the three selects of a parsed page,
+  per backend;
+* ``hash``: ``_hash_payload`` over the page's lessons;
+* ``fetch``: ``SpaScheduleClient.fetch_schedule`` end to end, per backend,
+  with the HTTP transport stubbed out to answer with the page.
+
+Every result reports throughput (pages/s and lessons, options or hashes per
+second) and, from one extra traced run, peak memory and the memory blocks
+still allocated afterwards. ``-o`` saves the run as JSON. ``--compare``
+prints the change against an earlier saved run.
+
+Usage::
+
+    python -m parser.bench
+    python -m parser.bench -o before.json
+    python -m parser.bench --compare before.json
+    python -m parser.bench --record data/bench            # save real pages
+    python -m parser.bench --corpus data/bench -o real.json
+"""
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import gc
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import requests
+
+from .form_page import parse_form_page
+from .parse_html_schedule import BACKENDS, _hash_payload, parse_html_schedule
+from .spa_client import BASE_URL, SpaScheduleClient
+from .synthetic import SyntheticSite
+
+BENCHMARKS = ("parse", "options", "hash", "fetch")
+DEFAULT_MIN_TIME = 1.0
+FORMAT_VERSION = 1
+
+_FIELDS = ("facultyid", "course", "groupid")
+_STUB_URL = "http://bench.invalid/time-table/group?type=0"
+
+
+class Page(NamedTuple):
+    name: str
+    html: str
+
+
+class Result(NamedTuple):
+    benchmark: str
+    page: str
+    variant: str
+    unit: str
+    items: int
+    iterations: int
+    median_s: float
+    best_s: float
+    mean_s: float
+    page_bytes: int
+    peak_bytes: int
+    retained_bytes: int
+    retained_blocks: int
+
+    @property
+    def key(self) -> Tuple[str, str, str]:
+        return (self.benchmark, self.page, self.variant)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            **self._asdict(),
+            "pages_per_s": round(1 / self.median_s, 2) if self.median_s else None,
+            "items_per_s": round(self.items / self.median_s, 1) if self.median_s else None,
+        }
+
+
+# -- corpus -----------------------------------------------------------------
+
+
+def synthetic_corpus() -> List[Page]:
+    """Synthetic pages for fixed dates, so runs on different days compare."""
+    site = SyntheticSite()
+    faculty_id, course, group_id = site.first_group()
+    ranges = {
+        "small": (dt.date(2025, 10, 8), dt.date(2025, 10, 8)),
+        "week": (dt.date(2025, 10, 6), dt.date(2025, 10, 12)),
+        "semester": (dt.date(2025, 9, 1), dt.date(2026, 4, 30)),
+    }
+    return [
+        Page(name, site.page(_form(faculty_id, course, group_id, start, end)))
+        for name, (start, end) in ranges.items()
+    ]
+
+
+def load_corpus(directory: Path) -> List[Page]:
+    """Recorded pages: every ``*.html`` in ``directory``, named after the file."""
+    pages = [
+        Page(path.stem, path.read_text(encoding="utf-8"))
+        for path in sorted(Path(directory).glob("*.html"))
+    ]
+    if not pages:
+        raise SystemExit(f"No .html pages in {directory}")
+    return pages
+
+
+def record_corpus(
+    directory: Path, base_url: str, group: Optional[Tuple[str, str, str]] = None
+) -> List[Path]:
+    """Fetch ``small``/``week``/``semester`` pages of one group from upstream and save them.
+
+    The group defaults to the first one listed.
+    """
+    from .cache_builder import daterange
+
+    client = SpaScheduleClient(base_url)
+    if group is None:
+        faculty_id = client.list_faculties()[0].id
+        course = client.list_courses(faculty_id)[0].id
+        group = (faculty_id, course, client.list_groups(faculty_id, course)[0].id)
+
+    pages: List[str] = []
+    post = client.session.post
+
+    def recording_post(*args: Any, **kwargs: Any) -> requests.Response:
+        resp = post(*args, **kwargs)
+        pages.append(resp.text)
+        return resp
+
+    client.session.post = recording_post  # type: ignore[method-assign]
+    today = dt.date.today()
+    monday = today - dt.timedelta(days=today.weekday())
+    ranges = {
+        "small": (today, today),
+        "week": (monday, monday + dt.timedelta(days=6)),
+        "semester": daterange(),
+    }
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    written = []
+    for name, (start, end) in ranges.items():
+        client.fetch_schedule(*group, date_from=start, date_to=end)
+        path = directory / f"{name}.html"
+        path.write_text(pages[-1], encoding="utf-8")
+        written.append(path)
+    return written
+
+
+def _form(faculty_id: str, course: str, group_id: str, start: dt.date, end: dt.date) -> Dict[str, str]:
+    return {
+        "TimeTableForm[facultyId]": faculty_id,
+        "TimeTableForm[course]": course,
+        "TimeTableForm[groupId]": group_id,
+        "TimeTableForm[dateStart]": f"{start:%d.%m.%Y}",
+        "TimeTableForm[dateEnd]": f"{end:%d.%m.%Y}",
+    }
+
+
+# -- benchmarks ---------------------------------------------------------------
+
+
+class _PageAdapter(requests.adapters.BaseAdapter):
+    """Transport answering every request with the same page."""
+
+    def __init__(self, html: str) -> None:
+        super().__init__()
+        self._body = html.encode("utf-8")
+
+    def send(self, request: requests.PreparedRequest, **kwargs: Any) -> requests.Response:
+        resp = requests.Response()
+        resp.status_code = 200
+        resp._content = self._body
+        resp.encoding = "utf-8"
+        resp.headers["Content-Type"] = "text/html; charset=UTF-8"
+        resp.url = request.url or ""
+        resp.request = request
+        return resp
+
+    def close(self) -> None:
+        pass
+
+
+def _cases(page: Page, benchmarks: Sequence[str]) -> List[Tuple[str, str, str, Callable[[], int]]]:
+    """``(benchmark, variant, unit, run)``; ``run`` does the work once and returns the item count."""
+    cases: List[Tuple[str, str, str, Callable[[], int]]] = []
+    backends = _available_backends()
+    if "parse" in benchmarks:
+        for backend in backends:
+            cases.append((
+                "parse",
+                backend,
+                "lessons",
+                lambda backend=backend: len(parse_html_schedule(page.html, backend=backend)),
+            ))
+
+    reference = parse_form_page(page.html, "bs4")
+    if "options" in benchmarks:
+        for backend in backends:
+            form = parse_form_page(page.html, backend)
+            cases.append((
+                "options",
+                backend,
+                "options",
+                lambda form=form: sum(len(form.options(field)) for field in _FIELDS),
+            ))
+    if "hash" in benchmarks:
+        payloads = [
+            {key: value for key, value in lesson.items() if key != "id"}
+            for lesson in parse_html_schedule(reference.tree)
+        ]
+        cases.append(("hash", "", "hashes", lambda: len([_hash_payload(p) for p in payloads])))
+    if "fetch" in benchmarks:
+        selected = [reference.selected(field) for field in _FIELDS]
+        if all(option is not None for option in selected):
+            ids = [option.id for option in selected]  # type: ignore[union-attr]
+            for backend in backends:
+                client = SpaScheduleClient(_STUB_URL, backend=backend)
+                client.session.mount("http://bench.invalid/", _PageAdapter(page.html))
+                cases.append((
+                    "fetch",
+                    backend,
+                    "lessons",
+                    lambda client=client: len(client.fetch_schedule(*ids)["lessons"]),  # type: ignore[index]
+                ))
+    return cases
+
+
+def _available_backends() -> List[str]:
+    backends = []
+    for backend in BACKENDS:
+        if backend == "lxml":
+            try:
+                import lxml  # noqa: F401
+            except ImportError:
+                continue
+        backends.append(backend)
+    return backends
+
+
+def measure(
+    benchmark: str,
+    page: Page,
+    variant: str,
+    unit: str,
+    run: Callable[[], int],
+    min_time: float = DEFAULT_MIN_TIME,
+) -> Result:
+    """Time ``run`` for at least ``min_time`` seconds, then trace one more call."""
+    items = run()  # warm-up, and the item count
+    times: List[float] = []
+    deadline = time.perf_counter() + min_time
+    while len(times) < 3 or time.perf_counter() < deadline:
+        started = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - started)
+    peak, retained, blocks = _traced(run)
+    return Result(
+        benchmark=benchmark,
+        page=page.name,
+        variant=variant,
+        unit=unit,
+        items=items,
+        iterations=len(times),
+        median_s=statistics.median(times),
+        best_s=min(times),
+        mean_s=statistics.fmean(times),
+        page_bytes=len(page.html.encode("utf-8")),
+        peak_bytes=peak,
+        retained_bytes=retained,
+        retained_blocks=blocks,
+    )
+
+
+def _traced(run: Callable[[], int]) -> Tuple[int, int, int]:
+    """Peak bytes during one call, and bytes and blocks still allocated after it."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        run()
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    return peak - base, current - base, blocks
+
+
+def run_benchmarks(
+    pages: Sequence[Page],
+    benchmarks: Sequence[str] = BENCHMARKS,
+    min_time: float = DEFAULT_MIN_TIME,
+    progress: Optional[Callable[[Result], None]] = None,
+) -> List[Result]:
+    results = []
+    for page in pages:
+        for benchmark, variant, unit, run in _cases(page, benchmarks):
+            result = measure(benchmark, page, variant, unit, run, min_time)
+            results.append(result)
+            if progress:
+                progress(result)
+    return results
+
+
+# -- reporting ----------------------------------------------------------------
+
+
+def to_json(results: Sequence[Result], corpus: str) -> Dict[str, Any]:
+    return {
+        "format": FORMAT_VERSION,
+        "created_at": dt.datetime.now(dt.timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": corpus,
+        "results": [result.as_dict() for result in results],
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).resolve().parent,
+            timeout=5,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def _row(result: Result) -> str:
+    name = f"{result.benchmark}{'/' + result.variant if result.variant else ''}"
+    return (
+        f"{name:<14} {result.page:<10} {result.items:>7} {result.unit:<8} "
+        f"{result.median_s * 1000:>10.3f} {1 / result.median_s:>9.1f} "
+        f"{result.items / result.median_s:>11.0f} {result.peak_bytes / 1024:>10.0f} "
+        f"{result.retained_blocks:>8}"
+    )
+
+
+_HEADER = (
+    f"{'benchmark':<14} {'page':<10} {'items':>7} {'':<8} {'median ms':>10} {'pages/s':>9} "
+    f"{'items/s':>11} {'peak KiB':>10} {'blocks':>8}"
+)
+
+
+def compare(results: Sequence[Result], baseline: Dict[str, Any]) -> List[str]:
+    """Lines comparing items/s and peak memory with a run saved by ``-o``."""
+    previous = {
+        (item["benchmark"], item["page"], item["variant"]): item for item in baseline["results"]
+    }
+    lines = [
+        f"{'benchmark':<14} {'page':<10} {'items/s before':>15} {'after':>11} {'speed-up':>9} "
+        f"{'peak before':>12} {'after':>10}"
+    ]
+    for result in results:
+        old = previous.get(result.key)
+        if old is None or not old.get("items_per_s"):
+            continue
+        new_rate = result.items / result.median_s
+        name = f"{result.benchmark}{'/' + result.variant if result.variant else ''}"
+        lines.append(
+            f"{name:<14} {result.page:<10} {old['items_per_s']:>15.0f} {new_rate:>11.0f} "
+            f"{new_rate / old['items_per_s']:>8.2f}x {old['peak_bytes'] / 1024:>11.0f}K "
+            f"{result.peak_bytes / 1024:>9.0f}K"
+        )
+    return lines
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    cli = argparse.ArgumentParser(description="Benchmark schedule parsing offline")
+    cli.add_argument("--corpus", type=Path, help="directory of recorded .html pages (default: synthetic)")
+    cli.add_argument(
+        "--record",
+        type=Path,
+        metavar="DIR",
+        help="fetch small/week/semester pages from upstream into DIR and exit",
+    )
+    cli.add_argument(
+        "--base-url",
+        default=BASE_URL,
+        help="upstream URL for --record, e.g. a local parser.upstream_sim (default: the real site)",
+    )
+    cli.add_argument("--group", help="FACULTY/COURSE/GROUP ids to record (default: the first group)")
+    cli.add_argument(
+        "--only",
+        action="append",
+        choices=BENCHMARKS,
+        help="run only this benchmark (repeatable)",
+    )
+    cli.add_argument(
+        "--min-time",
+        type=float,
+        default=DEFAULT_MIN_TIME,
+        help=f"seconds to repeat each case for (default: {DEFAULT_MIN_TIME})",
+    )
+    cli.add_argument("-o", "--output", type=Path, help="save results as JSON")
+    cli.add_argument("--compare", type=Path, help="JSON saved by an earlier run to compare against")
+    args = cli.parse_args(argv)
+
+    if args.record:
+        group = tuple(args.group.split("/")) if args.group else None
+        if group is not None and len(group) != 3:
+            cli.error("--group takes FACULTY/COURSE/GROUP")
+        for path in record_corpus(args.record, args.base_url, group):  # type: ignore[arg-type]
+            print(f"Recorded {path}")
+        return
+
+    baseline = json.loads(args.compare.read_text(encoding="utf-8")) if args.compare else None
+    pages = load_corpus(args.corpus) if args.corpus else synthetic_corpus()
+    print(_HEADER)
+    results = run_benchmarks(
+        pages,
+        args.only or BENCHMARKS,
+        args.min_time,
+        progress=lambda result: print(_row(result), flush=True),
+    )
+    if baseline is not None:
+        print()
+        print("\n".join(compare(results, baseline)))
+    if args.output:
+        payload = to_json(results, str(args.corpus) if args.corpus else "synthetic")
+        args.output.write_text(json.dumps(payload, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+        print(f"Results saved to {args.output}", file=sys.stderr)
+
+
+__all__ = [
+    "BENCHMARKS",
+    "Page",
+    "Result",
+    "load_corpus",
+    "measure",
+    "record_corpus",
+    "run_benchmarks",
+    "synthetic_corpus",
+]
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,41 @@
 from __future__ import annotations
 
+import argparse
 import json
+import os
+import re
 import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import date, datetime, timedelta
 import calendar
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 if str(BASE_DIR) not in sys.path:
     sys.path.insert(0, str(BASE_DIR))
 
-from parser.spa_client import SpaScheduleClient  # noqa: E402
+from parser.governor import CRAWL, GOVERNOR, UpstreamGovernor, lane, set_lane  # noqa: E402
+from parser.lesson_store import LessonStore, StoredGroup  # noqa: E402
+from parser.lesson_table import memory_report  # noqa: E402
+from parser.shared_slots import DEFAULT_LIMIT, SharedSlots  # noqa: E402
+from parser.snapshot import load_snapshot  # noqa: E402
+from parser.spa_client import BASE_URL, OptionItem, SpaScheduleClient  # noqa: E402
+from parser.windows import DEFAULT_WORKERS, WINDOWS  # noqa: E402
 
 CACHE_PATH = BASE_DIR / "data" / "cache.json"
+STORE_PATH = BASE_DIR / "data" / "cache.sqlite3"
+# Upstream request slots shared by the crawl and the servers on this host.
+SLOTS_PATH = BASE_DIR / "data" / "upstream.sqlite3"
+# How long lesson changes are kept for /schedule/changes delta sync.
+CHANGE_LOG_DAYS = 60
 DEFAULT_DAYS = 7
+# Whole-range pages take a while even on a healthy upstream; only answers
+# slower than this make the crawl back off.
+CRAWL_LATENCY_TARGET = 15.0
 
 
 @dataclass
@@ -29,6 +49,31 @@ class GroupSchedule:
     date_from: date
     date_to: date
     lessons: List[dict]
+    failed: bool = False
+
+
+@dataclass
+class PreviousGroup:
+    """A group entry from an earlier snapshot together with its serialized text."""
+
+    entry: dict
+    raw: str
+
+
+@dataclass
+class RebuildReport:
+    changed: int = 0
+    unchanged: int = 0
+    reused: int = 0
+    removed: int = 0
+    failed: int = 0
+
+    def summary(self) -> str:
+        return (
+            f"{self.changed} groups changed, {self.unchanged} unchanged "
+            f"({self.reused} left as is), "
+            f"{self.removed} removed, {self.failed} failed and kept from previous snapshot"
+        )
 
 
 def _shift_months(base: date, months: int) -> date:
@@ -52,9 +97,96 @@ def daterange(days: int = DEFAULT_DAYS) -> tuple[date, date]:
     return start, end
 
 
-def build_cache(days: int = DEFAULT_DAYS) -> tuple[Dict[str, GroupSchedule], List[dict]]:
-    client = SpaScheduleClient()
+def build_cache(
+    days: int = DEFAULT_DAYS,
+    concurrency: int = 1,
+    window: Optional[str] = None,
+    window_workers: int = DEFAULT_WORKERS,
+    base_url: str = BASE_URL,
+    governor: UpstreamGovernor = GOVERNOR,
+) -> tuple[Dict[str, GroupSchedule], List[dict]]:
+    """Crawl every faculty/course/group and return schedules plus the options tree.
+
+    With ``concurrency > 1`` the crawl runs on a bounded pool of worker
+    threads, each owning an independent ``SpaScheduleClient`` (and therefore
+    its own session and CSRF state). Results are identical to the sequential
+    crawl, including ordering.
+
+    With ``window`` ("month" or "week") each group's range is fetched as
+    that many windows on up to ``window_workers`` extra sessions, so a
+    slow or failed month does not cost the whole range.
+
+    ``base_url`` points the crawl at another timetable form, e.g. the local
+    simulator in :mod:`parser.upstream_sim`.
+
+    All upstream requests go through ``governor`` in the crawl lane, so
+    they back off when answers get slow or fail, and pause instead of
+    marking every group failed while upstream keeps failing. Called inside
+    a server, the default process-wide :data:`~parser.governor.GOVERNOR`
+    (or the server's own governor, if passed) puts the crawl behind that
+    process's user requests. A governor only orders the requests of its own
+    process: a crawl in another process competes with the servers unless
+    both governors share a slot table (see :func:`crawl_governor` and
+    :mod:`parser.shared_slots`).
+    """
     start, end = daterange(days)
+    timings: List[Tuple[str, float]] = []
+    fetch_options = {"window": window, "workers": window_workers}
+
+    def new_client() -> SpaScheduleClient:
+        return SpaScheduleClient(base_url, governor)
+
+    with lane(CRAWL):
+        if concurrency <= 1:
+            groups_data, options_tree = _crawl_sequential(
+                new_client, start, end, timings, fetch_options
+            )
+        else:
+            groups_data, options_tree = _crawl_concurrent(
+                new_client, start, end, concurrency, timings, fetch_options
+            )
+    _report_timings(timings)
+    print(f"Upstream governor: {json.dumps(governor.stats())}")
+    return groups_data, options_tree
+
+
+def crawl_governor(
+    concurrency: int = 1,
+    window: Optional[str] = None,
+    window_workers: int = DEFAULT_WORKERS,
+    latency_target: float = CRAWL_LATENCY_TARGET,
+    shared: Optional[SharedSlots] = None,
+) -> UpstreamGovernor:
+    """Governor of a standalone crawl: up to every session at once.
+
+    With ``shared`` (the servers' slot table), the crawl's requests also
+    count against the budget of all processes and yield to their user
+    requests.
+    """
+    sessions = max(concurrency, 1) * (window_workers if window else 1)
+    return UpstreamGovernor(
+        limit=sessions, max_limit=sessions, latency_target=latency_target, shared=shared
+    )
+
+
+def _crawl_sequential(
+    new_client: Callable[[], SpaScheduleClient],
+    start: date,
+    end: date,
+    timings: List[Tuple[str, float]],
+    fetch_options: Dict[str, object],
+) -> tuple[Dict[str, GroupSchedule], List[dict]]:
+    with new_client() as client:
+        return _crawl_tree(client, start, end, timings, fetch_options)
+
+
+def _crawl_tree(
+    client: SpaScheduleClient,
+    start: date,
+    end: date,
+    timings: List[Tuple[str, float]],
+    fetch_options: Dict[str, object],
+) -> tuple[Dict[str, GroupSchedule], List[dict]]:
     groups_data: Dict[str, GroupSchedule] = {}
     options_tree: List[dict] = []
 
@@ -71,41 +203,163 @@ def build_cache(days: int = DEFAULT_DAYS) -> tuple[Dict[str, GroupSchedule], Lis
             groups = client.list_groups(faculty.id, course.id)
             for group in groups:
                 course_entry["groups"].append({"id": group.id, "name": group.name})
-                try:
-                    result = client.fetch_schedule(
-                        faculty_id=faculty.id,
-                        course=course.id,
-                        group_id=group.id,
-                        date_from=start,
-                        date_to=end,
-                    )
-                    lessons = result.get("lessons", [])
-                except Exception as exc:  # noqa: BLE001
-                    print(
-                        f"Failed to fetch schedule for {faculty.name} / {course.name} / {group.name}: {exc}"
-                    )
-                    lessons = []
-                groups_data[group.id] = GroupSchedule(
-                    faculty_id=faculty.id,
-                    faculty_name=faculty.name,
-                    course_id=course.id,
-                    course_name=course.name,
-                    group_id=group.id,
-                    group_name=group.name,
-                    date_from=start,
-                    date_to=end,
-                    lessons=lessons,
+                groups_data[group.id] = _fetch_group(
+                    client, faculty, course, group, start, end, timings, fetch_options
                 )
     return groups_data, options_tree
 
 
+def _crawl_concurrent(
+    new_client: Callable[[], SpaScheduleClient],
+    start: date,
+    end: date,
+    concurrency: int,
+    timings: List[Tuple[str, float]],
+    fetch_options: Dict[str, object],
+) -> tuple[Dict[str, GroupSchedule], List[dict]]:
+    local = threading.local()
+    # One client per worker thread, reused across groups (window siblings
+    # included) and closed when the crawl is done.
+    clients: List[SpaScheduleClient] = []
+
+    def worker_client() -> SpaScheduleClient:
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = new_client()
+            clients.append(client)
+        return client
+
+    def list_courses(faculty: OptionItem) -> List[OptionItem]:
+        return worker_client().list_courses(faculty.id)
+
+    def list_groups(faculty: OptionItem, course: OptionItem) -> List[OptionItem]:
+        return worker_client().list_groups(faculty.id, course.id)
+
+    def fetch(faculty: OptionItem, course: OptionItem, group: OptionItem) -> GroupSchedule:
+        return _fetch_group(
+            worker_client(), faculty, course, group, start, end, timings, fetch_options
+        )
+
+    groups_data: Dict[str, GroupSchedule] = {}
+    options_tree: List[dict] = []
+
+    try:
+        with ThreadPoolExecutor(
+            max_workers=concurrency, initializer=set_lane, initargs=(CRAWL,)
+        ) as pool:
+            with new_client() as client:
+                faculties = client.list_faculties()
+            course_futures = [pool.submit(list_courses, faculty) for faculty in faculties]
+            course_lists = [future.result() for future in course_futures]
+
+            group_futures = {
+                (faculty.id, course.id): pool.submit(list_groups, faculty, course)
+                for faculty, courses in zip(faculties, course_lists)
+                for course in courses
+            }
+
+            # Submit every schedule fetch before waiting on any of them, but walk
+            # the tree in crawl order afterwards so the output matches the
+            # sequential path exactly.
+            schedule_futures: List[Tuple[str, "Future[GroupSchedule]"]] = []
+            for faculty, courses in zip(faculties, course_lists):
+                faculty_entry = {"id": faculty.id, "name": faculty.name, "courses": []}
+                options_tree.append(faculty_entry)
+                for course in courses:
+                    course_entry = {"id": course.id, "name": course.name, "groups": []}
+                    faculty_entry["courses"].append(course_entry)
+                    for group in group_futures[(faculty.id, course.id)].result():
+                        course_entry["groups"].append({"id": group.id, "name": group.name})
+                        schedule_futures.append(
+                            (group.id, pool.submit(fetch, faculty, course, group))
+                        )
+
+            for group_id, future in schedule_futures:
+                groups_data[group_id] = future.result()
+    finally:
+        # The executor has shut down, so no worker uses its client any more.
+        for client in clients:
+            client.close()
+    return groups_data, options_tree
+
+
+def _fetch_group(
+    client: SpaScheduleClient,
+    faculty: OptionItem,
+    course: OptionItem,
+    group: OptionItem,
+    start: date,
+    end: date,
+    timings: List[Tuple[str, float]],
+    fetch_options: Dict[str, object],
+) -> GroupSchedule:
+    started = time.perf_counter()
+    try:
+        result = client.fetch_schedule(
+            faculty_id=faculty.id,
+            course=course.id,
+            group_id=group.id,
+            date_from=start,
+            date_to=end,
+            **fetch_options,  # type: ignore[arg-type]
+        )
+        lessons = result.get("lessons", [])
+        failed = False
+    except Exception as exc:  # noqa: BLE001
+        print(
+            f"Failed to fetch schedule for {faculty.name} / {course.name} / {group.name}: {exc}"
+        )
+        lessons = []
+        failed = True
+    timings.append((f"{faculty.name} / {course.name} / {group.name}", time.perf_counter() - started))
+    return GroupSchedule(
+        faculty_id=faculty.id,
+        faculty_name=faculty.name,
+        course_id=course.id,
+        course_name=course.name,
+        group_id=group.id,
+        group_name=group.name,
+        date_from=start,
+        date_to=end,
+        lessons=lessons,
+        failed=failed,
+    )
+
+
+def _report_timings(timings: List[Tuple[str, float]], slowest: int = 5) -> None:
+    if not timings:
+        return
+    durations = sorted(duration for _, duration in timings)
+    total = sum(durations)
+    p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+    print(
+        f"Fetched {len(durations)} groups: total {total:.1f}s, "
+        f"mean {total / len(durations):.2f}s, p50 {durations[len(durations) // 2]:.2f}s, "
+        f"p95 {p95:.2f}s, max {durations[-1]:.2f}s"
+    )
+    for label, duration in sorted(timings, key=lambda item: item[1], reverse=True)[:slowest]:
+        print(f"  {duration:6.2f}s  {label}")
+
+
 def dump_cache(
     cache: Dict[str, GroupSchedule],
     options_tree: List[dict],
     path: Path = CACHE_PATH,
-) -> None:
+    previous: Optional[Dict[str, PreviousGroup]] = None,
+) -> RebuildReport:
+    """Write the snapshot, reusing untouched groups from ``previous``.
+
+    A group is unchanged when its set of lesson ids (the content hashes from
+    ``parse_html_schedule``) matches the previous snapshot. Unchanged groups
+    keep their ``last_changed`` timestamp, and when their metadata is also the
+    same their previously serialized JSON is copied verbatim. Groups whose
+    fetch failed keep their previous entry. The output is byte-for-byte what
+    ``json.dumps(payload, ensure_ascii=False, indent=2)`` would produce.
+    """
+    previous = previous or {}
+    report = RebuildReport(removed=len(previous.keys() - cache.keys()))
     generated_at = datetime.utcnow().isoformat() + "Z"
-    payload = {
+    head = {
         "generated_at": generated_at,
         "date_from": next(iter(cache.values())).date_from.isoformat() if cache else None,
         "date_to": next(iter(cache.values())).date_to.isoformat() if cache else None,
@@ -113,33 +367,313 @@ def dump_cache(
             "generated_at": generated_at,
             "faculties": options_tree,
         },
-        "groups": {
-            group_id: {
-                "faculty_id": entry.faculty_id,
-                "faculty_name": entry.faculty_name,
-                "course_id": entry.course_id,
-                "course_name": entry.course_name,
-                "group_id": entry.group_id,
-                "group_name": entry.group_name,
-                "date_from": entry.date_from.isoformat(),
-                "date_to": entry.date_to.isoformat(),
-                "lessons": entry.lessons,
-            }
-            for group_id, entry in cache.items()
-        },
     }
+
+    fragments: List[str] = []
+    for group_id, entry in cache.items():
+        prev = previous.get(group_id)
+        if prev is not None and entry.failed:
+            report.failed += 1
+            raw = prev.raw
+        elif prev is not None and _lesson_ids(prev.entry["lessons"]) == _lesson_ids(entry.lessons):
+            report.unchanged += 1
+            serialized = _group_entry(entry, prev.entry.get("last_changed") or generated_at)
+            if serialized == prev.entry:
+                report.reused += 1
+                raw = prev.raw
+            else:
+                raw = _serialize_group(serialized)
+        else:
+            report.changed += 1
+            raw = _serialize_group(_group_entry(entry, generated_at))
+        fragments.append(f"    {json.dumps(group_id, ensure_ascii=False)}: {raw}")
+
+    text = json.dumps(head, ensure_ascii=False, indent=2)[:-2]
+    groups_text = "{\n" + ",\n".join(fragments) + "\n  }" if fragments else "{}"
     path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    # Write next to the target and rename so readers never see a partial file.
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(f'{text},\n  "groups": {groups_text}\n}}', encoding="utf-8")
+    os.replace(tmp_path, path)
+    return report
+
+
+def dump_store(
+    cache: Dict[str, GroupSchedule],
+    options_tree: List[dict],
+    store: LessonStore,
+) -> RebuildReport:
+    """Write the crawl into ``store``, touching only groups that changed.
+
+    Follows the same rules as :func:`dump_cache` with the store as the
+    previous snapshot; rewritten groups log their lesson-level changes,
+    which are kept for ``CHANGE_LOG_DAYS``. Each group is its own
+    transaction; the options tree and ``generated_at`` are committed last,
+    which is what readers use to notice a finished rebuild.
+    """
+    generated_at = datetime.utcnow().isoformat() + "Z"
+    stale = store.group_ids() - cache.keys()
+    report = RebuildReport(removed=len(stale))
+    for group_id, entry in cache.items():
+        prev = store.group(group_id)
+        if prev is not None and entry.failed:
+            report.failed += 1
+        elif prev is not None and store.lesson_ids(group_id) == _lesson_ids(entry.lessons):
+            report.unchanged += 1
+            stored = _stored_group(entry, prev.last_changed or generated_at)
+            if stored == prev:
+                report.reused += 1
+            else:
+                store.write_group(stored)
+        else:
+            report.changed += 1
+            store.write_group(_stored_group(entry, generated_at), entry.lessons)
+    store.delete_groups(stale)
+    store.prune_changes((datetime.utcnow() - timedelta(days=CHANGE_LOG_DAYS)).isoformat() + "Z")
+    first = next(iter(cache.values()), None)
+    store.write_meta(
+        date_from=first.date_from.isoformat() if first else None,
+        date_to=first.date_to.isoformat() if first else None,
+        options=options_tree,
+        generated_at=generated_at,
+    )
+    return report
+
+
+def load_previous(path: Path = CACHE_PATH) -> Dict[str, PreviousGroup]:
+    """Read group entries and their raw JSON text from an existing snapshot."""
+    if not path.exists():
+        return {}
+    text = path.read_text(encoding="utf-8")
+    groups: Dict[str, PreviousGroup] = {}
+
+    def read_group(key: str, start: int) -> Tuple[PreviousGroup, int]:
+        entry, end = _DECODER.raw_decode(text, start)
+        return PreviousGroup(entry=entry, raw=text[start:end]), end
 
+    def read_top(key: str, start: int) -> Tuple[object, int]:
+        if key == "groups":
+            parsed, end = _read_object(text, start, read_group)
+            groups.update(parsed)
+            return None, end
+        return _DECODER.raw_decode(text, start)
 
-def main(days: Optional[int] = None) -> None:
+    _read_object(text, _skip_ws(text, 0), read_top)
+    return groups
+
+
+_DECODER = json.JSONDecoder()
+_WS_RE = re.compile(r"\s*")
+T = TypeVar("T")
+
+
+def _skip_ws(text: str, idx: int) -> int:
+    return _WS_RE.match(text, idx).end()  # type: ignore[union-attr]
+
+
+def _read_object(
+    text: str,
+    idx: int,
+    read_value: Callable[[str, int], Tuple[T, int]],
+) -> Tuple[Dict[str, T], int]:
+    """Walk the JSON object at ``text[idx]``, delegating each value to ``read_value``."""
+    if text[idx] != "{":
+        raise ValueError(f"Expected JSON object at offset {idx}")
+    members: Dict[str, T] = {}
+    idx = _skip_ws(text, idx + 1)
+    if text[idx] == "}":
+        return members, idx + 1
+    while True:
+        key, idx = _DECODER.raw_decode(text, idx)
+        idx = _skip_ws(text, idx)
+        if text[idx] != ":":
+            raise ValueError(f"Expected ':' at offset {idx}")
+        members[key], idx = read_value(key, _skip_ws(text, idx + 1))
+        idx = _skip_ws(text, idx)
+        if text[idx] == "}":
+            return members, idx + 1
+        if text[idx] != ",":
+            raise ValueError(f"Expected ',' at offset {idx}")
+        idx = _skip_ws(text, idx + 1)
+
+
+def _group_entry(entry: GroupSchedule, last_changed: str) -> dict:
+    return {
+        "faculty_id": entry.faculty_id,
+        "faculty_name": entry.faculty_name,
+        "course_id": entry.course_id,
+        "course_name": entry.course_name,
+        "group_id": entry.group_id,
+        "group_name": entry.group_name,
+        "date_from": entry.date_from.isoformat(),
+        "date_to": entry.date_to.isoformat(),
+        "last_changed": last_changed,
+        "lessons": entry.lessons,
+    }
+
+
+def _stored_group(entry: GroupSchedule, last_changed: str) -> StoredGroup:
+    return StoredGroup(
+        faculty_id=entry.faculty_id,
+        faculty_name=entry.faculty_name,
+        course_id=entry.course_id,
+        course_name=entry.course_name,
+        group_id=entry.group_id,
+        group_name=entry.group_name,
+        date_from=entry.date_from,
+        date_to=entry.date_to,
+        last_changed=last_changed,
+    )
+
+
+def _serialize_group(entry: dict) -> str:
+    # Groups sit two levels deep in the snapshot; JSON strings never contain
+    # raw newlines, so re-indenting line breaks is safe.
+    return json.dumps(entry, ensure_ascii=False, indent=2).replace("\n", "\n    ")
+
+
+def _lesson_ids(lessons: List[dict]) -> set:
+    return {lesson.get("id") for lesson in lessons}
+
+
+def main(
+    days: Optional[int] = None,
+    concurrency: int = 1,
+    incremental: bool = False,
+    output_format: str = "sqlite",
+    window: Optional[str] = None,
+    window_workers: int = DEFAULT_WORKERS,
+    base_url: str = BASE_URL,
+    latency_target: float = CRAWL_LATENCY_TARGET,
+    slots_path: Optional[Path] = SLOTS_PATH,
+    shared_limit: int = DEFAULT_LIMIT,
+) -> None:
     period = days or DEFAULT_DAYS
     print(f"Building schedule cache for {period} days…")
-    cache, options_tree = build_cache(period)
-    dump_cache(cache, options_tree)
-    print(f"Cache stored at {CACHE_PATH}")
+    governor = crawl_governor(
+        concurrency,
+        window,
+        window_workers,
+        latency_target,
+        shared=SharedSlots(slots_path, limit=shared_limit) if slots_path else None,
+    )
+    if output_format == "json":
+        previous = load_previous(CACHE_PATH) if incremental else None
+        cache, options_tree = build_cache(
+            period,
+            concurrency=concurrency,
+            window=window,
+            window_workers=window_workers,
+            base_url=base_url,
+            governor=governor,
+        )
+        report = dump_cache(cache, options_tree, previous=previous)
+        if incremental:
+            print(report.summary())
+        print(f"Cache stored at {CACHE_PATH}")
+        return
+    cache, options_tree = build_cache(
+        period,
+        concurrency=concurrency,
+        window=window,
+        window_workers=window_workers,
+        base_url=base_url,
+        governor=governor,
+    )
+    report = dump_store(cache, options_tree, LessonStore(STORE_PATH))
+    print(report.summary())
+    print(f"Cache stored at {STORE_PATH}")
+
+
+def print_memory_report(path: Path) -> None:
+    """Compare the lessons of an existing snapshot as dicts and as a LessonTable."""
+    snapshot = load_snapshot(path)
+    if snapshot is None:
+        raise SystemExit(f"No snapshot at {path}")
+    lessons = [lesson for _, lesson in snapshot.iter_lessons()]
+    print(json.dumps(memory_report(lessons), indent=2))
 
 
 if __name__ == "__main__":
-    days_arg = int(sys.argv[1]) if len(sys.argv) > 1 else None
-    main(days_arg)
+    cli = argparse.ArgumentParser(description="Build the schedule cache from cacs.spa.msu.ru")
+    cli.add_argument("days", nargs="?", type=int, default=None)
+    cli.add_argument(
+        "-j",
+        "--concurrency",
+        type=int,
+        default=1,
+        help="number of parallel upstream sessions (default: 1, sequential)",
+    )
+    cli.add_argument(
+        "--window",
+        choices=WINDOWS,
+        help="fetch each group's range as monthly or weekly windows in parallel "
+        "(default: one request per group)",
+    )
+    cli.add_argument(
+        "--window-workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"parallel sessions per group with --window (default: {DEFAULT_WORKERS})",
+    )
+    cli.add_argument(
+        "--base-url",
+        default=BASE_URL,
+        help="timetable form to crawl, e.g. a local parser.upstream_sim "
+        f"(default: {BASE_URL})",
+    )
+    cli.add_argument(
+        "--latency-target",
+        type=float,
+        default=CRAWL_LATENCY_TARGET,
+        help="seconds per upstream answer above which the crawl reduces its "
+        f"parallel requests (default: {CRAWL_LATENCY_TARGET:g})",
+    )
+    cli.add_argument(
+        "--shared-slots",
+        default=os.environ.get("SCHEDULE_UPSTREAM_SLOTS_PATH", str(SLOTS_PATH)),
+        help="slot table shared with the API servers, so the crawl yields to their "
+        "user requests; an empty value crawls without coordinating "
+        "(default: $SCHEDULE_UPSTREAM_SLOTS_PATH or data/upstream.sqlite3)",
+    )
+    cli.add_argument(
+        "--shared-limit",
+        type=int,
+        default=int(os.environ.get("SCHEDULE_UPSTREAM_SHARED_LIMIT", str(DEFAULT_LIMIT))),
+        help="upstream requests of all processes sharing the slot table at once; "
+        f"use the servers' value (default: $SCHEDULE_UPSTREAM_SHARED_LIMIT or {DEFAULT_LIMIT})",
+    )
+    cli.add_argument(
+        "--format",
+        choices=("sqlite", "json"),
+        default="sqlite",
+        help="write the indexed SQLite store (default) or the legacy data/cache.json",
+    )
+    cli.add_argument(
+        "--incremental",
+        action="store_true",
+        help="json only: compare with the existing snapshot and only rewrite groups "
+        "whose lessons changed (the SQLite store is always updated incrementally)",
+    )
+    cli.add_argument(
+        "--memory-report",
+        action="store_true",
+        help="do not crawl; report the memory the existing snapshot's lessons take "
+        "as dicts and as the compact in-memory table",
+    )
+    args = cli.parse_args()
+    if args.memory_report:
+        print_memory_report(CACHE_PATH if args.format == "json" else STORE_PATH)
+        raise SystemExit
+    main(
+        args.days,
+        concurrency=args.concurrency,
+        incremental=args.incremental,
+        output_format=args.format,
+        window=args.window,
+        window_workers=args.window_workers,
+        base_url=args.base_url,
+        latency_target=args.latency_target,
+        slots_path=Path(args.shared_slots) if args.shared_slots else None,
+        shared_limit=args.shared_limit,
+    )
@@ -0,0 +1,97 @@
+"""Lesson-level change tracking for delta sync of group schedules.
+
+Lessons are matched by :func:`~parser.parse_html_schedule.lesson_key`,
+which ignores ``notes``: a lesson whose note was edited is reported as
+modified rather than removed and re-added. Lessons that share a key (two
+identical rows in one timetable) are told apart by their position among
+the duplicates.
+"""
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .parse_html_schedule import lesson_key
+
+ADDED = "added"
+REMOVED = "removed"
+MODIFIED = "modified"
+
+Change = Tuple[str, str, dict]  # (op, key, lesson)
+
+
+def keyed(lessons: Iterable[dict]) -> Dict[str, dict]:
+    """Map sync keys to lessons, preserving order."""
+    result: Dict[str, dict] = {}
+    for lesson in lessons:
+        base = lesson_key(lesson)
+        key, n = base, 1
+        while key in result:
+            key, n = f"{base}:{n}", n + 1
+        result[key] = lesson
+    return result
+
+
+def diff(old: Iterable[dict], new: Iterable[dict]) -> List[Change]:
+    """Changes turning ``old`` into ``new``; removals carry the old lesson."""
+    before, after = keyed(old), keyed(new)
+    changes: List[Change] = [(REMOVED, key, lesson) for key, lesson in before.items() if key not in after]
+    for key, lesson in after.items():
+        previous = before.get(key)
+        if previous is None:
+            changes.append((ADDED, key, lesson))
+        elif previous.get("id") != lesson.get("id"):
+            changes.append((MODIFIED, key, lesson))
+    return changes
+
+
+def sync_payload(
+    group: Dict[str, Optional[str]],
+    version: int,
+    *,
+    lessons: Optional[Iterable[dict]] = None,
+    changes: Iterable[Change] = (),
+) -> Dict[str, object]:
+    """Response body of ``/schedule/changes``.
+
+    With ``lessons`` it is a full resync (``full`` is true and every lesson
+    is listed); otherwise ``changes`` in log order are collapsed into their
+    net effect since the client's version. Lessons carry their sync
+    ``key``; removals list only ``key`` and the last known ``id``.
+    """
+    payload: Dict[str, object] = {
+        "group": group,
+        "version": str(version),
+        "full": lessons is not None,
+        "lessons": [],
+        "added": [],
+        "modified": [],
+        "removed": [],
+    }
+    if lessons is not None:
+        payload["lessons"] = [{**lesson, "key": key} for key, lesson in keyed(lessons).items()]
+        return payload
+
+    # For every key: did the client have it, and what is its state now?
+    net: Dict[str, Tuple[bool, Change]] = {}
+    for change in changes:
+        op, key, _ = change
+        existed = net[key][0] if key in net else op != ADDED
+        net[key] = (existed, change)
+    for key, (existed, (op, _, lesson)) in net.items():
+        exists = op != REMOVED
+        if existed and not exists:
+            payload["removed"].append({"key": key, "id": lesson.get("id")})  # type: ignore[union-attr]
+        elif exists:
+            bucket = "modified" if existed else "added"
+            payload[bucket].append({**lesson, "key": key})  # type: ignore[union-attr]
+    return payload
+
+
+def parse_version(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+__all__ = ["ADDED", "MODIFIED", "REMOVED", "diff", "keyed", "parse_version", "sync_payload"]
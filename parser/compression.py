@@ -0,0 +1,155 @@
+"""Precompressed response bodies with Accept-Encoding negotiation.
+
+Bodies of snapshot-served responses are keyed by their ETag (see
+:mod:`parser.conditional`), which changes with the snapshot version, so each
+encoding of a body is produced once and then served as stored bytes.
+"""
+from __future__ import annotations
+
+import gzip
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
+from .conditional import Validators
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Each body is compressed once per snapshot version, so favour ratio over
+# speed (brotli's 10-11 are ~25x slower than 9 for a few percent).
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+IDENTITY = "identity"
+
+
+def available_encodings() -> tuple:
+    """Supported content codings, most preferred first."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding: Optional[str]) -> str:
+    """Pick the best supported coding from an Accept-Encoding header."""
+    if not accept_encoding:
+        return IDENTITY
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+    best, best_weight = IDENTITY, 0.0
+    for encoding in available_encodings():
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        # mtime=0 keeps the output byte-identical across processes and runs.
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == IDENTITY:
+        return body
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def body_headers(validators: Validators, encoding: str) -> Dict[str, str]:
+    """Response headers of a stored body in ``encoding``.
+
+    Each coding carries its own ETag (see :meth:`Validators.encoded`).
+    GZipMiddleware leaves bodies that already have a Content-Encoding alone,
+    so Vary is added here for those; identity bodies get it from the
+    middleware.
+    """
+    headers = validators.encoded(encoding).headers()
+    if encoding != IDENTITY:
+        headers.update({"Content-Encoding": encoding, "Vary": "Accept-Encoding"})
+    return headers
+
+
+class BodyCache:
+    """LRU of response bodies and their encodings, bounded by total size.
+
+    :meth:`get` is the cheap path and only returns an encoding that is
+    already stored. :meth:`fill` is the slow path: it renders the identity
+    body (unless stored), compresses it and stores both. Async callers
+    should run ``fill`` in a worker thread.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Dict[str, bytes]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "renders": 0, "compressions": 0, "evictions": 0}
+
+    def get(self, key: Hashable, encoding: str) -> Optional[bytes]:
+        with self._lock:
+            body = self._entries.get(key, {}).get(encoding)
+            if body is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["hits"] += 1
+            self._entries.move_to_end(key)
+            return body
+
+    def fill(
+        self, key: Hashable, encoding: str, render: Callable[[], Optional[bytes]]
+    ) -> Optional[bytes]:
+        """Produce, store and return ``encoding`` of the body; None if ``render`` is."""
+        with self._lock:
+            variants = self._entries.get(key, {})
+            body = variants.get(encoding)
+            identity = variants.get(IDENTITY)
+        if body is not None:
+            return body
+        rendered = identity is None
+        if identity is None:
+            identity = render()
+            if identity is None:
+                return None
+        body = compress(identity, encoding)
+        with self._lock:
+            self._counters["renders"] += rendered
+            variants = self._entries.setdefault(key, {})
+            self._entries.move_to_end(key)
+            for name, value in ((IDENTITY, identity), (encoding, body)):
+                if name not in variants:
+                    variants[name] = value
+                    self._size += len(value)
+            if encoding != IDENTITY:
+                self._counters["compressions"] += 1
+            self._evict()
+        return body
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries), "bytes": self._size}
+
+    def _evict(self) -> None:
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            _, variants = self._entries.popitem(last=False)
+            self._size -= sum(len(body) for body in variants.values())
+            self._counters["evictions"] += 1
+
+
+__all__ = [
+    "BodyCache",
+    "IDENTITY",
+    "available_encodings",
+    "body_headers",
+    "compress",
+    "negotiate",
+]
@@ -0,0 +1,158 @@
+"""ETag / Last-Modified validators for conditional GET requests."""
+from __future__ import annotations
+
+import datetime as dt
+import hashlib
+from dataclasses import dataclass, replace
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, Iterable, Mapping, Optional
+
+# Clients may keep responses but must revalidate them on every use.
+CACHE_CONTROL = "no-cache"
+# Content codings whose stored bodies get their own ETag (see Validators.encoded).
+_CODINGS = ("br", "gzip")
+
+
+@dataclass(frozen=True)
+class Validators:
+    etag: str
+    last_modified: Optional[dt.datetime] = None
+
+    def headers(self) -> Dict[str, str]:
+        headers = {"ETag": self.etag, "Cache-Control": CACHE_CONTROL}
+        if self.last_modified is not None:
+            headers["Last-Modified"] = format_datetime(self.last_modified, usegmt=True)
+        return headers
+
+    def encoded(self, encoding: str) -> "Validators":
+        """Validators of the body stored in ``encoding``.
+
+        Each coding is a different representation with different bytes, so
+        it gets its own strong ETag, ``"<tag>-<coding>"``; identity keeps the
+        plain tag.
+        """
+        if encoding not in _CODINGS or self.etag.startswith("W/"):
+            return self
+        return replace(self, etag=f'{self.etag[:-1]}-{encoding}"')
+
+    def weak(self) -> "Validators":
+        """Validators with a weak ETag, for bodies compressed on the fly by middleware."""
+        return self if self.etag.startswith("W/") else replace(self, etag=f"W/{self.etag}")
+
+    def not_modified(self, request_headers: Mapping[str, str]) -> bool:
+        """Whether a GET with these request headers can be answered with 304.
+
+        ``If-None-Match`` wins when present (RFC 9110 §13.2.2); otherwise
+        ``If-Modified-Since`` is compared at one-second resolution. A tag of
+        any encoded variant of the body matches, weak or strong.
+        """
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            return _etag_listed(self.etag, if_none_match)
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since is None or self.last_modified is None:
+            return False
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=dt.timezone.utc)
+        return self.last_modified.replace(microsecond=0) <= since
+
+
+def fingerprint(lesson_ids: Iterable[Optional[str]]) -> str:
+    """Order-sensitive digest of lesson ids (see ``parse_html_schedule._hash_payload``)."""
+    digest = hashlib.md5()
+    for lesson_id in lesson_ids:
+        digest.update((lesson_id or "").encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+def make_etag(*parts: Any) -> str:
+    digest = hashlib.md5("\x1e".join("" if part is None else str(part) for part in parts).encode("utf-8"))
+    return f'"{digest.hexdigest()}"'
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[dt.datetime]:
+    """Parse the ``...Z`` ISO timestamps written by cache_builder as aware UTC."""
+    if not value:
+        return None
+    try:
+        parsed = dt.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=dt.timezone.utc)
+
+
+def schedule_validators(
+    group_id: str,
+    group_name: Optional[str],
+    date_from: Optional[dt.date],
+    date_to: Optional[dt.date],
+    group_fingerprint: str,
+    last_changed: Optional[str],
+) -> Validators:
+    """Validators for a snapshot-served schedule.
+
+    Derived from the whole group's fingerprint, so they are known before
+    the requested range is read and change whenever any lesson does.
+    """
+    return Validators(
+        etag=make_etag("schedule", group_id, group_name, date_from, date_to, group_fingerprint),
+        last_modified=parse_timestamp(last_changed),
+    )
+
+
+def result_validators(result: Mapping[str, Any]) -> Validators:
+    """Validators for a schedule dict as returned by ``fetch_schedule``."""
+    group = result.get("group") or {}
+    lessons = result.get("lessons") or []
+    return Validators(
+        etag=make_etag(
+            "lessons",
+            group.get("id"),
+            group.get("name"),
+            fingerprint(lesson.get("id") for lesson in lessons),
+        )
+    )
+
+
+def options_validators(items: Iterable[Any]) -> Validators:
+    """Validators for an option list of ``OptionItem`` objects or ``{"id", "name"}`` dicts."""
+    digest = hashlib.md5()
+    for item in items:
+        item_id, name = (item["id"], item["name"]) if isinstance(item, Mapping) else (item.id, item.name)
+        digest.update(f"{item_id}\x1f{name}\x1e".encode("utf-8"))
+    return Validators(etag=f'"{digest.hexdigest()}"')
+
+
+def _etag_listed(etag: str, header: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison: W/"x" matches "x". The encoded
+    # variants of a body are the same content, so "x-gzip" matches "x" too.
+    candidates = {_base_tag(tag) for tag in header.split(",")}
+    return _base_tag(etag) in candidates
+
+
+def _base_tag(tag: str) -> str:
+    tag = tag.strip().removeprefix("W/")
+    for coding in _CODINGS:
+        suffix = f'-{coding}"'
+        if tag.endswith(suffix):
+            return tag[: -len(suffix)] + '"'
+    return tag
+
+
+__all__ = [
+    "CACHE_CONTROL",
+    "Validators",
+    "fingerprint",
+    "make_etag",
+    "options_validators",
+    "parse_timestamp",
+    "result_validators",
+    "schedule_validators",
+]
@@ -0,0 +1,251 @@
+"""Streaming NDJSON export of every group's lessons from a snapshot.
+
+Records are produced by a chain of generators (groups -> lessons ->
+records -> byte chunks); only the lessons of one group are in memory at a
+time, whatever the size of the snapshot. Groups go out in
+``(faculty, course, group)`` order and every record carries a ``cursor``:
+passing the cursor of the last record received resumes the export right
+after it.
+
+Usage::
+
+    python -m parser.export > lessons.ndjson
+    python -m parser.export --per group --faculty 5 --from 2025-09-01 -o groups.ndjson
+    python -m parser.export -o lessons.ndjson --resume   # continue an interrupted run
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import datetime as dt
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from .serialization import dumps
+
+PER_LESSON = "lesson"
+PER_GROUP = "group"
+MEDIA_TYPE = "application/x-ndjson"
+
+# Records are joined into chunks of about this size before being written.
+CHUNK_BYTES = 64 * 1024
+
+
+class ExportGroup(NamedTuple):
+    """A row of the snapshots' ``export_groups``."""
+
+    faculty_id: str
+    course_id: str
+    group_id: str
+    group_name: Optional[str]
+    # Moves whenever cache_builder rewrites the group's lessons.
+    last_changed: Optional[str]
+
+    @property
+    def key(self) -> Tuple[str, str, str]:
+        return (self.faculty_id, self.course_id, self.group_id)
+
+
+class Cursor(NamedTuple):
+    """Position after a record: ``offset`` lessons of ``group`` were sent.
+
+    ``version`` is the group's own ``last_changed``. If the group has been
+    rewritten since, it is sent again from its first lesson, because offsets
+    into its old lessons no longer line up. Lesson ids let consumers drop
+    the repeats. The version is per group because a rebuild rewrites the
+    groups one by one and records the snapshot's ``generated_at`` only after
+    the last of them.
+    """
+
+    version: Optional[str]
+    group: Tuple[str, str, str]
+    offset: int
+
+    def encode(self) -> str:
+        raw = json.dumps([self.version, *self.group, self.offset], ensure_ascii=False)
+        return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+    @classmethod
+    def parse(cls, token: str) -> "Cursor":
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+            version, faculty_id, course_id, group_id, offset = json.loads(raw)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Invalid export cursor: {token!r}") from e
+        if not isinstance(offset, int) or offset < 0:
+            raise ValueError(f"Invalid export cursor: {token!r}")
+        return cls(version, (str(faculty_id), str(course_id), str(group_id)), offset)
+
+
+def export_records(
+    snapshot: Any,
+    *,
+    per: str = PER_LESSON,
+    faculty_id: Optional[str] = None,
+    course: Optional[str] = None,
+    date_from: Optional[dt.date] = None,
+    date_to: Optional[dt.date] = None,
+    cursor: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Export records of a snapshot, one per lesson or one per group.
+
+    Arguments are validated here, so a bad ``per`` or ``cursor`` raises
+    ``ValueError`` before the first record is produced.
+    """
+    if per not in (PER_LESSON, PER_GROUP):
+        raise ValueError(f"Unknown export granularity: {per!r}")
+    if date_from and date_to and date_from > date_to:
+        raise ValueError("'from' date must be before 'to' date")
+    start = Cursor.parse(cursor) if cursor else None
+    groups = [ExportGroup(*row) for row in snapshot.export_groups(faculty_id, course)]
+    return _records(snapshot, groups, per, date_from, date_to, start)
+
+
+def ndjson_chunks(records: Iterable[Dict[str, Any]], chunk_bytes: int = CHUNK_BYTES) -> Iterator[bytes]:
+    """Encode records as NDJSON, several lines per chunk; chunks end on a line break."""
+    chunk: List[bytes] = []
+    size = 0
+    for record in records:
+        line = dumps(record) + b"\n"
+        chunk.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield b"".join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield b"".join(chunk)
+
+
+def _records(
+    snapshot: Any,
+    groups: List[ExportGroup],
+    per: str,
+    date_from: Optional[dt.date],
+    date_to: Optional[dt.date],
+    start: Optional[Cursor],
+) -> Iterator[Dict[str, Any]]:
+    # Groups without a last_changed (older snapshots) fall back to the
+    # snapshot-wide version.
+    generated_at = snapshot.generated_at
+    for group in groups:
+        version = group.last_changed or generated_at
+        resume_at: Optional[int] = None
+        if start is not None:
+            if group.key < start.group:
+                continue
+            if group.key == start.group and start.version == version:
+                resume_at = start.offset
+        lessons = snapshot.export_lessons(*group.key, date_from, date_to)
+        info = {
+            "faculty_id": group.faculty_id,
+            "course_id": group.course_id,
+            "group_id": group.group_id,
+            "group_name": group.group_name,
+        }
+        if per == PER_GROUP:
+            # A group is all or nothing: resuming inside one sends it whole.
+            if resume_at is not None and resume_at >= len(lessons):
+                continue
+            yield {**info, "lessons": lessons, "cursor": Cursor(version, group.key, len(lessons)).encode()}
+            continue
+        for offset in range(resume_at or 0, len(lessons)):
+            yield {
+                **info,
+                "lesson": lessons[offset],
+                "cursor": Cursor(version, group.key, offset + 1).encode(),
+            }
+
+
+def last_cursor(path: Path) -> Optional[str]:
+    """Cursor of the last complete record in an NDJSON file; drops a torn last line."""
+    if not path.exists():
+        return None
+    with path.open("rb+") as fh:
+        end = fh.seek(0, os.SEEK_END)
+        # Scan backwards block by block for the last two line breaks.
+        block, data, pos = 64 * 1024, b"", end
+        while pos > 0 and data.count(b"\n") < 2:
+            step = min(block, pos)
+            pos -= step
+            fh.seek(pos)
+            data = fh.read(step) + data
+        if data and not data.endswith(b"\n"):
+            complete = data.rfind(b"\n") + 1
+            fh.truncate(pos + complete)
+            data = data[:complete]
+        lines = data.rstrip(b"\n").rsplit(b"\n", 1)
+        if not lines[-1]:
+            return None
+        return json.loads(lines[-1]).get("cursor")
+
+
+def _write(chunks: Iterable[bytes], out: BinaryIO) -> None:
+    for chunk in chunks:
+        out.write(chunk)
+        out.flush()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from .cache_builder import STORE_PATH
+    from .snapshot import load_snapshot
+
+    cli = argparse.ArgumentParser(description="Export crawled schedules as NDJSON")
+    cli.add_argument("--snapshot", type=Path, default=STORE_PATH, help="cache.sqlite3 or cache.json")
+    cli.add_argument("--per", choices=(PER_LESSON, PER_GROUP), default=PER_LESSON)
+    cli.add_argument("--faculty")
+    cli.add_argument("--course")
+    cli.add_argument("--from", dest="date_from", type=dt.date.fromisoformat, help="YYYY-MM-DD")
+    cli.add_argument("--to", dest="date_to", type=dt.date.fromisoformat, help="YYYY-MM-DD")
+    cli.add_argument("--cursor", help="resume after the record with this cursor")
+    cli.add_argument("-o", "--output", type=Path, help="write to a file instead of stdout")
+    cli.add_argument(
+        "--resume",
+        action="store_true",
+        help="append to --output, continuing after its last complete record",
+    )
+    args = cli.parse_args(argv)
+    if args.resume and not args.output:
+        cli.error("--resume needs --output")
+
+    snapshot = load_snapshot(args.snapshot)
+    if snapshot is None:
+        raise SystemExit(f"No snapshot at {args.snapshot}")
+    cursor = args.cursor
+    if args.resume:
+        cursor = last_cursor(args.output) or cursor
+    try:
+        records = export_records(
+            snapshot,
+            per=args.per,
+            faculty_id=args.faculty,
+            course=args.course,
+            date_from=args.date_from,
+            date_to=args.date_to,
+            cursor=cursor,
+        )
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if args.output:
+        with args.output.open("ab" if args.resume else "wb") as out:
+            _write(ndjson_chunks(records), out)
+    else:
+        _write(ndjson_chunks(records), sys.stdout.buffer)
+
+
+__all__ = [
+    "Cursor",
+    "ExportGroup",
+    "MEDIA_TYPE",
+    "PER_GROUP",
+    "PER_LESSON",
+    "export_records",
+    "last_cursor",
+    "ndjson_chunks",
+]
+
+
+if __name__ == "__main__":
+    main()
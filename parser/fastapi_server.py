@@ -2,18 +2,106 @@
 from __future__ import annotations
 
 import json
-from typing import Optional
+import os
+import secrets
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, List, Optional
 
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 
 from .api_client import ScheduleApiClient, ApiResult, to_json
+from .cache_builder import SLOTS_PATH, STORE_PATH
+from .compression import BodyCache, body_headers, negotiate
+from .conditional import Validators, options_validators, result_validators
+from .export import MEDIA_TYPE as NDJSON_MEDIA_TYPE, ndjson_chunks
+from .governor import UpstreamGovernor
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, MetricsMiddleware
+from .shared_slots import DEFAULT_LIMIT as DEFAULT_SHARED_LIMIT, SharedSlots
+from .snapshot import load_snapshot
+from .spa_client import BASE_URL
+from .timing import CACHE, SERIALIZE, ServerTimingMiddleware, timed
+
+# Адрес формы расписания; для локальных прогонов — parser/upstream_sim.py
+UPSTREAM_URL = os.environ.get("SCHEDULE_UPSTREAM_URL", BASE_URL)
+# Размер пула клиентов к cacs.spa.msu.ru (по одному на параллельный запрос)
+POOL_SIZE = int(os.environ.get("SCHEDULE_POOL_SIZE", "8"))
+# Ответ сайта дольше этого (в секундах) считается перегрузкой и снижает
+# число параллельных запросов к нему
+UPSTREAM_LATENCY_TARGET = float(os.environ.get("SCHEDULE_UPSTREAM_LATENCY_TARGET", "5"))
+# На сколько секунд прекращаются запросы к сайту, если он отвечает ошибками
+UPSTREAM_OPEN_SECONDS = float(os.environ.get("SCHEDULE_UPSTREAM_OPEN_SECONDS", "30"))
+# Общая с другими серверами и cache_builder таблица мест для запросов к
+# сайту (parser/shared_slots.py): все процессы на машине вместе делают не
+# больше SCHEDULE_UPSTREAM_SHARED_LIMIT запросов, обход уступает запросам
+# пользователей. Пустая строка отключает согласование
+UPSTREAM_SLOTS_PATH = os.environ.get("SCHEDULE_UPSTREAM_SLOTS_PATH", str(SLOTS_PATH))
+UPSTREAM_SHARED_LIMIT = int(
+    os.environ.get("SCHEDULE_UPSTREAM_SHARED_LIMIT", str(DEFAULT_SHARED_LIMIT))
+)
+# Время жизни кэша списков факультетов/курсов/групп, в секундах
+OPTIONS_TTL = float(os.environ.get("SCHEDULE_OPTIONS_TTL", "3600"))
+# Токен для служебных запросов (сброс кэша): заголовок
+# "Authorization: Bearer <токен>". Без токена они принимаются только с localhost
+ADMIN_TOKEN = os.environ.get("SCHEDULE_ADMIN_TOKEN", "")
+# Период перестроения поискового индекса групп, в секундах
+SEARCH_INDEX_INTERVAL = float(os.environ.get("SCHEDULE_SEARCH_INDEX_INTERVAL", str(6 * 3600)))
+
+# База расписаний, собранная parser/cache_builder.py; пустая строка отключает её
+SNAPSHOT_PATH = os.environ.get("SCHEDULE_SNAPSHOT_PATH", str(STORE_PATH))
+
+# Объём кэша готовых (сериализованных и сжатых) ответов, в мегабайтах
+BODY_CACHE_MB = float(os.environ.get("SCHEDULE_BODY_CACHE_MB", "64"))
+
+# Общий предел запросов к сайту: подстраивается под его задержки и ошибки,
+# запросы пользователей идут раньше фонового обновления индексов и обхода
+# cache_builder
+_governor = UpstreamGovernor(
+    limit=POOL_SIZE,
+    max_limit=POOL_SIZE,
+    latency_target=UPSTREAM_LATENCY_TARGET,
+    open_seconds=UPSTREAM_OPEN_SECONDS,
+    crawl_reserve=1,
+    shared=(
+        SharedSlots(Path(UPSTREAM_SLOTS_PATH), limit=UPSTREAM_SHARED_LIMIT)
+        if UPSTREAM_SLOTS_PATH
+        else None
+    ),
+)
+_api_client = ScheduleApiClient(
+    base_url=UPSTREAM_URL, pool_size=POOL_SIZE, options_ttl=OPTIONS_TTL, governor=_governor
+)
+# Тела ответов по ETag: сериализуются и сжимаются один раз на версию данных
+_bodies = BodyCache(max_bytes=int(BODY_CACHE_MB * 1024 * 1024))
+
+REGISTRY.register_stats("pool", _api_client.pool_stats)
+REGISTRY.register_stats("options_cache", _api_client.options_cache.stats)
+REGISTRY.register_stats("schedule_coalescing", _api_client.schedule_flights.stats)
+REGISTRY.register_stats("response_bodies", _bodies.stats)
+REGISTRY.register_stats("upstream_governor", _governor.stats)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    if SNAPSHOT_PATH:
+        _api_client.snapshot = load_snapshot(Path(SNAPSHOT_PATH))
+    await run_in_threadpool(_api_client.warm)
+    _api_client.start_search_index(SEARCH_INDEX_INTERVAL)
+    yield
+    _api_client.stop_search_index()
+
 
 app = FastAPI(
     title="CACS SPA MSU Schedule API",
     description="REST API для получения расписания занятий с cacs.spa.msu.ru",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Разрешить CORS для мобильных приложений
@@ -24,8 +112,12 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-_api_client = ScheduleApiClient()
+# Остальные ответы сжимаются на лету; готовые тела уже имеют Content-Encoding
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+# Задержка каждого запроса по шаблону маршрута, для /metrics
+app.add_middleware(MetricsMiddleware)
+# Заголовок Server-Timing: сайт, разбор HTML, кэш, сериализация
+app.add_middleware(ServerTimingMiddleware)
 
 
 class ApiResponse(BaseModel):
@@ -45,13 +137,22 @@ def root():
             "/courses": "Получить список курсов для факультета",
             "/groups": "Получить список групп для факультета и курса",
             "/schedule": "Получить расписание для группы",
+            "/schedule/changes": "Изменения расписания группы с указанной версии",
             "/search": "Поиск группы по названию",
+            "/teachers": "Список преподавателей",
+            "/teacher/{name}/schedule": "Расписание преподавателя по всем группам",
+            "/rooms/free": "Свободные аудитории на выбранные пары",
+            "/room/{name}/schedule": "Расписание аудитории",
+            "/export": "Выгрузка всех расписаний в NDJSON (потоком)",
+            "/stats": "Статистика пула соединений и кэша",
+            "/metrics": "Метрики в формате Prometheus",
+            "/cache/invalidate": "Сбросить кэш списков (POST)",
         }
     }
 
 
 @app.get("/faculties", response_model=ApiResponse, tags=["faculties"])
-def get_faculties():
+def get_faculties(request: Request, response: Response):
     """
     Получить список всех факультетов.
     
@@ -60,11 +161,15 @@ def get_faculties():
     - name: название факультета
     """
     result = _api_client.get_faculties()
-    return ApiResponse(success=result.success, data=result.data, error=result.error)
+    return _options_response(request, response, result)
 
 
 @app.get("/courses", response_model=ApiResponse, tags=["courses"])
-def get_courses(faculty_id: str = Query(..., description="ID факультета")):
+def get_courses(
+    request: Request,
+    response: Response,
+    faculty_id: str = Query(..., description="ID факультета"),
+):
     """
     Получить список курсов для указанного факультета.
     
@@ -76,11 +181,13 @@ def get_courses(faculty_id: str = Query(..., description="ID факультет
     - name: название курса
     """
     result = _api_client.get_courses(faculty_id)
-    return ApiResponse(success=result.success, data=result.data, error=result.error)
+    return _options_response(request, response, result)
 
 
 @app.get("/groups", response_model=ApiResponse, tags=["groups"])
 def get_groups(
+    request: Request,
+    response: Response,
     faculty_id: str = Query(..., description="ID факультета"),
     course: str = Query(..., description="ID курса")
 ):
@@ -96,11 +203,12 @@ def get_groups(
     - name: название группы
     """
     result = _api_client.get_groups(faculty_id, course)
-    return ApiResponse(success=result.success, data=result.data, error=result.error)
+    return _options_response(request, response, result)
 
 
 @app.get("/schedule", response_model=ApiResponse, tags=["schedule"])
 def get_schedule(
+    request: Request,
     faculty_id: str = Query(..., description="ID факультета"),
     course: str = Query(..., description="ID курса"),
     group_id: str = Query(..., description="ID группы"),
@@ -131,7 +239,22 @@ def get_schedule(
         - room: аудитория
         - group_id: ID группы
         - notes: примечания
+
+    Ответ содержит ETag (по идентификаторам занятий) и, если расписание
+    взято из базы, Last-Modified; повторный запрос с If-None-Match или
+    If-Modified-Since получает 304 без тела.
     """
+    # Для расписаний из базы 304 и готовое сжатое тело находятся до чтения занятий.
+    with timed(CACHE):
+        validators = _api_client.schedule_validators(
+            faculty_id, course, group_id, date_from=date_from, date_to=date_to
+        )
+    if validators is not None:
+        if validators.not_modified(request.headers):
+            return _not_modified(validators.encoded(_encoding(request)))
+        stored = _stored_response(request, validators)
+        if stored is not None:
+            return stored
     result = _api_client.get_schedule(
         faculty_id=faculty_id,
         course=course,
@@ -139,16 +262,62 @@ def get_schedule(
         date_from=date_from,
         date_to=date_to
     )
+    if not result.success:
+        return ApiResponse(success=False, error=result.error)
+    if validators is not None:
+        return _store_response(request, validators, result)
+    # Тело может сжать GZipMiddleware на лету, поэтому ETag слабый
+    validators = result_validators(result.data).weak()
+    if validators.not_modified(request.headers):
+        return _not_modified(validators)
+    with timed(SERIALIZE):
+        body = jsonable_encoder(ApiResponse(success=True, data=result.data))
+        return JSONResponse(body, headers=validators.headers())
+
+
+@app.get("/schedule/changes", response_model=ApiResponse, tags=["schedule"])
+def get_schedule_changes(
+    faculty_id: str = Query(..., description="ID факультета"),
+    course: str = Query(..., description="ID курса"),
+    group_id: str = Query(..., description="ID группы"),
+    since: Optional[str] = Query(None, description="Версия из предыдущего ответа"),
+):
+    """
+    Получить изменения расписания группы с указанной версии.
+
+    Первый запрос делается без since и возвращает все занятия; дальше
+    передавайте version из последнего ответа и получайте только
+    добавленные, изменённые и удалённые занятия. Занятия сопоставляются
+    по полю key, которое (в отличие от id) не меняется при правке примечаний.
+    Если журнал изменений уже не покрывает версию, приходит полный список.
+
+    Возвращает объект с полями:
+    - group: информация о группе (id, name)
+    - version: версия для следующего запроса
+    - full: true, если lessons заменяет всё расписание на клиенте
+    - lessons: все занятия (только при full)
+    - added, modified: занятия, которые нужно добавить/заменить по key
+    - removed: массив {key, id} удалённых занятий
+    """
+    result = _api_client.get_schedule_changes(faculty_id, course, group_id, since)
     return ApiResponse(success=result.success, data=result.data, error=result.error)
 
 
 @app.get("/search", response_model=ApiResponse, tags=["search"])
-def search_group(q: str = Query(..., description="Поисковый запрос")):
+def search_group(
+    q: str = Query(..., description="Поисковый запрос"),
+    limit: int = Query(50, ge=1, le=500, description="Максимум результатов"),
+):
     """
     Поиск группы по названию.
     
+    Ищет по индексу в памяти (перестраивается в фоне): сначала точные
+    совпадения, затем по началу названия, по подстроке и похожие названия
+    (с опечатками). Пока индекс строится, поиск идёт напрямую по сайту.
+    
     Параметры:
     - q: подстрока для поиска (регистронезависимый поиск)
+    - limit: максимальное число результатов
     
     Возвращает массив найденных групп с полями:
     - id: идентификатор группы
@@ -158,10 +327,239 @@ def search_group(q: str = Query(..., description="Поисковый запро
     - course: ID курса
     - course_name: название курса
     """
-    result = _api_client.search_group(q)
+    result = _api_client.search_group(q, limit=limit)
+    return ApiResponse(success=result.success, data=result.data, error=result.error)
+
+
+@app.get("/teachers", response_model=ApiResponse, tags=["teachers"])
+def list_teachers():
+    """
+    Получить список всех преподавателей из собранной базы расписаний.
+
+    Возвращает массив объектов с полями:
+    - name: имя преподавателя
+    - lessons: число его занятий в базе
+    """
+    result = _api_client.list_teachers()
+    return ApiResponse(success=result.success, data=result.data, error=result.error)
+
+
+@app.get("/teacher/{name}/schedule", response_model=ApiResponse, tags=["teachers"])
+def get_teacher_schedule(
+    name: str,
+    date_from: Optional[str] = Query(None, description="Дата начала в формате DD.MM.YYYY"),
+    date_to: Optional[str] = Query(None, description="Дата окончания в формате DD.MM.YYYY"),
+):
+    """
+    Получить расписание преподавателя по всем группам.
+
+    Отвечает по индексу преподавателей, который строится по базе
+    parser/cache_builder.py и перестраивается после каждого её обновления.
+    Регистр, пробелы и знаки препинания в имени не учитываются.
+
+    Параметры:
+    - name: имя преподавателя (из /teachers)
+    - date_from: необязательно, дата начала периода (DD.MM.YYYY)
+    - date_to: необязательно, дата окончания периода (DD.MM.YYYY)
+
+    Возвращает объект с полями:
+    - teacher: имя преподавателя
+    - lessons: массив занятий (как в /schedule), отсортированный по дате и времени
+    """
+    result = _api_client.get_teacher_schedule(name, date_from=date_from, date_to=date_to)
+    return ApiResponse(success=result.success, data=result.data, error=result.error)
+
+
+@app.get("/rooms/free", response_model=ApiResponse, tags=["rooms"])
+def find_free_rooms(
+    date: str = Query(..., description="Дата в формате DD.MM.YYYY"),
+    pair: List[int] = Query(..., description="Номер пары; можно указать несколько"),
+):
+    """
+    Найти аудитории, свободные на указанные пары.
+
+    Отвечает по индексу занятости аудиторий, построенному по базе
+    parser/cache_builder.py. Известны только аудитории, встречающиеся в
+    расписании; онлайн-занятия (Zoom и т.п.) не считаются аудиториями.
+
+    Параметры:
+    - date: дата (DD.MM.YYYY)
+    - pair: номер пары, например `?pair=3&pair=4`
+
+    Возвращает отсортированный массив названий аудиторий.
+    """
+    result = _api_client.find_free_rooms(date, pair)
+    return ApiResponse(success=result.success, data=result.data, error=result.error)
+
+
+@app.get("/room/{name}/schedule", response_model=ApiResponse, tags=["rooms"])
+def get_room_schedule(
+    name: str,
+    date_from: Optional[str] = Query(None, description="Дата начала в формате DD.MM.YYYY"),
+    date_to: Optional[str] = Query(None, description="Дата окончания в формате DD.MM.YYYY"),
+):
+    """
+    Получить расписание аудитории.
+
+    Параметры:
+    - name: аудитория; «ауд. Г 608», «Г-608» и «г608» считаются одной аудиторией
+    - date_from: необязательно, дата начала периода (DD.MM.YYYY)
+    - date_to: необязательно, дата окончания периода (DD.MM.YYYY)
+
+    Возвращает объект с полями:
+    - room: название аудитории
+    - lessons: массив занятий (как в /schedule), отсортированный по дате и времени
+    """
+    result = _api_client.get_room_schedule(name, date_from=date_from, date_to=date_to)
     return ApiResponse(success=result.success, data=result.data, error=result.error)
 
 
+@app.get("/export", tags=["export"])
+def export(
+    per: str = Query("lesson", description="lesson — строка на занятие, group — строка на группу"),
+    faculty_id: Optional[str] = Query(None, description="ID факультета"),
+    course: Optional[str] = Query(None, description="ID курса"),
+    date_from: Optional[str] = Query(None, description="Дата начала в формате DD.MM.YYYY"),
+    date_to: Optional[str] = Query(None, description="Дата окончания в формате DD.MM.YYYY"),
+    cursor: Optional[str] = Query(None, description="cursor последней полученной строки"),
+):
+    """
+    Выгрузить занятия всех групп из собранной базы в формате NDJSON.
+
+    Ответ передаётся потоком, по одному JSON-объекту на строку; сервер
+    держит в памяти занятия только одной группы, поэтому выгрузка всей
+    базы не требует памяти пропорционально её размеру. Группы идут в
+    порядке (факультет, курс, группа).
+
+    Параметры:
+    - per: `lesson` (по умолчанию) или `group`
+    - faculty_id, course: необязательные фильтры
+    - date_from, date_to: необязательно, период (DD.MM.YYYY)
+    - cursor: необязательно, поле cursor последней полученной строки;
+      выгрузка продолжится сразу после неё
+
+    Каждая строка содержит faculty_id, course_id, group_id, group_name,
+    cursor и либо lesson (занятие, как в /schedule), либо lessons (все
+    занятия группы). При ошибке в параметрах возвращается обычный ответ
+    с success=false.
+    """
+    result = _api_client.export(
+        per=per,
+        faculty_id=faculty_id,
+        course=course,
+        date_from=date_from,
+        date_to=date_to,
+        cursor=cursor,
+    )
+    if not result.success:
+        return ApiResponse(success=False, error=result.error)
+    return StreamingResponse(ndjson_chunks(result.data), media_type=NDJSON_MEDIA_TYPE)
+
+
+@app.get("/stats", tags=["root"])
+def get_stats():
+    """
+    Статистика пула клиентов к cacs.spa.msu.ru и кэша списков.
+
+    Возвращает размер пула, число выдач клиентов, количество и суммарное
+    время ожидания свободного клиента, число обновлений CSRF-состояния,
+    попадания/промахи кэша факультетов, курсов и групп, а также сколько
+    одинаковых одновременных запросов расписания обслужено одной загрузкой,
+    сколько ответов отдано из кэша готовых сжатых тел, а также текущий
+    предел запросов к сайту и состояние предохранителя.
+    """
+    return {
+        "pool": _api_client.pool_stats(),
+        "options_cache": _api_client.options_cache.stats(),
+        "schedule_coalescing": _api_client.schedule_flights.stats(),
+        "response_bodies": _bodies.stats(),
+        "upstream_governor": _governor.stats(),
+    }
+
+
+@app.get("/metrics", tags=["root"])
+def metrics():
+    """
+    Метрики в текстовом формате Prometheus.
+
+    Гистограммы времени запросов к cacs.spa.msu.ru по шагам формы
+    (начальный GET, POST формы), времени разбора страницы и числа занятий
+    на ней, число запросов к сайту в работе, задержка ответов этого API по
+    маршрутам, а также счётчики из /stats (пул, кэши, объединение запросов).
+    """
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.post("/cache/invalidate", tags=["root"])
+def invalidate_cache(request: Request):
+    """
+    Сбросить кэш списков факультетов, курсов и групп.
+
+    Следующий запрос к /faculties, /courses или /groups загрузит данные с сайта.
+    Требует заголовок `Authorization: Bearer <SCHEDULE_ADMIN_TOKEN>`; если
+    токен не задан, запрос принимается только с localhost.
+    """
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    return {"invalidated": _api_client.options_cache.invalidate()}
+
+
+def _admin_denied(request: Request) -> Optional[Response]:
+    if ADMIN_TOKEN:
+        supplied = request.headers.get("authorization", "")
+        if secrets.compare_digest(supplied.encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+            return None
+        status, error = 401, "Нужен токен SCHEDULE_ADMIN_TOKEN"
+    elif request.client is not None and request.client.host in ("127.0.0.1", "::1", "localhost"):
+        return None
+    else:
+        status, error = 403, "Задайте SCHEDULE_ADMIN_TOKEN, чтобы разрешить запрос не с localhost"
+    return JSONResponse(
+        jsonable_encoder(ApiResponse(success=False, error=error)), status_code=status
+    )
+
+
+def _options_response(request: Request, response: Response, result: ApiResult):
+    if not result.success:
+        return ApiResponse(success=False, error=result.error)
+    validators = options_validators(result.data)
+    if validators.not_modified(request.headers):
+        return _not_modified(validators.encoded(_encoding(request)))
+    return _stored_response(request, validators) or _store_response(request, validators, result)
+
+
+def _stored_response(request: Request, validators: Validators) -> Optional[Response]:
+    encoding = _encoding(request)
+    with timed(CACHE):
+        body = _bodies.get(validators.etag, encoding)
+    return _encoded_response(body, encoding, validators) if body is not None else None
+
+
+def _store_response(request: Request, validators: Validators, result: ApiResult) -> Response:
+    encoding = _encoding(request)
+    with timed(SERIALIZE):
+        body = _bodies.fill(
+            validators.etag,
+            encoding,
+            lambda: JSONResponse(jsonable_encoder(ApiResponse(success=True, data=result.data))).body,
+        )
+    assert body is not None
+    return _encoded_response(body, encoding, validators)
+
+
+def _encoded_response(body: bytes, encoding: str, validators: Validators) -> Response:
+    return Response(body, media_type="application/json", headers=body_headers(validators, encoding))
+
+
+def _not_modified(validators: Validators) -> Response:
+    return Response(status_code=304, headers=validators.headers())
+
+
+def _encoding(request: Request) -> str:
+    return negotiate(request.headers.get("accept-encoding"))
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
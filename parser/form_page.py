@@ -0,0 +1,160 @@
+"""The timetable form as read from a response page, with either parser backend.
+
+Every response of the SPA carries the whole page: the CSRF token, the
+``#filter-form`` inputs, the faculty/course/group selects and, once a
+group is selected, ``table#timeTable``. The clients parse each response
+once into a :class:`FormPage` and read both the form state and the lessons
+from that one tree. ``bs4`` (BeautifulSoup with html.parser) is the
+reference; ``lxml`` reads the same values several times faster. The
+backend defaults to ``SCHEDULE_PARSER_BACKEND``, as in
+:func:`parser.parse_html_schedule.parse_html_schedule`.
+"""
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from bs4 import BeautifulSoup
+
+from .parse_html_schedule import BACKENDS, DEFAULT_BACKEND, lxml_root, lxml_text
+from .timing import HTML_TREE, timed
+
+
+@dataclass
+class OptionItem:
+    id: str
+    name: str
+
+
+class FormPage(ABC):
+    """Form state of one page; ``tree`` goes to ``parse_html_schedule`` as is."""
+
+    backend = ""
+
+    def __init__(self, tree: Any) -> None:
+        self.tree = tree
+
+    @abstractmethod
+    def csrf_token(self) -> Optional[str]:
+        """Content of ``meta[name=csrf-token]``, if the page has one."""
+
+    @abstractmethod
+    def has_form(self) -> bool:
+        """Whether the page has ``#filter-form``."""
+
+    @abstractmethod
+    def form_inputs(self) -> Dict[str, str]:
+        """Named ``<input>`` values of ``#filter-form`` (empty without the form)."""
+
+    @abstractmethod
+    def options(self, field: str) -> List[OptionItem]:
+        """Options of ``select#timetableform-<field>`` that have a value."""
+
+    @abstractmethod
+    def selected(self, field: str) -> Optional[OptionItem]:
+        """The option of ``select#timetableform-<field>`` marked ``selected``."""
+
+
+class Bs4FormPage(FormPage):
+    backend = "bs4"
+    tree: BeautifulSoup
+
+    def csrf_token(self) -> Optional[str]:
+        token = self.tree.select_one("meta[name='csrf-token']")
+        return token.get("content") or None if token else None
+
+    def has_form(self) -> bool:
+        return self.tree.select_one("#filter-form") is not None
+
+    def form_inputs(self) -> Dict[str, str]:
+        form = self.tree.select_one("#filter-form")
+        inputs: Dict[str, str] = {}
+        if form:
+            for inp in form.find_all("input"):
+                name = inp.get("name")
+                if name:
+                    inputs[name] = inp.get("value", "")
+        return inputs
+
+    def options(self, field: str) -> List[OptionItem]:
+        select = self.tree.select_one(f"#timetableform-{field}")
+        if select is None:
+            return []
+        items: List[OptionItem] = []
+        for option in select.find_all("option"):
+            value = option.get("value")
+            if value is None or not value.strip():
+                continue
+            items.append(OptionItem(id=value.strip(), name=option.get_text(strip=True)))
+        return items
+
+    def selected(self, field: str) -> Optional[OptionItem]:
+        option = self.tree.select_one(f"#timetableform-{field} option[selected]")
+        if option is None:
+            return None
+        return OptionItem(id=(option.get("value") or "").strip(), name=option.get_text(strip=True))
+
+
+class LxmlFormPage(FormPage):
+    backend = "lxml"
+
+    def csrf_token(self) -> Optional[str]:
+        for meta in self.tree.iter("meta"):
+            if meta.get("name") == "csrf-token":
+                return meta.get("content") or None
+        return None
+
+    def has_form(self) -> bool:
+        return self._by_id("filter-form") is not None
+
+    def form_inputs(self) -> Dict[str, str]:
+        form = self._by_id("filter-form")
+        inputs: Dict[str, str] = {}
+        if form is not None:
+            for inp in form.iter("input"):
+                name = inp.get("name")
+                if name:
+                    inputs[name] = inp.get("value", "")
+        return inputs
+
+    def options(self, field: str) -> List[OptionItem]:
+        select = self._by_id(f"timetableform-{field}")
+        if select is None:
+            return []
+        items: List[OptionItem] = []
+        for option in select.iter("option"):
+            value = option.get("value")
+            if value is None or not value.strip():
+                continue
+            items.append(OptionItem(id=value.strip(), name=lxml_text(option)))
+        return items
+
+    def selected(self, field: str) -> Optional[OptionItem]:
+        select = self._by_id(f"timetableform-{field}")
+        found = select.xpath(".//option[@selected]") if select is not None else []
+        if not found:
+            return None
+        return OptionItem(id=(found[0].get("value") or "").strip(), name=lxml_text(found[0]))
+
+    def _by_id(self, element_id: str) -> Any:
+        # The form precedes the timetable; iterating stops there instead of
+        # scanning the whole page as an ``//*[@id=...]`` query would.
+        for el in self.tree.iter():
+            if el.get("id") == element_id:
+                return el
+        return None
+
+
+def parse_form_page(html: str, backend: Optional[str] = None) -> FormPage:
+    """Parse a response page once with ``backend`` ("bs4" or "lxml")."""
+    name = backend or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown parser backend {name!r}; expected one of {sorted(BACKENDS)}")
+    with timed(HTML_TREE):
+        if name == "lxml":
+            return LxmlFormPage(lxml_root(html))
+        return Bs4FormPage(BeautifulSoup(html, "html.parser"))
+
+
+__all__ = ["Bs4FormPage", "FormPage", "LxmlFormPage", "OptionItem", "parse_form_page"]
@@ -0,0 +1,473 @@
+"""Adaptive concurrency limit, circuit breaker and priority lanes for upstream requests.
+
+Every round trip of the schedule clients goes through an
+:class:`UpstreamGovernor`. By default that is the process-wide
+:data:`GOVERNOR`, so pooled clients, window siblings and background
+refreshes share one limit:
+
+* The concurrency limit follows AIMD. It grows by one per ``limit``
+  successful requests answered within ``latency_target`` while the limit
+  is in use. A failed or slower request cuts it by ``backoff``, at most
+  once per ``latency_target`` seconds.
+* The circuit breaker opens when at least ``error_threshold`` of the last
+  ``window`` requests failed. While it is open, live requests fail at once
+  with :class:`CircuitOpen` and the servers answer from their caches only;
+  crawl requests wait. After ``open_seconds`` a single probe request goes
+  through, and the circuit closes when it succeeds.
+* Waiting ``LIVE`` requests (user-facing, the default lane) are admitted
+  before waiting ``CRAWL`` ones, and ``crawl_reserve`` slots stay free of
+  crawl requests. Background fetches run inside ``with lane(CRAWL):``.
+
+A governor only orders the requests of its own process. Separate
+processes, such as a server and a ``cache_builder`` run, coordinate through
+``shared`` (:class:`parser.shared_slots.SharedSlots`). Each admitted request
+then also holds a slot of a table that caps all of them together. In that
+table, a waiting live request of any process goes ahead of crawl requests,
+and a tripped circuit pauses the crawl everywhere. Without ``shared``,
+processes do not coordinate at all.
+
+Connection errors, timeouts, 5xx and 429 count as failures. Other 4xx
+responses (e.g. an expired CSRF token) are caused by the client's own
+state and count as neither success nor failure.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Deque, Dict, Iterator, Optional
+
+if TYPE_CHECKING:
+    from .shared_slots import SharedSlots
+
+logger = logging.getLogger(__name__)
+
+# What a missing or broken shared slot table raises (see _shared_acquire).
+_SLOT_ERRORS = (sqlite3.Error, OSError)
+
+LIVE = "live"
+CRAWL = "crawl"
+LANES = (LIVE, CRAWL)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_lane: ContextVar[str] = ContextVar("schedule_upstream_lane", default=LIVE)
+
+
+class CircuitOpen(RuntimeError):
+    """Raised instead of a live upstream request while the circuit is open."""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(
+            f"cacs.spa.msu.ru is failing; upstream requests are paused for {math.ceil(retry_after)}s"
+        )
+        self.retry_after = retry_after
+
+
+@contextmanager
+def lane(name: str) -> Iterator[None]:
+    """Run upstream requests made inside the block in lane ``name``."""
+    if name not in LANES:
+        raise ValueError(f"Unknown lane {name!r}; expected one of {LANES}")
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def set_lane(name: str) -> None:
+    """Put the rest of the current thread in lane ``name``, e.g. as an executor initializer."""
+    if name not in LANES:
+        raise ValueError(f"Unknown lane {name!r}; expected one of {LANES}")
+    _lane.set(name)
+
+
+def current_lane() -> str:
+    return _lane.get()
+
+
+class _Waiter:
+    __slots__ = ("lane", "notify", "granted", "probe", "error")
+
+    def __init__(self, lane: str, notify: Callable[[], None]) -> None:
+        self.lane = lane
+        self.notify = notify
+        self.granted = False
+        self.probe = False
+        self.error: Optional[CircuitOpen] = None
+
+
+class UpstreamGovernor:
+    """Admits upstream requests; shared by threads and event loops alike."""
+
+    def __init__(
+        self,
+        *,
+        limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 32,
+        latency_target: float = 5.0,
+        backoff: float = 0.7,
+        error_threshold: float = 0.5,
+        window: int = 20,
+        min_requests: int = 5,
+        open_seconds: float = 30.0,
+        crawl_reserve: int = 0,
+        shared: Optional["SharedSlots"] = None,
+    ) -> None:
+        if not 1 <= min_limit <= max_limit:
+            raise ValueError("Limits must satisfy 1 <= min_limit <= max_limit")
+        if not 0 < backoff < 1:
+            raise ValueError("backoff must be between 0 and 1")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.error_threshold = error_threshold
+        self.min_requests = min_requests
+        self.open_seconds = open_seconds
+        self.crawl_reserve = crawl_reserve
+        self.shared = shared
+        self._limit = float(min(max(limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._waiting: Dict[str, Deque[_Waiter]] = {name: deque() for name in LANES}
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._last_decrease = float("-inf")
+        self._lock = threading.Lock()
+        self._counters = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected": 0,
+            "failures": 0,
+            "slow": 0,
+            "decreases": 0,
+            "trips": 0,
+        }
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def retry_after(self) -> float:
+        """Seconds until the open circuit lets a probe through (0 when closed)."""
+        if self._state != OPEN:
+            return 0.0
+        return max(self._opened_at + self.open_seconds - time.monotonic(), 0.0)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            failures = sum(self._outcomes)
+            stats = {
+                "limit": self.limit,
+                "in_flight": self._in_flight,
+                "waiting_live": len(self._waiting[LIVE]),
+                "waiting_crawl": len(self._waiting[CRAWL]),
+                "circuit_state": self._state,
+                "circuit_open": int(self._state != CLOSED),
+                "error_ratio": round(failures / len(self._outcomes), 4) if self._outcomes else 0.0,
+                **self._counters,
+            }
+        if self.shared is not None:
+            try:
+                stats.update({f"shared_{key}": value for key, value in self.shared.stats().items()})
+            except _SLOT_ERRORS as exc:
+                logger.warning("Failed to read shared upstream slots: %s", exc)
+        return stats
+
+    # -- admission ---------------------------------------------------------
+
+    @contextmanager
+    def request(self) -> Iterator[None]:
+        """Hold a slot for one blocking round trip in the current lane."""
+        probe = self._acquire()
+        try:
+            slot = self._shared_acquire()
+        except BaseException:
+            self._release(probe, None, 0.0)
+            raise
+        started = time.perf_counter()
+        outcome: Optional[bool] = None
+        try:
+            yield
+            outcome = True
+        except BaseException as exc:
+            outcome = _outcome(exc)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            if slot is not None:
+                self._shared_release(slot)
+            self._release(probe, outcome, elapsed)
+
+    @asynccontextmanager
+    async def arequest(self) -> AsyncIterator[None]:
+        """Hold a slot for one awaited round trip in the current lane."""
+        probe = await self._aacquire()
+        try:
+            slot = await self._shared_aacquire()
+        except BaseException:
+            self._release(probe, None, 0.0)
+            raise
+        started = time.perf_counter()
+        outcome: Optional[bool] = None
+        try:
+            yield
+            outcome = True
+        except BaseException as exc:
+            outcome = _outcome(exc)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            try:
+                if slot is not None:
+                    await self._shared_arelease(slot)
+            finally:
+                self._release(probe, outcome, elapsed)
+
+    # A broken slot table must not stop upstream requests: they then run
+    # under this process's own limit only.
+
+    def _shared_acquire(self) -> Optional[int]:
+        if self.shared is None:
+            return None
+        try:
+            return self.shared.acquire(current_lane())
+        except _SLOT_ERRORS as exc:
+            logger.warning("Shared upstream slots unavailable: %s", exc)
+            return None
+
+    async def _shared_aacquire(self) -> Optional[int]:
+        if self.shared is None:
+            return None
+        try:
+            return await self.shared.aacquire(current_lane())
+        except _SLOT_ERRORS as exc:
+            logger.warning("Shared upstream slots unavailable: %s", exc)
+            return None
+
+    def _shared_release(self, slot: int) -> None:
+        try:
+            self.shared.release(slot)  # type: ignore[union-attr]
+        except _SLOT_ERRORS as exc:
+            logger.warning("Failed to release a shared upstream slot: %s", exc)
+
+    async def _shared_arelease(self, slot: int) -> None:
+        try:
+            await self.shared.arelease(slot)  # type: ignore[union-attr]
+        except _SLOT_ERRORS as exc:
+            logger.warning("Failed to release a shared upstream slot: %s", exc)
+
+    def _acquire(self) -> bool:
+        event = threading.Event()
+        waiter = _Waiter(current_lane(), event.set)
+        with self._lock:
+            if self._admit(waiter):
+                return waiter.probe
+        event.wait()
+        if waiter.error is not None:
+            raise waiter.error
+        return waiter.probe
+
+    async def _aacquire(self) -> bool:
+        loop = asyncio.get_running_loop()
+        future: "asyncio.Future[None]" = loop.create_future()
+        waiter = _Waiter(current_lane(), lambda: loop.call_soon_threadsafe(_resolve, future))
+        with self._lock:
+            if self._admit(waiter):
+                return waiter.probe
+        try:
+            await future
+        except BaseException:
+            with self._lock:
+                if waiter.granted:
+                    self._finish(waiter.probe, None, 0.0)
+                elif waiter.error is None:
+                    self._waiting[waiter.lane].remove(waiter)
+            raise
+        if waiter.error is not None:
+            raise waiter.error
+        return waiter.probe
+
+    def _admit(self, waiter: _Waiter) -> bool:
+        """Take a slot for ``waiter`` now (True), queue it (False) or raise."""
+        if self._state != CLOSED:
+            if self._state == HALF_OPEN and not self._probing:
+                self._grant(waiter, probe=True)
+                return True
+            if waiter.lane == LIVE:
+                self._counters["rejected"] += 1
+                raise CircuitOpen(self.retry_after())
+        elif self._has_room(waiter.lane) and not self._queued_ahead(waiter.lane):
+            self._grant(waiter, probe=False)
+            return True
+        self._counters["queued"] += 1
+        self._waiting[waiter.lane].append(waiter)
+        return False
+
+    def _has_room(self, lane: str) -> bool:
+        if lane == CRAWL:
+            return self._in_flight < max(self.limit - self.crawl_reserve, 1)
+        return self._in_flight < self.limit
+
+    def _queued_ahead(self, lane: str) -> bool:
+        if lane == LIVE:
+            return bool(self._waiting[LIVE])
+        return any(self._waiting.values())
+
+    def _grant(self, waiter: _Waiter, probe: bool) -> None:
+        self._in_flight += 1
+        self._counters["admitted"] += 1
+        waiter.granted = True
+        waiter.probe = probe
+        if probe:
+            self._probing = True
+
+    def _dispatch(self) -> None:
+        if self._state == OPEN:
+            return
+        if self._state == HALF_OPEN:
+            if not self._probing:
+                waiter = self._next_waiter()
+                if waiter is not None:
+                    self._grant(waiter, probe=True)
+                    waiter.notify()
+            return
+        for name in LANES:
+            waiting = self._waiting[name]
+            while waiting and self._has_room(name):
+                waiter = waiting.popleft()
+                self._grant(waiter, probe=False)
+                waiter.notify()
+            if waiting:
+                # Lower lanes wait behind a higher one that is still queued.
+                return
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        for name in LANES:
+            if self._waiting[name]:
+                return self._waiting[name].popleft()
+        return None
+
+    # -- feedback ----------------------------------------------------------
+
+    def _release(self, probe: bool, outcome: Optional[bool], elapsed: float) -> None:
+        with self._lock:
+            self._finish(probe, outcome, elapsed)
+
+    def _finish(self, probe: bool, outcome: Optional[bool], elapsed: float) -> None:
+        saturated = self._in_flight >= self.limit
+        self._in_flight -= 1
+        now = time.monotonic()
+        if probe:
+            self._probing = False
+            if outcome is False:
+                self._trip(now)
+            elif outcome is True:
+                self._state = CLOSED
+                self._outcomes.clear()
+        elif outcome is not None and self._state == CLOSED:
+            failed = outcome is False
+            slow = not failed and elapsed > self.latency_target
+            self._outcomes.append(failed)
+            if failed:
+                self._counters["failures"] += 1
+            elif slow:
+                self._counters["slow"] += 1
+            if failed or slow:
+                self._decrease(now)
+            elif saturated:
+                # Additive increase: about one slot per limit's worth of successes.
+                self._limit = min(self._limit + 1 / self._limit, float(self.max_limit))
+            failures = sum(self._outcomes)
+            if (
+                failed
+                and len(self._outcomes) >= self.min_requests
+                and failures >= self.error_threshold * len(self._outcomes)
+            ):
+                self._trip(now)
+        self._dispatch()
+
+    def _decrease(self, now: float) -> None:
+        # One cut per latency_target: requests already in flight when the
+        # first one failed report the same congestion.
+        if now - self._last_decrease < self.latency_target:
+            return
+        self._last_decrease = now
+        self._limit = max(self._limit * self.backoff, float(self.min_limit))
+        self._counters["decreases"] += 1
+
+    def _trip(self, now: float) -> None:
+        self._state = OPEN
+        self._opened_at = now
+        self._limit = float(self.min_limit)
+        self._counters["trips"] += 1
+        error = CircuitOpen(self.open_seconds)
+        live = self._waiting[LIVE]
+        while live:
+            waiter = live.popleft()
+            waiter.error = error
+            waiter.notify()
+        timer = threading.Timer(self.open_seconds, self._half_open, args=(now,))
+        timer.daemon = True
+        timer.start()
+        if self.shared is not None:
+            try:
+                self.shared.pause(self.open_seconds)
+            except _SLOT_ERRORS as exc:
+                logger.warning("Failed to pause shared upstream slots: %s", exc)
+
+    def _half_open(self, opened_at: float) -> None:
+        with self._lock:
+            if self._state == OPEN and self._opened_at == opened_at:
+                self._state = HALF_OPEN
+                self._dispatch()
+
+
+def _outcome(exc: BaseException) -> Optional[bool]:
+    """False for an upstream failure, None for cancellation and client-side 4xx."""
+    if not isinstance(exc, Exception):
+        return None
+    status = getattr(getattr(exc, "response", None), "status_code", None)
+    if status is not None and status < 500 and status != 429:
+        return None
+    return False
+
+
+def _resolve(future: "asyncio.Future[None]") -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+GOVERNOR = UpstreamGovernor()
+
+
+__all__ = [
+    "CLOSED",
+    "CRAWL",
+    "CircuitOpen",
+    "GOVERNOR",
+    "HALF_OPEN",
+    "LANES",
+    "LIVE",
+    "OPEN",
+    "UpstreamGovernor",
+    "current_lane",
+    "lane",
+    "set_lane",
+]
@@ -0,0 +1,571 @@
+"""Indexed SQLite storage for crawled group schedules.
+
+Replaces reading the monolithic ``data/cache.json``: every group's lessons
+are stored as rows indexed by group, date, teacher and room, so readers only
+touch the rows they need. Each group is rewritten in its own transaction and
+the database runs in WAL mode, so readers always see either the old or the
+new version of a group, never a mix.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import json
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .changes import Change, diff, parse_version, sync_payload
+from .conditional import Validators, fingerprint, schedule_validators
+from .room_index import RoomIndex
+from .spa_client import OptionItem
+from .teacher_index import TeacherIndex
+
+# Column order mirrors the key order of lesson dicts from parse_html_schedule.
+LESSON_FIELDS = (
+    "date",
+    "pair_number",
+    "starts_at",
+    "ends_at",
+    "subject",
+    "type",
+    "teacher",
+    "room",
+    "group_id",
+    "notes",
+    "id",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS groups (
+    group_id TEXT PRIMARY KEY,
+    faculty_id TEXT NOT NULL,
+    faculty_name TEXT,
+    course_id TEXT NOT NULL,
+    course_name TEXT,
+    group_name TEXT,
+    date_from TEXT NOT NULL,
+    date_to TEXT NOT NULL,
+    last_changed TEXT,
+    fingerprint TEXT
+);
+CREATE TABLE IF NOT EXISTS lessons (
+    owner TEXT NOT NULL REFERENCES groups(group_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    day INTEGER,
+    date TEXT,
+    pair_number INTEGER,
+    starts_at TEXT,
+    ends_at TEXT,
+    subject TEXT,
+    type TEXT,
+    teacher TEXT,
+    room TEXT,
+    group_id TEXT,
+    notes TEXT,
+    id TEXT,
+    PRIMARY KEY (owner, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS lessons_owner_day ON lessons (owner, day);
+CREATE INDEX IF NOT EXISTS lessons_day ON lessons (day);
+CREATE INDEX IF NOT EXISTS lessons_teacher ON lessons (teacher, day);
+CREATE INDEX IF NOT EXISTS lessons_room ON lessons (room, day);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner TEXT NOT NULL REFERENCES groups(group_id) ON DELETE CASCADE,
+    recorded_at TEXT NOT NULL,
+    op TEXT NOT NULL,
+    key TEXT NOT NULL,
+    lesson TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_owner ON changes (owner, seq);
+-- Changes of a group up to and including ``floor`` are no longer logged
+-- (the group was first stored then, or older entries were pruned).
+CREATE TABLE IF NOT EXISTS change_floors (
+    group_id TEXT PRIMARY KEY REFERENCES groups(group_id) ON DELETE CASCADE,
+    floor INTEGER NOT NULL
+);
+"""
+
+_LESSON_COLUMNS = ", ".join(LESSON_FIELDS)
+
+
+@dataclass
+class StoredGroup:
+    faculty_id: str
+    faculty_name: Optional[str]
+    course_id: str
+    course_name: Optional[str]
+    group_id: str
+    group_name: Optional[str]
+    date_from: dt.date
+    date_to: dt.date
+    last_changed: Optional[str]
+    # Digest of the lesson ids, set by write_group; None for rows written
+    # before it was stored. Derived from the lessons, so cache_builder's
+    # metadata comparison ignores it.
+    fingerprint: Optional[str] = field(default=None, compare=False)
+
+    def covers(self, date_from: dt.date, date_to: dt.date) -> bool:
+        return self.date_from <= date_from and date_to <= self.date_to
+
+
+class LessonStore:
+    """Thread-safe handle on the SQLite schedule database.
+
+    Each thread gets its own connection; instances can be shared freely.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(groups)")}
+        if "fingerprint" not in columns:
+            with conn:
+                conn.execute("ALTER TABLE groups ADD COLUMN fingerprint TEXT")
+
+    # -- writes -------------------------------------------------------------
+
+    def write_group(self, group: StoredGroup, lessons: Optional[List[dict]] = None) -> None:
+        """Atomically replace one group's metadata and lessons.
+
+        With ``lessons=None`` only the metadata row is updated. The lessons'
+        fingerprint is stored with the row, so validators never scan them.
+        """
+        # The connection's context manager wraps everything below in a single
+        # transaction that commits or rolls back as a whole.
+        with self._conn() as conn:
+            existed = conn.execute(
+                "SELECT 1 FROM groups WHERE group_id = ?", (group.group_id,)
+            ).fetchone()
+            conn.execute(
+                "INSERT INTO groups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (group_id) DO UPDATE SET"
+                " faculty_id = excluded.faculty_id, faculty_name = excluded.faculty_name,"
+                " course_id = excluded.course_id, course_name = excluded.course_name,"
+                " group_name = excluded.group_name, date_from = excluded.date_from,"
+                " date_to = excluded.date_to, last_changed = excluded.last_changed,"
+                " fingerprint = COALESCE(excluded.fingerprint, groups.fingerprint)",
+                (
+                    group.group_id,
+                    group.faculty_id,
+                    group.faculty_name,
+                    group.course_id,
+                    group.course_name,
+                    group.group_name,
+                    group.date_from.isoformat(),
+                    group.date_to.isoformat(),
+                    group.last_changed,
+                    None if lessons is None else fingerprint(lesson.get("id") for lesson in lessons),
+                ),
+            )
+            if lessons is None:
+                return
+            if existed:
+                self._log_changes(conn, group, lessons)
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO change_floors VALUES (?, ?)",
+                    (group.group_id, _last_seq(conn)),
+                )
+            conn.execute("DELETE FROM lessons WHERE owner = ?", (group.group_id,))
+            conn.executemany(
+                f"INSERT INTO lessons (owner, position, day, {_LESSON_COLUMNS})"
+                f" VALUES ({', '.join('?' * (len(LESSON_FIELDS) + 3))})",
+                (
+                    (group.group_id, position, _day(lesson.get("date")))
+                    + tuple(lesson.get(name) for name in LESSON_FIELDS)
+                    for position, lesson in enumerate(lessons)
+                ),
+            )
+
+    def _log_changes(self, conn: sqlite3.Connection, group: StoredGroup, lessons: List[dict]) -> None:
+        old = [
+            dict(zip(LESSON_FIELDS, row))
+            for row in conn.execute(
+                f"SELECT {_LESSON_COLUMNS} FROM lessons WHERE owner = ? ORDER BY position",
+                (group.group_id,),
+            )
+        ]
+        recorded_at = group.last_changed or dt.datetime.utcnow().isoformat() + "Z"
+        conn.executemany(
+            "INSERT INTO changes (owner, recorded_at, op, key, lesson) VALUES (?, ?, ?, ?, ?)",
+            (
+                (group.group_id, recorded_at, op, key, json.dumps(lesson, ensure_ascii=False))
+                for op, key, lesson in diff(old, lessons)
+            ),
+        )
+
+    def prune_changes(self, recorded_before: str) -> None:
+        """Forget changes recorded before the given ISO timestamp.
+
+        Clients synced before the oldest remaining change get a full resync.
+        """
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO change_floors"
+                " SELECT owner, MAX(seq) FROM changes WHERE recorded_at < ? GROUP BY owner",
+                (recorded_before,),
+            )
+            conn.execute("DELETE FROM changes WHERE recorded_at < ?", (recorded_before,))
+
+    def delete_groups(self, group_ids: Iterable[str]) -> None:
+        with self._conn() as conn:
+            conn.executemany("DELETE FROM groups WHERE group_id = ?", ((g,) for g in group_ids))
+
+    def write_meta(self, **values: Any) -> None:
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                ((key, json.dumps(value, ensure_ascii=False)) for key, value in values.items()),
+            )
+
+    # -- reads --------------------------------------------------------------
+
+    def meta(self, key: str, default: Any = None) -> Any:
+        row = self._conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def options_tree(self) -> List[dict]:
+        return self.meta("options", [])
+
+    def group(self, group_id: str) -> Optional[StoredGroup]:
+        row = self._conn().execute(
+            "SELECT * FROM groups WHERE group_id = ?", (str(group_id),)
+        ).fetchone()
+        return _stored_group(row) if row else None
+
+    def groups(self) -> List[StoredGroup]:
+        return [_stored_group(row) for row in self._conn().execute("SELECT * FROM groups")]
+
+    def group_keys(
+        self, faculty_id: Optional[str] = None, course: Optional[str] = None
+    ) -> List[Tuple[str, str, str, Optional[str], Optional[str]]]:
+        """``(faculty, course, group id, group name, last changed)`` rows ordered by the first three."""
+        query = (
+            "SELECT faculty_id, course_id, group_id, group_name, last_changed FROM groups WHERE 1 = 1"
+        )
+        params: List[Any] = []
+        if faculty_id is not None:
+            query += " AND faculty_id = ?"
+            params.append(str(faculty_id))
+        if course is not None:
+            query += " AND course_id = ?"
+            params.append(str(course))
+        query += " ORDER BY faculty_id, course_id, group_id"
+        return self._conn().execute(query, params).fetchall()
+
+    def group_ids(self) -> Set[str]:
+        return {row[0] for row in self._conn().execute("SELECT group_id FROM groups")}
+
+    def fingerprint(self, group_id: str) -> str:
+        """Digest of the group's lesson ids in stored order."""
+        rows = self._conn().execute(
+            "SELECT id FROM lessons WHERE owner = ? ORDER BY position", (str(group_id),)
+        )
+        return fingerprint(row[0] for row in rows)
+
+    def lesson_ids(self, group_id: str) -> Set[str]:
+        return {
+            row[0]
+            for row in self._conn().execute("SELECT id FROM lessons WHERE owner = ?", (group_id,))
+        }
+
+    def lessons(
+        self,
+        group_id: str,
+        date_from: Optional[dt.date] = None,
+        date_to: Optional[dt.date] = None,
+    ) -> List[dict]:
+        """Lessons of one group in their original order, optionally by date range."""
+        query = f"SELECT {_LESSON_COLUMNS} FROM lessons WHERE owner = ?"
+        params: List[Any] = [str(group_id)]
+        if date_from is not None:
+            query += " AND day >= ?"
+            params.append(date_from.toordinal())
+        if date_to is not None:
+            query += " AND day <= ?"
+            params.append(date_to.toordinal())
+        query += " ORDER BY position"
+        return [dict(zip(LESSON_FIELDS, row)) for row in self._conn().execute(query, params)]
+
+    def changes_since(self, group_id: str, since: int) -> Tuple[int, Optional[List[Change]]]:
+        """Current version of a group and its changes after version ``since``.
+
+        The change list is None when the log no longer reaches back to
+        ``since`` (or ``since`` is from the future), i.e. a full resync is due.
+        """
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT floor FROM change_floors WHERE group_id = ?", (str(group_id),)
+        ).fetchone()
+        floor = row[0] if row else 0
+        rows = conn.execute(
+            "SELECT seq, op, key, lesson FROM changes WHERE owner = ? AND seq > ? ORDER BY seq",
+            (str(group_id), since),
+        ).fetchall()
+        version = rows[-1][0] if rows else max(floor, self._last_change(group_id))
+        if since < floor or since > version:
+            return version, None
+        return version, [(op, key, json.loads(lesson)) for _, op, key, lesson in rows]
+
+    def _last_change(self, group_id: str) -> int:
+        row = self._conn().execute(
+            "SELECT MAX(seq) FROM changes WHERE owner = ?", (str(group_id),)
+        ).fetchone()
+        return row[0] or 0
+
+    def iter_lessons(self) -> Iterator[Tuple[str, dict]]:
+        """Stream ``(owner group id, lesson)`` for every stored lesson."""
+        cursor = self._conn().execute(
+            f"SELECT owner, {_LESSON_COLUMNS} FROM lessons ORDER BY owner, position"
+        )
+        for row in cursor:
+            yield row[0], dict(zip(LESSON_FIELDS, row[1:]))
+
+    # -- connections --------------------------------------------------------
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+
+class StoreSnapshot:
+    """Snapshot lookups answered from a :class:`LessonStore`.
+
+    Offers the same lookups as :class:`parser.snapshot.ScheduleSnapshot`, but
+    only the small options tree is held in memory; schedules are read per
+    request through the group/date index. The options tree is reloaded, and
+    the teacher and room indexes rebuilt on next use, when the cache builder
+    records a new ``generated_at``.
+    """
+
+    def __init__(self, store: LessonStore) -> None:
+        self.store = store
+        self._lock = threading.Lock()
+        self._version: Optional[str] = None
+        self._indexes: Dict[str, Tuple[Optional[str], Any]] = {}
+        # group id -> (last_changed, fingerprint) for rows without a stored
+        # fingerprint; last_changed moves whenever cache_builder rewrites the
+        # group's lessons.
+        self._fingerprints: Dict[str, Tuple[Optional[str], str]] = {}
+        self._reload_options()
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["StoreSnapshot"]:
+        if not Path(path).exists():
+            return None
+        return cls(LessonStore(path))
+
+    @property
+    def generated_at(self) -> Optional[str]:
+        return self.store.meta("generated_at")
+
+    def options_tree(self) -> List[dict]:
+        self._check_version()
+        return self._tree
+
+    def list_faculties(self) -> Optional[List[OptionItem]]:
+        self._check_version()
+        return self._faculties or None
+
+    def list_courses(self, faculty_id: str) -> Optional[List[OptionItem]]:
+        self._check_version()
+        return self._courses.get(str(faculty_id))
+
+    def list_groups(self, faculty_id: str, course: str) -> Optional[List[OptionItem]]:
+        self._check_version()
+        return self._groups.get((str(faculty_id), str(course)))
+
+    def fetch_schedule(
+        self,
+        faculty_id: str,
+        course: str,
+        group_id: str,
+        *,
+        date_from: Optional[dt.date] = None,
+        date_to: Optional[dt.date] = None,
+    ) -> Optional[Dict[str, object]]:
+        group = self._covering_group(faculty_id, course, group_id, date_from, date_to)
+        if group is None:
+            return None
+        return {
+            "group": {"id": group.group_id, "name": group.group_name},
+            "lessons": self.store.lessons(group.group_id, date_from, date_to),
+        }
+
+    def schedule_changes(
+        self, faculty_id: str, course: str, group_id: str, since: Optional[str] = None
+    ) -> Optional[Dict[str, object]]:
+        """Lesson changes of a group since a version token (see :mod:`parser.changes`).
+
+        Without a usable ``since`` the whole stored schedule is returned.
+        """
+        group = self.store.group(group_id)
+        if group is None or group.faculty_id != str(faculty_id) or group.course_id != str(course):
+            return None
+        info = {"id": group.group_id, "name": group.group_name}
+        client_version = parse_version(since)
+        version, changes = self.store.changes_since(group.group_id, client_version or 0)
+        if client_version is None or changes is None:
+            # Lessons are read after the version: if a rebuild lands in
+            # between, the client merely re-applies a few changes it already
+            # has, and applying by key is idempotent.
+            return sync_payload(info, version, lessons=self.store.lessons(group.group_id))
+        return sync_payload(info, version, changes=changes)
+
+    def schedule_validators(
+        self,
+        faculty_id: str,
+        course: str,
+        group_id: str,
+        *,
+        date_from: Optional[dt.date] = None,
+        date_to: Optional[dt.date] = None,
+    ) -> Optional[Validators]:
+        """ETag/Last-Modified of what :meth:`fetch_schedule` would return, without reading it."""
+        group = self._covering_group(faculty_id, course, group_id, date_from, date_to)
+        if group is None:
+            return None
+        digest = group.fingerprint
+        if digest is None:
+            cached = self._fingerprints.get(group.group_id)
+            if cached is None or cached[0] != group.last_changed:
+                cached = (group.last_changed, self.store.fingerprint(group.group_id))
+                self._fingerprints[group.group_id] = cached
+            digest = cached[1]
+        return schedule_validators(
+            group.group_id, group.group_name, date_from, date_to, digest, group.last_changed
+        )
+
+    def export_groups(
+        self, faculty_id: Optional[str] = None, course: Optional[str] = None
+    ) -> List[Tuple[str, str, str, Optional[str], Optional[str]]]:
+        """``(faculty, course, group id, group name, last changed)`` of stored groups in key order.
+
+        Together with :meth:`export_lessons` this is what :mod:`parser.export` reads.
+        """
+        return self.store.group_keys(faculty_id, course)
+
+    def export_lessons(
+        self,
+        faculty_id: str,
+        course: str,
+        group_id: str,
+        date_from: Optional[dt.date] = None,
+        date_to: Optional[dt.date] = None,
+    ) -> List[dict]:
+        return self.store.lessons(group_id, date_from, date_to)
+
+    def iter_lessons(self) -> Iterator[Tuple[str, dict]]:
+        return self.store.iter_lessons()
+
+    def teacher_index(self) -> TeacherIndex:
+        """Teacher index over all stored lessons, rebuilt after each crawl."""
+        return self._derived_index("teachers", TeacherIndex)
+
+    def room_index(self) -> RoomIndex:
+        """Room occupancy index over all stored lessons, rebuilt after each crawl."""
+        return self._derived_index("rooms", RoomIndex)
+
+    def _derived_index(self, name: str, build: Callable[[Iterator[Tuple[str, dict]]], Any]) -> Any:
+        self._check_version()
+        with self._lock:
+            version, index = self._indexes.get(name, (None, None))
+            if index is None or version != self._version:
+                index = build(self.store.iter_lessons())
+                self._indexes[name] = (self._version, index)
+            return index
+
+    def _covering_group(
+        self,
+        faculty_id: str,
+        course: str,
+        group_id: str,
+        date_from: Optional[dt.date],
+        date_to: Optional[dt.date],
+    ) -> Optional[StoredGroup]:
+        if date_from is None or date_to is None:
+            return None
+        group = self.store.group(group_id)
+        if (
+            group is None
+            or group.faculty_id != str(faculty_id)
+            or group.course_id != str(course)
+            or not group.covers(date_from, date_to)
+        ):
+            return None
+        return group
+
+    def _check_version(self) -> None:
+        if self.store.meta("generated_at") != self._version:
+            self._reload_options()
+
+    def _reload_options(self) -> None:
+        with self._lock:
+            self._version = self.store.meta("generated_at")
+            tree = self.store.options_tree()
+            faculties: List[OptionItem] = []
+            courses: Dict[str, List[OptionItem]] = {}
+            groups: Dict[Tuple[str, str], List[OptionItem]] = {}
+            for faculty in tree:
+                faculty_id = str(faculty["id"])
+                faculties.append(OptionItem(id=faculty_id, name=faculty["name"]))
+                courses[faculty_id] = []
+                for course in faculty.get("courses", []):
+                    course_id = str(course["id"])
+                    courses[faculty_id].append(OptionItem(id=course_id, name=course["name"]))
+                    groups[(faculty_id, course_id)] = [
+                        OptionItem(id=str(group["id"]), name=group["name"])
+                        for group in course.get("groups", [])
+                    ]
+            self._tree, self._faculties, self._courses, self._groups = (
+                tree,
+                faculties,
+                courses,
+                groups,
+            )
+
+
+def _stored_group(row: Tuple[Any, ...]) -> StoredGroup:
+    return StoredGroup(
+        group_id=row[0],
+        faculty_id=row[1],
+        faculty_name=row[2],
+        course_id=row[3],
+        course_name=row[4],
+        group_name=row[5],
+        date_from=dt.date.fromisoformat(row[6]),
+        date_to=dt.date.fromisoformat(row[7]),
+        last_changed=row[8],
+        fingerprint=row[9],
+    )
+
+
+def _last_seq(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+    return row[0] if row else 0
+
+
+def _day(date_str: Optional[str]) -> Optional[int]:
+    try:
+        return dt.datetime.strptime(date_str or "", "%d.%m.%Y").date().toordinal()
+    except ValueError:
+        return None
+
+
+__all__ = ["LESSON_FIELDS", "LessonStore", "StoreSnapshot", "StoredGroup"]
@@ -0,0 +1,268 @@
+"""Compact in-memory storage for lessons.
+
+A semester of lessons as plain dicts costs roughly a kilobyte each, mostly
+for the dict itself and for separate copies of strings such as subject,
+teacher, room and date that repeat thousands of times. :class:`LessonTable`
+keeps one array of small integer codes per field instead, with every
+distinct value stored once in a :class:`ValuePool`, and packs the md5
+lesson ids into 16 raw bytes. Rows are decoded back to the usual lesson
+dict only when a response needs them.
+
+``python -m parser.cache_builder --memory-report`` prints the memory saved
+on the current snapshot (see :func:`memory_report`).
+"""
+from __future__ import annotations
+
+import gc
+import json
+import tracemalloc
+from array import array
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+    overload,
+)
+
+# Key order of lessons built by parse_html_schedule; ``id`` is stored apart.
+FIELDS = (
+    "date",
+    "pair_number",
+    "starts_at",
+    "ends_at",
+    "subject",
+    "type",
+    "teacher",
+    "room",
+    "group_id",
+    "notes",
+)
+
+T = TypeVar("T")
+
+_MISSING = object()  # a key absent from the lesson, as opposed to None
+_KEYS = frozenset(FIELDS) | {"id"}
+_ID_BYTES = 16  # an md5 hex digest, packed
+
+
+class ValuePool:
+    """Dictionary encoding: each distinct value gets a small integer code.
+
+    Code 0 means "key not present". Strings and None are looked up as
+    themselves, anything else together with its type, so ``1``, ``1.0``
+    and ``True`` never share a code.
+    """
+
+    def __init__(self) -> None:
+        self.values: List[Any] = [_MISSING]
+        self.codes: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.values) - 1
+
+    def encode(self, value: Any) -> int:
+        if value is _MISSING:
+            return 0
+        key = value if value is None or value.__class__ is str else (value.__class__, value)
+        code = self.codes.get(key)
+        if code is None:
+            code = self.codes[key] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class LessonTable:
+    """Column store of lessons; rows are addressed by their insertion index.
+
+    Appending is lossless: :meth:`lesson` returns a dict equal to the one
+    appended, including keys outside :data:`FIELDS` and ids that are not
+    md5 digests.
+    """
+
+    def __init__(self, pool: Optional[ValuePool] = None) -> None:
+        self.pool = pool if pool is not None else ValuePool()
+        self._columns: Dict[str, array] = {name: array("I") for name in FIELDS}
+        self._ids = bytearray()
+        # Rare cases kept outside the packed columns, by row.
+        self._odd_ids: Dict[int, Any] = {}
+        self._extras: Dict[int, Dict[str, Any]] = {}
+        self._complete = True  # every row has every field; allows the fast decode
+
+    def __len__(self) -> int:
+        return len(self._ids) // _ID_BYTES
+
+    def append(self, lesson: Dict[str, Any]) -> int:
+        row = len(self)
+        codes, encode = self.pool.codes, self.pool.encode
+        for name, column in self._columns.items():
+            value = lesson.get(name, _MISSING)
+            # Inline hit for the common case: a string or None seen before.
+            code = codes.get(value) if value is None or value.__class__ is str else None
+            if code is None:
+                code = encode(value)
+                if not code:
+                    self._complete = False
+            column.append(code)
+        lesson_id = lesson.get("id", _MISSING)
+        packed = _pack_id(lesson_id)
+        if packed is None:
+            self._odd_ids[row] = lesson_id
+            packed = bytes(_ID_BYTES)
+        self._ids += packed
+        if lesson.keys() - _KEYS:
+            self._extras[row] = {key: value for key, value in lesson.items() if key not in _KEYS}
+        return row
+
+    def extend(self, lessons: Iterable[Dict[str, Any]]) -> "LessonRows":
+        """Append ``lessons`` and return a view of the new rows."""
+        start = len(self)
+        for lesson in lessons:
+            self.append(lesson)
+        return LessonRows(self, range(start, len(self)))
+
+    def lesson(self, row: int) -> Dict[str, Any]:
+        values = self.pool.values
+        if self._complete:
+            lesson = {name: values[column[row]] for name, column in self._columns.items()}
+        else:
+            lesson = {}
+            for name, column in self._columns.items():
+                code = column[row]
+                if code:
+                    lesson[name] = values[code]
+        lesson_id = self.lesson_id(row)
+        if lesson_id is not _MISSING:
+            lesson["id"] = lesson_id
+        if self._extras:
+            lesson.update(self._extras.get(row, ()))
+        return lesson
+
+    def lesson_id(self, row: int) -> Any:
+        if row in self._odd_ids:
+            return self._odd_ids[row]
+        offset = row * _ID_BYTES
+        return self._ids[offset : offset + _ID_BYTES].hex()
+
+    def value(self, row: int, name: str) -> Any:
+        """One field of a row without decoding the rest; None if absent."""
+        if name == "id":
+            lesson_id = self.lesson_id(row)
+            return None if lesson_id is _MISSING else lesson_id
+        column = self._columns.get(name)
+        if column is None:
+            return self._extras.get(row, {}).get(name)
+        value = self.pool.values[column[row]]
+        return None if value is _MISSING else value
+
+    def rows(self, rows: Sequence[int]) -> "LessonRows":
+        return LessonRows(self, rows)
+
+
+class LessonRows(Sequence[Dict[str, Any]]):
+    """Read-only sequence of lesson dicts backed by rows of a :class:`LessonTable`.
+
+    Items are decoded on access, so slicing yields a fresh ``list`` of dicts
+    that callers may keep or serialize.
+    """
+
+    __slots__ = ("table", "_rows")
+
+    def __init__(self, table: LessonTable, rows: Sequence[int]) -> None:
+        self.table = table
+        self._rows = rows
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @overload
+    def __getitem__(self, index: int) -> Dict[str, Any]: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[Dict[str, Any]]: ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            return [self.table.lesson(row) for row in self._rows[index]]
+        return self.table.lesson(self._rows[index])
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        lesson = self.table.lesson
+        return (lesson(row) for row in self._rows)
+
+    def column(self, name: str) -> Iterator[Any]:
+        """Values of one field, in row order, without decoding whole lessons."""
+        value = self.table.value
+        return (value(row, name) for row in self._rows)
+
+
+def memory_report(lessons: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """Measure lessons held as dicts (as loaded from JSON) against a :class:`LessonTable`.
+
+    Sizes are the bytes allocated while building each form, traced with
+    :mod:`tracemalloc`; both forms are built from a JSON round trip of
+    ``lessons``, which reproduces the per-occurrence strings of a loaded
+    ``cache.json``.
+    """
+    encoded = json.dumps(list(lessons), ensure_ascii=False)
+    as_dicts, dict_bytes = _traced(lambda: json.loads(encoded))
+    table, table_bytes = _traced(lambda: _table_of(json.loads(encoded)))
+    return {
+        "lessons": len(as_dicts),
+        "lossless": len(table) == len(as_dicts)
+        and all(table.lesson(row) == lesson for row, lesson in enumerate(as_dicts)),
+        "distinct_values": len(table.pool),
+        "dict_bytes": dict_bytes,
+        "table_bytes": table_bytes,
+        "bytes_per_lesson": {
+            "dicts": round(dict_bytes / max(len(as_dicts), 1)),
+            "table": round(table_bytes / max(len(as_dicts), 1)),
+        },
+        "ratio": round(table_bytes / dict_bytes, 3) if dict_bytes else None,
+    }
+
+
+def _table_of(lessons: Iterable[Dict[str, Any]]) -> LessonTable:
+    table = LessonTable()
+    table.extend(lessons)
+    return table
+
+
+def _traced(build: Callable[[], T]) -> Tuple[T, int]:
+    """Build an object and return it with the bytes it still holds."""
+    gc.collect()
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        gc.collect()
+        return result, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        if started:
+            tracemalloc.stop()
+
+
+def _pack_id(lesson_id: Any) -> Optional[bytes]:
+    # Only canonical (lowercase) digests round-trip through bytes.hex().
+    if isinstance(lesson_id, str) and len(lesson_id) == 2 * _ID_BYTES:
+        try:
+            packed = bytes.fromhex(lesson_id)
+        except ValueError:
+            return None
+        if packed.hex() == lesson_id:
+            return packed
+    return None
+
+
+__all__ = ["FIELDS", "LessonRows", "LessonTable", "ValuePool", "memory_report"]
+
@@ -0,0 +1,378 @@
+"""Prometheus metrics in the text exposition format, without extra dependencies.
+
+Counters, gauges and histograms here only take a per-series lock for a
+couple of additions, so they can sit on the hot path. Both servers expose
+:data:`REGISTRY` at ``/metrics``. The registry holds the upstream and
+parser series defined below and, through collectors, the ``stats()`` of the
+pools and caches each server owns.
+"""
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = bounds
+        # Per-bucket (not cumulative) counts; the last slot is +Inf.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Labels, Any] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str) -> Any:
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    @abstractmethod
+    def _new_child(self) -> Any:
+        """A fresh value for one label combination."""
+
+    @abstractmethod
+    def _samples(self) -> Iterator[str]:
+        """Exposition lines of every label combination."""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class _ScalarMetric(_Metric):
+    """One number per label combination: the common part of counters and gauges."""
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def _samples(self) -> Iterator[str]:
+        for values, child in list(self._children.items()):
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}{labels} {_format_value(child.value)}"
+
+
+class Counter(_ScalarMetric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0) -> None:
+        if amount < 0:
+            raise ValueError(f"{self.name} is a counter and can only increase")
+        self.labels().inc(amount)
+
+
+class Gauge(_ScalarMetric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self) -> Any:
+        return self.labels().time()
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def _samples(self) -> Iterator[str]:
+        names = self.labelnames + ("le",)
+        for values, child in list(self._children.items()):
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(names, values + (_format_value(bound),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    """Metrics plus collectors that turn ``stats()`` dicts into series at scrape time."""
+
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Tuple[str, Callable[[], Optional[Dict[str, Any]]]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, component: str, stats: Callable[[], Optional[Dict[str, Any]]]) -> None:
+        """Expose every number of ``stats()`` as ``schedule_<component>_<key>``.
+
+        Monotonic keys (hits, misses, evictions, ...) become counters named
+        ``schedule_<component>_<key>_total``; the rest are gauges. A
+        ``hit_ratio`` is derived from ``hits``/``misses`` when the stats have
+        those but no ratio of their own.
+        """
+        with self._lock:
+            self._collectors.append((component, stats))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for component, stats in collectors:
+            lines.extend(_stats_lines(component, stats()))
+        return "\n".join(lines) + "\n"
+
+
+# ``stats()`` keys that only ever grow; they are exported as counters with
+# a ``_total`` suffix. Every other number (sizes, levels, ratios, limits,
+# maxima and averages) is a gauge.
+_STATS_COUNTERS = frozenset({
+    "admitted",
+    "calls",
+    "checkouts",
+    "coalesced",
+    "compressions",
+    "decreases",
+    "discarded",
+    "evictions",
+    "executions",
+    "expired",
+    "failures",
+    "fetches",
+    "hits",
+    "invalidations",
+    "misses",
+    "queued",
+    "refresh_errors",
+    "refreshes",
+    "rejected",
+    "renders",
+    "shared_waits",
+    "slow",
+    "stale_hits",
+    "stale_served",
+    "trips",
+    "wait_seconds_total",
+    "waits",
+})
+
+
+def _stats_lines(component: str, stats: Optional[Dict[str, Any]]) -> Iterator[str]:
+    if not stats:
+        return
+    values = {
+        key: value
+        for key, value in stats.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    }
+    if "hit_ratio" not in values and "hits" in values and "misses" in values:
+        lookups = values["hits"] + values["misses"]
+        values["hit_ratio"] = round(values["hits"] / lookups, 4) if lookups else 0.0
+    for key, value in values.items():
+        name = f"schedule_{component}_{key}"
+        if key in _STATS_COUNTERS:
+            if not name.endswith("_total"):
+                name += "_total"
+            yield f"# HELP {name} Cumulative {key} since start ({component} stats)."
+            yield f"# TYPE {name} counter"
+        else:
+            yield f"# HELP {name} Current {key} ({component} stats)."
+            yield f"# TYPE {name} gauge"
+        yield f"{name} {_format_value(value)}"
+
+
+REGISTRY = Registry()
+
+UPSTREAM_SECONDS = REGISTRY.register(Histogram(
+    "schedule_upstream_request_seconds",
+    "Time of HTTP round trips to cacs.spa.msu.ru by form step.",
+    ["step"],
+))
+UPSTREAM_ERRORS = REGISTRY.register(Counter(
+    "schedule_upstream_errors_total",
+    "Failed HTTP round trips to cacs.spa.msu.ru by form step.",
+    ["step"],
+))
+UPSTREAM_IN_FLIGHT = REGISTRY.register(Gauge(
+    "schedule_upstream_in_flight",
+    "HTTP requests to cacs.spa.msu.ru currently waiting for a response.",
+))
+PARSE_SECONDS = REGISTRY.register(Histogram(
+    "schedule_parse_seconds",
+    "Time parse_html_schedule takes per schedule page.",
+))
+PARSE_LESSONS = REGISTRY.register(Histogram(
+    "schedule_parse_lessons",
+    "Lessons parse_html_schedule finds per schedule page.",
+    buckets=COUNT_BUCKETS,
+))
+HTTP_SECONDS = REGISTRY.register(Histogram(
+    "schedule_http_request_duration_seconds",
+    "Latency of requests served by this API, by route template and status.",
+    ["method", "route", "status"],
+))
+
+
+@contextmanager
+def upstream_request(step: str) -> Iterator[None]:
+    """Time one upstream round trip; an exception inside counts as an error."""
+    UPSTREAM_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        UPSTREAM_ERRORS.labels(step).inc()
+        raise
+    finally:
+        UPSTREAM_IN_FLIGHT.dec()
+        UPSTREAM_SECONDS.labels(step).observe(time.perf_counter() - started)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording :data:`HTTP_SECONDS` for every HTTP request.
+
+    Requests are labelled with the matched route's path template (e.g.
+    ``/teacher/{name}/schedule``), so label cardinality stays bounded.
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_SECONDS.labels(scope["method"], route, str(status[0])).observe(
+                time.perf_counter() - started
+            )
+
+
+__all__ = [
+    "CONTENT_TYPE",
+    "COUNT_BUCKETS",
+    "Counter",
+    "DEFAULT_BUCKETS",
+    "Gauge",
+    "HTTP_SECONDS",
+    "Histogram",
+    "MetricsMiddleware",
+    "PARSE_LESSONS",
+    "PARSE_SECONDS",
+    "REGISTRY",
+    "Registry",
+    "UPSTREAM_ERRORS",
+    "UPSTREAM_IN_FLIGHT",
+    "UPSTREAM_SECONDS",
+    "upstream_request",
+]
@@ -0,0 +1,161 @@
+"""TTL cache with stale-while-revalidate for faculty/course/group option lists."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set
+
+from .governor import CRAWL, lane
+from .singleflight import AsyncSingleFlight, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 3600.0
+
+
+@dataclass
+class _Entry:
+    value: Any
+    loaded_at: float
+
+
+class OptionsCache:
+    """Caches option lists keyed by e.g. ``("courses", faculty_id)``.
+
+    Fresh entries (younger than ``ttl``) are returned as hits. Expired entries
+    are still returned immediately, and a single background refresh per key
+    replaces them; entries older than ``ttl + max_stale`` are reloaded inline.
+    Missing keys are loaded inline, once per key however many callers miss
+    it at the same time; the others wait for and share that load (see
+    :mod:`parser.singleflight`). Failed loads are not cached: inline
+    failures propagate, background failures are logged and keep the stale
+    value.
+
+    ``get`` refreshes in a daemon thread and suits the sync server; ``aget``
+    takes a coroutine loader and refreshes in an asyncio task. Background
+    refreshes go upstream in the crawl lane, behind user requests.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_stale: Optional[float] = None) -> None:
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._entries: Dict[Hashable, _Entry] = {}
+        self._refreshing: Set[Hashable] = set()
+        self._tasks: Set["asyncio.Task[None]"] = set()
+        self._flights = SingleFlight()
+        self._aflights = AsyncSingleFlight()
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "refresh_errors": 0,
+            "invalidations": 0,
+        }
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        entry, refresh = self._lookup(key)
+        if entry is None:
+            return self._flights.do(key, lambda: self._store(key, loader()))
+        if refresh:
+            threading.Thread(
+                target=self._refresh, args=(key, loader), name="options-refresh", daemon=True
+            ).start()
+        return entry.value
+
+    async def aget(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        entry, refresh = self._lookup(key)
+        if entry is None:
+            return await self._aflights.do(key, lambda: self._aload(key, loader))
+        if refresh:
+            task = asyncio.create_task(self._arefresh(key, loader))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return entry.value
+
+    def invalidate(self, key: Optional[Hashable] = None) -> int:
+        """Drop one key, or everything when ``key`` is None; returns entries dropped."""
+        with self._lock:
+            self._counters["invalidations"] += 1
+            if key is None:
+                dropped = len(self._entries)
+                self._entries.clear()
+                return dropped
+            return 1 if self._entries.pop(key, None) is not None else 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["stale_hits"] + self._counters["misses"]
+            served = self._counters["hits"] + self._counters["stale_hits"]
+            return {
+                **self._counters,
+                "coalesced": self._flights.stats()["coalesced"] + self._aflights.stats()["coalesced"],
+                "size": len(self._entries),
+                "hit_ratio": round(served / lookups, 4) if lookups else 0.0,
+                "ttl": self.ttl,
+            }
+
+    # -- internals --------------------------------------------------------
+
+    def _lookup(self, key: Hashable) -> "tuple[Optional[_Entry], bool]":
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = now - entry.loaded_at
+                if age < self.ttl:
+                    self._counters["hits"] += 1
+                    return entry, False
+                if self.max_stale is None or age < self.ttl + self.max_stale:
+                    self._counters["stale_hits"] += 1
+                    refresh = key not in self._refreshing
+                    if refresh:
+                        self._refreshing.add(key)
+                    return entry, refresh
+            self._counters["misses"] += 1
+            return None, False
+
+    def _store(self, key: Hashable, value: Any) -> Any:
+        with self._lock:
+            self._entries[key] = _Entry(value, time.monotonic())
+        return value
+
+    async def _aload(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        return self._store(key, await loader())
+
+    def _refresh(self, key: Hashable, loader: Callable[[], Any]) -> None:
+        try:
+            with lane(CRAWL):
+                value = loader()
+        except Exception as exc:  # noqa: BLE001
+            self._refresh_failed(key, exc)
+        else:
+            self._refresh_done(key, value)
+
+    async def _arefresh(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            with lane(CRAWL):
+                value = await loader()
+        except Exception as exc:  # noqa: BLE001
+            self._refresh_failed(key, exc)
+        else:
+            self._refresh_done(key, value)
+
+    def _refresh_done(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._refreshing.discard(key)
+            self._counters["refreshes"] += 1
+            self._entries[key] = _Entry(value, time.monotonic())
+
+    def _refresh_failed(self, key: Hashable, exc: Exception) -> None:
+        with self._lock:
+            self._refreshing.discard(key)
+            self._counters["refresh_errors"] += 1
+        logger.warning("Background refresh of %r failed: %s", key, exc)
+
+
+__all__ = ["OptionsCache", "DEFAULT_TTL"]
@@ -2,14 +2,17 @@ from __future__ import annotations
 
 import hashlib
 import json
+import os
 import re
 from datetime import date as Date, datetime
 from pathlib import Path
-from typing import Any, List, Optional, Sequence, Tuple, Union
+from typing import Any, Callable, List, Optional, Sequence, Tuple, Union
 
 from bs4 import BeautifulSoup, Tag
 
-HtmlSource = Union[str, bytes, Path]
+from .timing import EXTRACT, HTML_TREE, timed
+
+HtmlSource = Union[str, bytes, Path, Tag]
 
 _PAIR_RE = re.compile(r"(\d+)")
 _TIME_RANGE_RE = re.compile(r"^(\d{1,2}:\d{2})\s*[-–]\s*(\d{1,2}:\d{2})$")
@@ -24,16 +27,67 @@ _NOTE_PREFIXES = (
 )
 
 
+DEFAULT_BACKEND = os.environ.get("SCHEDULE_PARSER_BACKEND", "bs4")
+
+
 def parse_html_schedule(
     html: HtmlSource,
     *,
     group_id: Optional[str] = None,
     date_from: Optional[Date] = None,
     date_to: Optional[Date] = None,
+    backend: Optional[str] = None,
+) -> List[dict[str, Any]]:
+    """Parse the SPA timetable HTML page and return lesson dictionaries.
+
+    ``html`` may be markup (string, bytes, path) or an already parsed
+    BeautifulSoup or lxml document (or its ``table#timeTable`` node), which
+    is walked in place without re-parsing. For markup, ``backend`` selects the tree
+    implementation: ``"bs4"`` (the reference BeautifulSoup/html.parser walk)
+    or ``"lxml"`` (libxml2, several times faster). Both produce identical
+    lessons. The default comes from the ``SCHEDULE_PARSER_BACKEND``
+    environment variable.
+    """
+    with timed(EXTRACT):
+        if isinstance(html, Tag):
+            lessons = _extract_bs4(html, group_id, date_from, date_to)
+        elif _is_lxml_tree(html):
+            lessons = _extract_lxml(html, group_id, date_from, date_to)
+        else:
+            name = backend or DEFAULT_BACKEND
+            try:
+                extract = _BACKENDS[name]
+            except KeyError:
+                raise ValueError(
+                    f"Unknown parser backend {name!r}; expected one of {sorted(_BACKENDS)}"
+                ) from None
+            lessons = extract(_ensure_html(html), group_id, date_from, date_to)
+        lessons.sort(
+            key=lambda item: (
+                _date_key(item["date"]),
+                item.get("pair_number") or 0,
+                item.get("starts_at") or "",
+                item.get("subject") or "",
+            )
+        )
+    return lessons
+
+
+def _extract_bs4(
+    html: Union[str, Tag],
+    group_id: Optional[str],
+    date_from: Optional[Date],
+    date_to: Optional[Date],
 ) -> List[dict[str, Any]]:
-    """Parse the SPA timetable HTML page and return lesson dictionaries."""
-    soup = BeautifulSoup(_ensure_html(html), "html.parser")
-    table = soup.select_one("table#timeTable")
+    if isinstance(html, Tag):
+        node = html
+    else:
+        with timed(HTML_TREE):
+            node = BeautifulSoup(html, "html.parser")
+    if node.name == "table" and node.get("id") == "timeTable":
+        table: Optional[Tag] = node
+    else:
+        table = node.select_one("table#timeTable")
     if table is None:
         return []
 
@@ -74,18 +128,116 @@ def parse_html_schedule(
                 )
                 if lesson:
                     lessons.append(lesson)
+    return lessons
 
-    lessons.sort(
-        key=lambda item: (
-            _date_key(item["date"]),
-            item.get("pair_number") or 0,
-            item.get("starts_at") or "",
-            item.get("subject") or "",
-        )
-    )
+
+def _extract_lxml(
+    html: Any,
+    group_id: Optional[str],
+    date_from: Optional[Date],
+    date_to: Optional[Date],
+) -> List[dict[str, Any]]:
+    if _is_lxml_tree(html):
+        root = html
+    else:
+        with timed(HTML_TREE):
+            root = lxml_root(html)
+    if root.tag == "table" and root.get("id") == "timeTable":
+        tables = [root]
+    else:
+        tables = root.xpath("//table[@id='timeTable']")
+    if not tables:
+        return []
+
+    lessons: List[dict[str, Any]] = []
+    current_dates: List[str] = []
+
+    # Mirrors _extract_bs4 step by step; find()/select() there search all
+    # descendants, hence iter() rather than direct children here.
+    for row in tables[0].iter("tr"):
+        cells = [el for el in row.iter("th") if el is not row]
+        if any(_lxml_has_class(th, "headday") for th in cells):
+            current_dates = [
+                lxml_text(th) for th in cells if _lxml_has_class(th, "headdate")
+            ]
+            continue
+
+        headcol = next((th for th in cells if _lxml_has_class(th, "headcol")), None)
+        if headcol is None or not current_dates:
+            continue
+
+        pair_number = _parse_pair_number_text(_lxml_child_text(headcol, "lesson"))
+        starts_at = _lxml_child_text(headcol, "start") or None
+        ends_at = _lxml_child_text(headcol, "end") or None
+
+        for column_idx, cell in enumerate(el for el in row.iter("td") if el is not row):
+            if column_idx >= len(current_dates):
+                continue
+            date_str = current_dates[column_idx]
+            if not date_str:
+                continue
+            if not _within_range(date_str, date_from, date_to):
+                continue
+
+            for block in cell.iter("div"):
+                if block is cell or block.get("data-toggle") != "popover":
+                    continue
+                lesson = _lesson_from_content(
+                    block.get("data-content", ""),
+                    lambda node=block: [
+                        text.strip() for text in node.itertext() if text.strip()
+                    ],
+                    date_str,
+                    pair_number,
+                    starts_at,
+                    ends_at,
+                    group_id,
+                )
+                if lesson:
+                    lessons.append(lesson)
     return lessons
 
 
+def lxml_root(html: str) -> Any:
+    """Parse markup into an lxml document root (the ``"lxml"`` backend's tree)."""
+    try:
+        from lxml import html as lxml_html
+    except ImportError:
+        raise RuntimeError("The 'lxml' parser backend requires the lxml package") from None
+    return lxml_html.fromstring(
+        html.encode("utf-8"), parser=lxml_html.HTMLParser(encoding="utf-8")
+    )
+
+
+def _is_lxml_tree(html: Any) -> bool:
+    # Duck-typed so that lxml stays an optional import.
+    return not isinstance(html, (str, bytes, bytearray, Path)) and hasattr(html, "xpath")
+
+
+def _lxml_has_class(el: Any, name: str) -> bool:
+    return name in (el.get("class") or "").split()
+
+
+def lxml_text(el: Any) -> str:
+    """Text of an lxml element, stripped piecewise like ``get_text(strip=True)``."""
+    return "".join(text.strip() for text in el.itertext())
+
+
+def _lxml_child_text(el: Any, class_name: str) -> Optional[str]:
+    for child in el.iterdescendants():
+        if isinstance(child.tag, str) and _lxml_has_class(child, class_name):
+            return lxml_text(child)
+    return None
+
+
+_BACKENDS: dict[str, Callable[..., List[dict[str, Any]]]] = {
+    "bs4": _extract_bs4,
+    "lxml": _extract_lxml,
+}
+# Names accepted as ``backend`` here and by :func:`parser.form_page.parse_form_page`.
+BACKENDS = tuple(_BACKENDS)
+
+
 def _build_lesson(
     node: Tag,
     date_str: str,
@@ -94,7 +246,27 @@ def _build_lesson(
     ends_at: Optional[str],
     fallback_group: Optional[str],
 ) -> Optional[dict[str, Any]]:
-    raw_parts = node.get("data-content", "").split("<br>")
+    return _lesson_from_content(
+        node.get("data-content", ""),
+        lambda: list(node.stripped_strings),
+        date_str,
+        pair_number,
+        starts_at,
+        ends_at,
+        fallback_group,
+    )
+
+
+def _lesson_from_content(
+    content: str,
+    text_parts_of: Callable[[], List[str]],
+    date_str: str,
+    pair_number: Optional[int],
+    starts_at: Optional[str],
+    ends_at: Optional[str],
+    fallback_group: Optional[str],
+) -> Optional[dict[str, Any]]:
+    raw_parts = content.split("<br>")
     parts = [part.strip() for part in raw_parts if part and part.strip()]
 
     override = None
@@ -124,15 +296,18 @@ def _build_lesson(
     if note_parts:
         notes = " ".join(note_parts)
 
-    text_parts = list(node.stripped_strings)
-    if subject is None and text_parts:
-        subject = text_parts[0]
-    if lesson_type is None:
-        lesson_type = _extract_type_from_text(text_parts)
-    if room is None:
-        room = _extract_room(text_parts)
-    if teacher is None:
-        teacher = _extract_teacher(text_parts)
+    # The popover's own text is only a fallback; skip walking it when the
+    # data-content attribute already provided every field.
+    if subject is None or lesson_type is None or room is None or teacher is None:
+        text_parts = text_parts_of()
+        if subject is None and text_parts:
+            subject = text_parts[0]
+        if lesson_type is None:
+            lesson_type = _extract_type_from_text(text_parts)
+        if room is None:
+            room = _extract_room(text_parts)
+        if teacher is None:
+            teacher = _extract_teacher(text_parts)
 
     if override:
         match = _TIME_RANGE_RE.match(override)
@@ -184,7 +359,13 @@ def _text_or_none(node: Optional[Tag]) -> Optional[str]:
 def _parse_pair_number(node: Optional[Tag]) -> Optional[int]:
     if not node:
         return None
-    match = _PAIR_RE.search(node.get_text(strip=True))
+    return _parse_pair_number_text(node.get_text(strip=True))
+
+
+def _parse_pair_number_text(text: Optional[str]) -> Optional[int]:
+    if text is None:
+        return None
+    match = _PAIR_RE.search(text)
     if match:
         try:
             return int(match.group(1))
@@ -265,25 +446,44 @@ def _looks_like_note(value: str) -> bool:
     return lowered.startswith(_NOTE_PREFIXES)
 
 
+_LESSON_FIELDS = (
+    "date",
+    "pair_number",
+    "starts_at",
+    "ends_at",
+    "subject",
+    "type",
+    "teacher",
+    "room",
+    "group_id",
+    "notes",
+)
+# "Обновлено: ..."-style notes annotate a lesson without making it a
+# different one, so they are left out of its identity.
+_IDENTITY_FIELDS = tuple(field for field in _LESSON_FIELDS if field != "notes")
+
+
+def lesson_key(lesson: dict[str, Any]) -> str:
+    """Identity of a lesson that, unlike its ``id``, survives edits to ``notes``."""
+    return _digest(lesson, _IDENTITY_FIELDS)
+
+
 def _hash_payload(payload: dict[str, Any]) -> str:
-    basis = {
-        key: payload.get(key)
-        for key in (
-            "date",
-            "pair_number",
-            "starts_at",
-            "ends_at",
-            "subject",
-            "type",
-            "teacher",
-            "room",
-            "group_id",
-            "notes",
-        )
-    }
+    return _digest(payload, _LESSON_FIELDS)
+
+
+def _digest(payload: dict[str, Any], fields: Sequence[str]) -> str:
+    basis = {key: payload.get(key) for key in fields}
     return hashlib.md5(
         json.dumps(basis, ensure_ascii=False, sort_keys=True).encode("utf-8")
     ).hexdigest()
 
 
-__all__ = ["parse_html_schedule"]
+__all__ = [
+    "BACKENDS",
+    "DEFAULT_BACKEND",
+    "lesson_key",
+    "lxml_root",
+    "lxml_text",
+    "parse_html_schedule",
+]
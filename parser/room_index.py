@@ -0,0 +1,89 @@
+"""Room occupancy index: free rooms per slot and per-room timetables."""
+from __future__ import annotations
+
+import datetime as dt
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .search_index import normalize
+from .teacher_index import Timeline, build_timelines
+
+_ROOM_PREFIX_RE = re.compile(r"^\s*(ауд|каб)\w*\.?\s*", re.IGNORECASE)
+# Rooms that are not a physical place and can never be "free".
+_VIRTUAL_TOKENS = ("zoom", "онлайн", "дистан", "teams", "webinar", "вебинар")
+
+
+def room_key(name: str) -> str:
+    """Lookup key for a room: "ауд. Г 608", "Г-608" and "г608" are the same room."""
+    return normalize(_ROOM_PREFIX_RE.sub("", name))
+
+
+class RoomIndex:
+    """Occupancy of every room seen in the snapshot.
+
+    Rooms are numbered in name order and each ``(day, pair number)`` slot
+    keeps an integer bitset of the rooms busy in it. Finding free rooms is
+    then one dictionary lookup per pair and a couple of integer operations,
+    independent of how many groups or lessons the semester has. Per-room
+    timetables are :class:`~parser.teacher_index.Timeline` objects.
+    Lessons without a pair number are only in the timetables.
+    """
+
+    def __init__(self, lessons: Iterable[Tuple[str, dict]]) -> None:
+        self._timelines = build_timelines(lessons, _rooms, room_key)
+        keys = sorted(self._timelines, key=lambda key: self._timelines[key].name)
+        self._names: List[str] = [self._timelines[key].name for key in keys]
+        self._bits: Dict[str, int] = {key: 1 << idx for idx, key in enumerate(keys)}
+        self._physical = 0
+        for key, bit in self._bits.items():
+            if not _is_virtual(key):
+                self._physical |= bit
+
+        self._busy: Dict[int, Dict[int, int]] = {}
+        for key, timeline in self._timelines.items():
+            bit = self._bits[key]
+            for pair, day in zip(timeline.lessons.column("pair_number"), timeline.day_ordinals()):
+                if pair is None:
+                    continue
+                slots = self._busy.setdefault(day, {})
+                slots[pair] = slots.get(pair, 0) | bit
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def get(self, name: str) -> Optional[Timeline]:
+        return self._timelines.get(room_key(name))
+
+    def rooms(self) -> List[str]:
+        return list(self._names)
+
+    def free_rooms(self, day: dt.date, pairs: Iterable[int]) -> List[str]:
+        """Physical rooms with no lesson on ``day`` during any of ``pairs``."""
+        slots = self._busy.get(day.toordinal(), {})
+        busy = 0
+        for pair in pairs:
+            busy |= slots.get(pair, 0)
+        return self._decode(self._physical & ~busy)
+
+    def busy_rooms(self, day: dt.date, pair: int) -> List[str]:
+        return self._decode(self._busy.get(day.toordinal(), {}).get(pair, 0))
+
+    def _decode(self, mask: int) -> List[str]:
+        names = []
+        while mask:
+            low = mask & -mask
+            names.append(self._names[low.bit_length() - 1])
+            mask ^= low
+        return names
+
+
+def _rooms(lesson: dict) -> List[str]:
+    room = (lesson.get("room") or "").strip()
+    return [room] if room else []
+
+
+def _is_virtual(key: str) -> bool:
+    return any(token in key for token in _VIRTUAL_TOKENS)
+
+
+__all__ = ["RoomIndex", "room_key"]
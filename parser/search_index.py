@@ -0,0 +1,184 @@
+"""In-memory n-gram index for searching groups by name."""
+from __future__ import annotations
+
+import logging
+import re
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD_RE = re.compile(r"[\W_]+")
+# Minimum trigram similarity for a typo-tolerant match.
+_FUZZY_THRESHOLD = 0.3
+
+# Rank tiers, best first.
+_EXACT, _PREFIX, _SUBSTRING, _FUZZY = range(4)
+
+
+@dataclass(frozen=True)
+class GroupRef:
+    id: str
+    name: str
+    faculty_id: str
+    faculty_name: str
+    course: str
+    course_name: str
+
+    def to_dict(self) -> Dict[str, str]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "faculty_id": self.faculty_id,
+            "faculty_name": self.faculty_name,
+            "course": self.course,
+            "course_name": self.course_name,
+        }
+
+
+def normalize(value: str) -> str:
+    """Case-fold, treat ё as е and drop separators such as spaces and dashes."""
+    return _NON_WORD_RE.sub("", value.casefold().replace("ё", "е"))
+
+
+class GroupSearchIndex:
+    """Ranked, typo-tolerant lookup over group names.
+
+    Every 1-, 2- and 3-gram of each normalized name is indexed, so substring
+    queries of up to three characters are a single dictionary lookup and
+    longer ones intersect trigram posting lists. Queries that find too few
+    substring matches are topped up with names sharing enough trigrams.
+    """
+
+    def __init__(self, groups: Iterable[GroupRef]) -> None:
+        self._groups: List[GroupRef] = list(groups)
+        self._names: List[str] = [normalize(group.name) for group in self._groups]
+        self._grams: Dict[str, Set[int]] = {}
+        self._trigram_counts: List[int] = []
+        for idx, name in enumerate(self._names):
+            for size in (1, 2, 3):
+                for gram in _ngrams(name, size):
+                    self._grams.setdefault(gram, set()).add(idx)
+            self._trigram_counts.append(len(set(_ngrams(name, 3))))
+
+    @classmethod
+    def from_options_tree(cls, faculties: List[dict]) -> "GroupSearchIndex":
+        """Build from the ``faculties -> courses -> groups`` tree of cache_builder."""
+        return cls(
+            GroupRef(
+                id=str(group["id"]),
+                name=group["name"],
+                faculty_id=str(faculty["id"]),
+                faculty_name=faculty["name"],
+                course=str(course["id"]),
+                course_name=course["name"],
+            )
+            for faculty in faculties
+            for course in faculty.get("courses", [])
+            for group in course.get("groups", [])
+        )
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def search(self, query: str, limit: Optional[int] = 50) -> List[GroupRef]:
+        needle = normalize(query)
+        if not needle:
+            return []
+
+        ranked: Dict[int, Tuple[int, float]] = {}
+        for idx in self._substring_candidates(needle):
+            name = self._names[idx]
+            if name == needle:
+                ranked[idx] = (_EXACT, 0.0)
+            elif name.startswith(needle):
+                ranked[idx] = (_PREFIX, 0.0)
+            elif needle in name:
+                ranked[idx] = (_SUBSTRING, float(name.index(needle)))
+
+        if len(needle) >= 3 and (limit is None or len(ranked) < limit):
+            for idx, similarity in self._fuzzy_candidates(needle):
+                ranked.setdefault(idx, (_FUZZY, -similarity))
+
+        order = sorted(
+            ranked,
+            key=lambda idx: (*ranked[idx], len(self._names[idx]), self._names[idx]),
+        )
+        if limit is not None:
+            order = order[:limit]
+        return [self._groups[idx] for idx in order]
+
+    def _substring_candidates(self, needle: str) -> Set[int]:
+        if len(needle) <= 3:
+            return self._grams.get(needle, set())
+        postings = sorted(
+            (self._grams.get(gram, set()) for gram in set(_ngrams(needle, 3))),
+            key=len,
+        )
+        return set.intersection(*postings) if postings else set()
+
+    def _fuzzy_candidates(self, needle: str) -> List[Tuple[int, float]]:
+        trigrams = set(_ngrams(needle, 3))
+        shared: Dict[int, int] = {}
+        for gram in trigrams:
+            for idx in self._grams.get(gram, ()):
+                shared[idx] = shared.get(idx, 0) + 1
+        matches = []
+        for idx, common in shared.items():
+            similarity = common / (len(trigrams) + self._trigram_counts[idx] - common)
+            if similarity >= _FUZZY_THRESHOLD:
+                matches.append((idx, similarity))
+        return matches
+
+
+class SearchIndexRefresher:
+    """Keeps a :class:`GroupSearchIndex` current from a background thread.
+
+    ``load_tree`` returns the options tree (see
+    :meth:`GroupSearchIndex.from_options_tree`). It is called once by
+    :meth:`start` and then every ``interval`` seconds. Readers keep using the
+    previous index until a rebuild finishes, and failed rebuilds are logged
+    and retried on the next tick.
+    """
+
+    def __init__(self, load_tree: Callable[[], List[dict]], interval: float = 6 * 3600) -> None:
+        self._load_tree = load_tree
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.index: Optional[GroupSearchIndex] = None
+
+    def refresh(self) -> None:
+        try:
+            self.index = GroupSearchIndex.from_options_tree(self._load_tree())
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Failed to rebuild group search index: %s", exc)
+        else:
+            logger.info("Group search index rebuilt with %d groups", len(self.index))
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="search-index", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            self.refresh()
+            if self._stop.wait(self._interval):
+                return
+
+
+def _ngrams(value: str, size: int) -> List[str]:
+    return [value[i : i + size] for i in range(len(value) - size + 1)]
+
+
+__all__ = ["GroupRef", "GroupSearchIndex", "SearchIndexRefresher", "normalize"]
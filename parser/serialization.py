@@ -0,0 +1,59 @@
+"""Model-free JSON rendering of schedule responses.
+
+Lesson dicts produced by :mod:`parser.parse_html_schedule` (and read back
+from the snapshot) already have the shape of the API's ``Lesson`` model, so
+hot endpoints encode them straight to bytes instead of building and
+re-validating one pydantic object per lesson. The output is byte-identical
+to FastAPI's ``JSONResponse`` rendering of the same models.
+"""
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, Iterable, Optional
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib encoder is the fallback
+    orjson = None
+
+# Field order of the API ``Lesson`` model, which fixes the key order on the wire.
+LESSON_FIELDS = (
+    "id",
+    "date",
+    "pair_number",
+    "starts_at",
+    "ends_at",
+    "subject",
+    "type",
+    "teacher",
+    "room",
+    "group_id",
+    "notes",
+)
+
+
+def dumps(content: Any) -> bytes:
+    """Compact UTF-8 JSON, as rendered by ``JSONResponse``."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def project_lesson(lesson: Dict[str, Any]) -> Dict[str, Any]:
+    """The ``Lesson`` model's fields of a lesson dict, in model order."""
+    return {field: lesson.get(field) for field in LESSON_FIELDS}
+
+
+def schedule_body(group_id: str, group_name: Optional[str], lessons: Iterable[Dict[str, Any]]) -> bytes:
+    """``ScheduleResponse`` JSON for already-parsed lessons."""
+    return dumps(
+        {
+            "group": {"id": group_id, "name": group_name},
+            "lessons": [project_lesson(lesson) for lesson in lessons],
+        }
+    )
+
+
+__all__ = ["LESSON_FIELDS", "dumps", "project_lesson", "schedule_body"]
@@ -0,0 +1,273 @@
+"""Bounded pools of pre-warmed schedule clients.
+
+``SpaScheduleClient`` keeps per-instance form and CSRF state, so a client must
+only serve one request at a time. The pools below hand out clients exclusively,
+refresh their upstream state once it gets old and drop clients whose state may
+have been left half-updated by a failed request. A request refused by the
+open circuit (see :mod:`parser.governor`) never reached upstream, so its
+client goes back to the pool.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Dict, Generic, Iterator, Optional, TypeVar
+
+from .async_client import AsyncSpaScheduleClient
+from .governor import CircuitOpen
+from .spa_client import SpaScheduleClient
+
+logger = logging.getLogger(__name__)
+
+ClientT = TypeVar("ClientT")
+
+DEFAULT_POOL_SIZE = 4
+# Upstream CSRF tokens are tied to the PHP session; refresh well before the
+# default 24 minute session lifetime runs out.
+DEFAULT_MAX_AGE = 15 * 60
+
+
+class PoolTimeout(RuntimeError):
+    """Raised when no client becomes available within the checkout timeout."""
+
+
+@dataclass
+class PoolStats:
+    size: int
+    created: int = 0
+    in_use: int = 0
+    checkouts: int = 0
+    waits: int = 0
+    wait_seconds_total: float = 0.0
+    wait_seconds_max: float = 0.0
+    refreshes: int = 0
+    discarded: int = 0
+
+    def record_wait(self, seconds: float) -> None:
+        self.checkouts += 1
+        self.wait_seconds_total += seconds
+        if seconds > 0.001:
+            self.waits += 1
+        if seconds > self.wait_seconds_max:
+            self.wait_seconds_max = seconds
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "size": self.size,
+            "created": self.created,
+            "in_use": self.in_use,
+            "checkouts": self.checkouts,
+            "waits": self.waits,
+            "wait_seconds_total": round(self.wait_seconds_total, 6),
+            "wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 6)
+            if self.checkouts
+            else 0.0,
+            "wait_seconds_max": round(self.wait_seconds_max, 6),
+            "refreshes": self.refreshes,
+            "discarded": self.discarded,
+        }
+
+
+@dataclass
+class _Entry(Generic[ClientT]):
+    client: ClientT
+    warmed_at: float = field(default_factory=time.monotonic)
+
+    def expired(self, max_age: float) -> bool:
+        return time.monotonic() - self.warmed_at > max_age
+
+
+class ClientPool:
+    """Thread-safe pool of ``SpaScheduleClient`` instances."""
+
+    def __init__(
+        self,
+        factory: Callable[[], SpaScheduleClient] = SpaScheduleClient,
+        *,
+        size: int = DEFAULT_POOL_SIZE,
+        max_age: float = DEFAULT_MAX_AGE,
+        timeout: Optional[float] = 60.0,
+    ) -> None:
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self._factory = factory
+        self._max_age = max_age
+        self._timeout = timeout
+        self._idle: "queue.LifoQueue[_Entry[SpaScheduleClient]]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._stats = PoolStats(size=size)
+
+    def warm(self) -> None:
+        """Fill the pool with clients that already hold valid CSRF state."""
+        while True:
+            with self._lock:
+                if self._stats.created >= self._stats.size:
+                    return
+                self._stats.created += 1
+            try:
+                self._idle.put(self._new_entry())
+            except Exception as exc:  # noqa: BLE001
+                with self._lock:
+                    self._stats.created -= 1
+                logger.warning("Failed to pre-warm schedule client: %s", exc)
+                return
+
+    @contextmanager
+    def checkout(self) -> Iterator[SpaScheduleClient]:
+        started = time.perf_counter()
+        entry = self._acquire()
+        with self._lock:
+            self._stats.record_wait(time.perf_counter() - started)
+            self._stats.in_use += 1
+        healthy = False
+        try:
+            if entry.expired(self._max_age):
+                entry.client.warm()
+                entry.warmed_at = time.monotonic()
+                with self._lock:
+                    self._stats.refreshes += 1
+            yield entry.client
+            healthy = True
+        except CircuitOpen:
+            healthy = True
+            raise
+        finally:
+            self._release(entry, healthy)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return self._stats.as_dict()
+
+    def _new_entry(self) -> _Entry[SpaScheduleClient]:
+        client = self._factory()
+        client.warm()
+        return _Entry(client)
+
+    def _acquire(self) -> _Entry[SpaScheduleClient]:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_grow = self._stats.created < self._stats.size
+            if can_grow:
+                self._stats.created += 1
+        if can_grow:
+            try:
+                return self._new_entry()
+            except BaseException:
+                with self._lock:
+                    self._stats.created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self._timeout)
+        except queue.Empty:
+            raise PoolTimeout("Timed out waiting for a schedule client") from None
+
+    def _release(self, entry: _Entry[SpaScheduleClient], healthy: bool) -> None:
+        with self._lock:
+            self._stats.in_use -= 1
+            if not healthy:
+                # The form state may be half-updated; let the next checkout
+                # build a fresh client instead.
+                self._stats.created -= 1
+                self._stats.discarded += 1
+        if not healthy:
+            entry.client.close()
+            return
+        self._idle.put(entry)
+
+
+class AsyncClientPool:
+    """asyncio pool of ``AsyncSpaScheduleClient`` instances."""
+
+    def __init__(
+        self,
+        factory: Callable[[], AsyncSpaScheduleClient] = AsyncSpaScheduleClient,
+        *,
+        size: int = DEFAULT_POOL_SIZE,
+        max_age: float = DEFAULT_MAX_AGE,
+        timeout: Optional[float] = 60.0,
+    ) -> None:
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self._factory = factory
+        self._max_age = max_age
+        self._timeout = timeout
+        self._idle: "asyncio.LifoQueue[_Entry[AsyncSpaScheduleClient]]" = asyncio.LifoQueue()
+        self._stats = PoolStats(size=size)
+
+    async def warm(self) -> None:
+        """Fill the pool with clients that already hold valid CSRF state."""
+        missing = self._stats.size - self._stats.created
+        self._stats.created += missing
+        results = await asyncio.gather(
+            *(self._new_entry() for _ in range(missing)), return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                self._stats.created -= 1
+                logger.warning("Failed to pre-warm schedule client: %s", result)
+            else:
+                self._idle.put_nowait(result)
+
+    @asynccontextmanager
+    async def checkout(self) -> AsyncIterator[AsyncSpaScheduleClient]:
+        started = time.perf_counter()
+        entry = await self._acquire()
+        self._stats.record_wait(time.perf_counter() - started)
+        self._stats.in_use += 1
+        healthy = False
+        try:
+            if entry.expired(self._max_age):
+                await entry.client.warm()
+                entry.warmed_at = time.monotonic()
+                self._stats.refreshes += 1
+            yield entry.client
+            healthy = True
+        except CircuitOpen:
+            healthy = True
+            raise
+        finally:
+            self._stats.in_use -= 1
+            if healthy:
+                self._idle.put_nowait(entry)
+            else:
+                self._stats.created -= 1
+                self._stats.discarded += 1
+                await entry.client.aclose()
+
+    def stats(self) -> Dict[str, float]:
+        return self._stats.as_dict()
+
+    async def aclose(self) -> None:
+        while not self._idle.empty():
+            await self._idle.get_nowait().client.aclose()
+
+    async def _new_entry(self) -> _Entry[AsyncSpaScheduleClient]:
+        client = self._factory()
+        await client.warm()
+        return _Entry(client)
+
+    async def _acquire(self) -> _Entry[AsyncSpaScheduleClient]:
+        if not self._idle.empty():
+            return self._idle.get_nowait()
+        if self._stats.created < self._stats.size:
+            self._stats.created += 1
+            try:
+                return await self._new_entry()
+            except BaseException:
+                self._stats.created -= 1
+                raise
+        try:
+            return await asyncio.wait_for(self._idle.get(), self._timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout("Timed out waiting for a schedule client") from None
+
+
+__all__ = ["AsyncClientPool", "ClientPool", "PoolStats", "PoolTimeout"]
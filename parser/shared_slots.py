@@ -0,0 +1,234 @@
+"""Upstream request slots shared by every process that opens the same file.
+
+Each server and each ``cache_builder`` run has its own
+:class:`~parser.governor.UpstreamGovernor`, whose limit and lanes only
+order the requests of that process. A governor created with
+``shared=SharedSlots(path)`` also takes a slot from a small SQLite table
+for every round trip, so all processes on the host stay within one
+budget and a crawl gives way to user requests:
+
+* Each round trip holds a row of ``slots`` while it runs. Rows of a
+  process that died mid-request expire after ``lease_seconds``.
+* At most ``limit`` rows exist at once. ``crawl`` requests are not admitted
+  into the last ``crawl_reserve`` of them, nor while a ``live`` request of
+  any process is waiting (it keeps a short-lived row in ``waiting``).
+* When a governor's circuit trips, it records a pause; ``crawl`` requests
+  of every process wait until it has passed.
+
+Every process should be given the same ``limit``.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from .governor import CRAWL, LIVE
+
+DEFAULT_LIMIT = 8
+DEFAULT_LEASE = 120.0
+# A waiting live request renews its row on every poll; one that stops
+# polling (cancelled, killed) no longer holds crawl requests back after this.
+_WAIT_LEASE = 2.0
+_POLL_MIN = 0.01
+_POLL_MAX = 0.25
+
+# Ids are never reused, so a holder whose row expired cannot release or
+# renew someone else's.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS slots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    lane TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS waiting (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+
+class SharedSlots:
+    """Cross-process request slots in a SQLite file; thread-safe like ``LessonStore``."""
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        limit: int = DEFAULT_LIMIT,
+        crawl_reserve: int = 1,
+        lease_seconds: float = DEFAULT_LEASE,
+    ) -> None:
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        self.path = Path(path)
+        self.limit = limit
+        self.crawl_reserve = crawl_reserve
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._waits = 0
+
+    # -- slots -------------------------------------------------------------
+
+    def acquire(self, lane: str) -> int:
+        """Block until a slot is free for ``lane``; return its id for :meth:`release`."""
+        ticket: Optional[int] = None
+        delay = _POLL_MIN
+        try:
+            while True:
+                slot, ticket = self._try_acquire(lane, ticket)
+                if slot is not None:
+                    return slot
+                delay = self._wait_step(delay)
+                time.sleep(delay)
+        except BaseException:
+            if ticket is not None:
+                self._forget(ticket)
+            raise
+
+    async def aacquire(self, lane: str) -> int:
+        """Like :meth:`acquire`; the SQLite work runs in worker threads."""
+        ticket: Optional[int] = None
+        delay = _POLL_MIN
+        try:
+            while True:
+                attempt = asyncio.ensure_future(asyncio.to_thread(self._try_acquire, lane, ticket))
+                try:
+                    slot, ticket = await asyncio.shield(attempt)
+                except asyncio.CancelledError:
+                    # The attempt still finishes in its thread; give back
+                    # whatever it took.
+                    attempt.add_done_callback(self._undo_attempt)
+                    raise
+                if slot is not None:
+                    return slot
+                delay = self._wait_step(delay)
+                await asyncio.sleep(delay)
+        except BaseException:
+            if ticket is not None:
+                asyncio.get_running_loop().run_in_executor(None, self._forget, ticket)
+            raise
+
+    def release(self, slot: int) -> None:
+        self._conn().execute("DELETE FROM slots WHERE id = ?", (slot,))
+
+    async def arelease(self, slot: int) -> None:
+        await asyncio.to_thread(self.release, slot)
+
+    def pause(self, seconds: float) -> None:
+        """Hold crawl requests of every process back for ``seconds``."""
+        self._conn().execute(
+            "INSERT INTO state VALUES ('paused_until', ?)"
+            " ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)",
+            (time.time() + seconds,),
+        )
+
+    def stats(self) -> Dict[str, object]:
+        now = time.time()
+        conn = self._conn()
+        in_flight = conn.execute("SELECT COUNT(*) FROM slots WHERE expires >= ?", (now,)).fetchone()[0]
+        waiting = conn.execute("SELECT COUNT(*) FROM waiting WHERE expires >= ?", (now,)).fetchone()[0]
+        with self._lock:
+            waits = self._waits
+        return {
+            "limit": self.limit,
+            "in_flight": in_flight,
+            "waiting_live": waiting,
+            "paused": int(self._paused_until(conn) > now),
+            "waits": waits,
+        }
+
+    # -- internals ---------------------------------------------------------
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Opened on first use, so creating a governor never touches disk.
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Autocommit, with explicit BEGIN IMMEDIATE where a count and an
+            # insert must not interleave with another process.
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # The rows only matter while their processes run.
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _try_acquire(self, lane: str, ticket: Optional[int]) -> Tuple[Optional[int], Optional[int]]:
+        """One attempt: ``(slot, None)`` if admitted, else ``(None, waiting ticket)``."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM slots WHERE expires < ?", (now,))
+            conn.execute("DELETE FROM waiting WHERE expires < ?", (now,))
+            in_flight = conn.execute("SELECT COUNT(*) FROM slots").fetchone()[0]
+            if lane == CRAWL:
+                live_waiting = conn.execute("SELECT COUNT(*) FROM waiting").fetchone()[0]
+                room = (
+                    in_flight < max(self.limit - self.crawl_reserve, 1)
+                    and not live_waiting
+                    and self._paused_until(conn) <= now
+                )
+            else:
+                room = in_flight < self.limit
+            if room:
+                if ticket is not None:
+                    conn.execute("DELETE FROM waiting WHERE id = ?", (ticket,))
+                slot = conn.execute(
+                    "INSERT INTO slots (lane, pid, expires) VALUES (?, ?, ?)",
+                    (lane, os.getpid(), now + self.lease_seconds),
+                ).lastrowid
+                conn.execute("COMMIT")
+                return slot, None
+            if lane == LIVE:
+                expires = now + _WAIT_LEASE
+                if ticket is None or not conn.execute(
+                    "UPDATE waiting SET expires = ? WHERE id = ?", (expires, ticket)
+                ).rowcount:
+                    ticket = conn.execute(
+                        "INSERT INTO waiting (expires) VALUES (?)", (expires,)
+                    ).lastrowid
+            conn.execute("COMMIT")
+            return None, ticket
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _undo_attempt(self, attempt: "asyncio.Future[Tuple[Optional[int], Optional[int]]]") -> None:
+        if attempt.cancelled() or attempt.exception() is not None:
+            return
+        slot, ticket = attempt.result()
+        loop = asyncio.get_running_loop()
+        if slot is not None:
+            loop.run_in_executor(None, self.release, slot)
+        if ticket is not None:
+            loop.run_in_executor(None, self._forget, ticket)
+
+    def _forget(self, ticket: int) -> None:
+        self._conn().execute("DELETE FROM waiting WHERE id = ?", (ticket,))
+
+    def _wait_step(self, delay: float) -> float:
+        if delay == _POLL_MIN:
+            with self._lock:
+                self._waits += 1
+        return min(delay * 2, _POLL_MAX)
+
+    @staticmethod
+    def _paused_until(conn: sqlite3.Connection) -> float:
+        row = conn.execute("SELECT value FROM state WHERE key = 'paused_until'").fetchone()
+        return row[0] if row else 0.0
+
+
+__all__ = ["DEFAULT_LEASE", "DEFAULT_LIMIT", "SharedSlots"]
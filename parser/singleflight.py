@@ -0,0 +1,106 @@
+"""Coalescing of identical concurrent upstream requests.
+
+When many callers ask for the same key at once, only the first (the leader)
+runs the fetch; everyone else waits for and shares its result or exception.
+Results are shared objects, so callers must treat them as read-only.
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class _Counters:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    def as_dict(self, in_flight: int) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": in_flight,
+        }
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Thread-based coalescing for the threadpool endpoints."""
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self._counters = _Counters()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            self._counters.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._counters.executions += 1
+            else:
+                self._counters.coalesced += 1
+        assert call is not None
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return self._counters.as_dict(len(self._calls))
+
+
+class AsyncSingleFlight:
+    """asyncio coalescing for the async app.
+
+    The shared fetch runs as its own task, so a waiter being cancelled (for
+    example because its client disconnected) never cancels the fetch for the
+    others.
+    """
+
+    def __init__(self) -> None:
+        self._tasks: Dict[Hashable, "asyncio.Task[Any]"] = {}
+        self._counters = _Counters()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self._counters.calls += 1
+        task = self._tasks.get(key)
+        if task is None:
+            self._counters.executions += 1
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self._counters.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, int]:
+        return self._counters.as_dict(len(self._tasks))
+
+
+__all__ = ["AsyncSingleFlight", "SingleFlight"]
@@ -0,0 +1,309 @@
+"""Indexed in-memory view of the schedule snapshot written by cache_builder."""
+from __future__ import annotations
+
+import bisect
+import datetime as dt
+import json
+import threading
+from array import array
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from .changes import sync_payload
+from .conditional import Validators, fingerprint, schedule_validators
+from .lesson_store import StoreSnapshot
+from .lesson_table import LessonRows, LessonTable
+from .room_index import RoomIndex
+from .spa_client import OptionItem
+from .teacher_index import TeacherIndex, date_ordinal
+
+GroupKey = Tuple[str, str, str]
+
+
+@dataclass
+class SnapshotGroup:
+    faculty_id: str
+    course_id: str
+    group_id: str
+    group_name: Optional[str]
+    date_from: dt.date
+    date_to: dt.date
+    lessons: LessonRows
+    last_changed: Optional[str] = None
+    _ordinals: array = field(default_factory=lambda: array("i"), repr=False)
+    _fingerprint: Optional[str] = field(default=None, repr=False)
+
+    def __post_init__(self) -> None:
+        # Lessons come out of parse_html_schedule sorted by date, so a parallel
+        # list of day ordinals lets range queries bisect instead of scanning.
+        self._ordinals = array("i", map(date_ordinal, self.lessons.column("date")))
+
+    def covers(self, date_from: dt.date, date_to: dt.date) -> bool:
+        return self.date_from <= date_from and date_to <= self.date_to
+
+    def lessons_between(
+        self, date_from: Optional[dt.date] = None, date_to: Optional[dt.date] = None
+    ) -> List[dict]:
+        lo = bisect.bisect_left(self._ordinals, date_from.toordinal()) if date_from else 0
+        hi = (
+            bisect.bisect_right(self._ordinals, date_to.toordinal())
+            if date_to
+            else len(self._ordinals)
+        )
+        return self.lessons[lo:hi]
+
+    @property
+    def fingerprint(self) -> str:
+        if self._fingerprint is None:
+            self._fingerprint = fingerprint(self.lessons.column("id"))
+        return self._fingerprint
+
+
+class ScheduleSnapshot:
+    """Read-only lookup structures over ``data/cache.json``.
+
+    Options are indexed by faculty and by ``(faculty, course)``; schedules by
+    ``(faculty, course, group)``. Every lookup returns ``None`` when the
+    snapshot cannot answer it so callers can fall back to a live fetch.
+    Lessons of all groups live in one :class:`~parser.lesson_table.LessonTable`
+    and are decoded to dicts per request.
+
+    A snapshot opened with :meth:`load` watches its file: when cache_builder
+    replaces it (new mtime) with a new ``generated_at``, the next lookup
+    reloads it and the teacher and room indexes are rebuilt on next use.
+    """
+
+    def __init__(self, payload: Dict[str, object]) -> None:
+        self._path: Optional[Path] = None
+        self._mtime: Optional[int] = None
+        # One lookup reloads a replaced file; the others keep answering from
+        # the current data meanwhile.
+        self._reload_lock = threading.Lock()
+        self.generated_at: Optional[str] = payload.get("generated_at")  # type: ignore[assignment]
+        self.faculties: List[OptionItem] = []
+        self.courses: Dict[str, List[OptionItem]] = {}
+        self.groups: Dict[Tuple[str, str], List[OptionItem]] = {}
+        self.schedules: Dict[GroupKey, SnapshotGroup] = {}
+        self.lessons = LessonTable()
+        self._teachers: Optional[TeacherIndex] = None
+        self._rooms: Optional[RoomIndex] = None
+        # Concurrent first requests wait for one build instead of each
+        # building its own index.
+        self._lock = threading.Lock()
+
+        options = payload.get("options") or {}
+        self._tree: List[dict] = options.get("faculties", [])  # type: ignore[union-attr]
+        for faculty in self._tree:
+            faculty_id = str(faculty["id"])
+            self.faculties.append(OptionItem(id=faculty_id, name=faculty["name"]))
+            courses = self.courses.setdefault(faculty_id, [])
+            for course in faculty.get("courses", []):
+                course_id = str(course["id"])
+                courses.append(OptionItem(id=course_id, name=course["name"]))
+                self.groups[(faculty_id, course_id)] = [
+                    OptionItem(id=str(group["id"]), name=group["name"])
+                    for group in course.get("groups", [])
+                ]
+
+        for entry in (payload.get("groups") or {}).values():  # type: ignore[union-attr]
+            group = SnapshotGroup(
+                faculty_id=str(entry["faculty_id"]),
+                course_id=str(entry["course_id"]),
+                group_id=str(entry["group_id"]),
+                group_name=entry.get("group_name"),
+                date_from=dt.date.fromisoformat(entry["date_from"]),
+                date_to=dt.date.fromisoformat(entry["date_to"]),
+                lessons=self.lessons.extend(entry.get("lessons", [])),
+                last_changed=entry.get("last_changed"),
+            )
+            self.schedules[(group.faculty_id, group.course_id, group.group_id)] = group
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["ScheduleSnapshot"]:
+        """Load a snapshot from disk, returning ``None`` if it does not exist."""
+        path = Path(path)
+        if not path.exists():
+            return None
+        # Stat before reading, so a replacement written meanwhile is reloaded.
+        mtime = path.stat().st_mtime_ns
+        snapshot = cls(json.loads(path.read_text(encoding="utf-8")))
+        snapshot._path, snapshot._mtime = path, mtime
+        return snapshot
+
+    # -- lookups ----------------------------------------------------------
+
+    def options_tree(self) -> List[dict]:
+        self._check_version()
+        return self._tree
+
+    def list_faculties(self) -> Optional[List[OptionItem]]:
+        self._check_version()
+        return self.faculties or None
+
+    def list_courses(self, faculty_id: str) -> Optional[List[OptionItem]]:
+        self._check_version()
+        return self.courses.get(str(faculty_id))
+
+    def list_groups(self, faculty_id: str, course: str) -> Optional[List[OptionItem]]:
+        self._check_version()
+        return self.groups.get((str(faculty_id), str(course)))
+
+    def fetch_schedule(
+        self,
+        faculty_id: str,
+        course: str,
+        group_id: str,
+        *,
+        date_from: Optional[dt.date] = None,
+        date_to: Optional[dt.date] = None,
+    ) -> Optional[Dict[str, object]]:
+        """Answer like ``SpaScheduleClient.fetch_schedule`` when the range is cached.
+
+        Requests without an explicit range are left to upstream because its
+        default window is not part of the snapshot.
+        """
+        if date_from is None or date_to is None:
+            return None
+        self._check_version()
+        group = self.schedules.get((str(faculty_id), str(course), str(group_id)))
+        if group is None or not group.covers(date_from, date_to):
+            return None
+        return {
+            "group": {"id": group.group_id, "name": group.group_name},
+            "lessons": group.lessons_between(date_from, date_to),
+        }
+
+    def schedule_changes(
+        self, faculty_id: str, course: str, group_id: str, since: Optional[str] = None
+    ) -> Optional[Dict[str, object]]:
+        """Always a full resync: the JSON snapshot keeps no change log."""
+        self._check_version()
+        group = self.schedules.get((str(faculty_id), str(course), str(group_id)))
+        if group is None:
+            return None
+        return sync_payload(
+            {"id": group.group_id, "name": group.group_name}, 0, lessons=group.lessons
+        )
+
+    def schedule_validators(
+        self,
+        faculty_id: str,
+        course: str,
+        group_id: str,
+        *,
+        date_from: Optional[dt.date] = None,
+        date_to: Optional[dt.date] = None,
+    ) -> Optional[Validators]:
+        """ETag/Last-Modified of what :meth:`fetch_schedule` would return, without reading it."""
+        if date_from is None or date_to is None:
+            return None
+        self._check_version()
+        group = self.schedules.get((str(faculty_id), str(course), str(group_id)))
+        if group is None or not group.covers(date_from, date_to):
+            return None
+        return schedule_validators(
+            group.group_id, group.group_name, date_from, date_to, group.fingerprint, group.last_changed
+        )
+
+    def export_groups(
+        self, faculty_id: Optional[str] = None, course: Optional[str] = None
+    ) -> List[Tuple[str, str, str, Optional[str], Optional[str]]]:
+        """``(faculty, course, group id, group name, last changed)`` of cached groups in key order.
+
+        Together with :meth:`export_lessons` this is what :mod:`parser.export` reads.
+        """
+        self._check_version()
+        return [
+            (*key, group.group_name, group.last_changed)
+            for key, group in sorted(self.schedules.items())
+            if (faculty_id is None or key[0] == str(faculty_id))
+            and (course is None or key[1] == str(course))
+        ]
+
+    def export_lessons(
+        self,
+        faculty_id: str,
+        course: str,
+        group_id: str,
+        date_from: Optional[dt.date] = None,
+        date_to: Optional[dt.date] = None,
+    ) -> List[dict]:
+        group = self.schedules.get((str(faculty_id), str(course), str(group_id)))
+        return group.lessons_between(date_from, date_to) if group else []
+
+    def iter_lessons(self) -> Iterator[Tuple[str, dict]]:
+        """Yield ``(group id, lesson)`` for every lesson in the snapshot."""
+        for group in self.schedules.values():
+            for lesson in group.lessons:
+                yield group.group_id, lesson
+
+    def teacher_index(self) -> TeacherIndex:
+        """Teacher index over all groups, built on first use after each load."""
+        self._check_version()
+        if self._teachers is None:
+            with self._lock:
+                if self._teachers is None:
+                    self._teachers = TeacherIndex(self.iter_lessons())
+        return self._teachers
+
+    def room_index(self) -> RoomIndex:
+        """Room occupancy index over all groups, built on first use after each load."""
+        self._check_version()
+        if self._rooms is None:
+            with self._lock:
+                if self._rooms is None:
+                    self._rooms = RoomIndex(self.iter_lessons())
+        return self._rooms
+
+    # -- reloading --------------------------------------------------------
+
+    def _check_version(self) -> None:
+        if self._path is None:
+            return
+        try:
+            mtime = self._path.stat().st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._mtime or not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            if mtime != self._mtime:
+                self._reload(mtime)
+        finally:
+            self._reload_lock.release()
+
+    def _reload(self, mtime: int) -> None:
+        try:
+            payload = json.loads(self._path.read_text(encoding="utf-8"))  # type: ignore[union-attr]
+        except (OSError, ValueError):
+            return  # mid-write or gone; the next lookup tries again
+        self._mtime = mtime
+        if payload.get("generated_at") == self.generated_at:
+            return
+        fresh = ScheduleSnapshot(payload)
+        # Under the index lock, so an index build of the old data finishes
+        # before it is dropped and none is stored after the swap.
+        with self._lock:
+            self.generated_at = fresh.generated_at
+            self.faculties, self.courses, self.groups = fresh.faculties, fresh.courses, fresh.groups
+            self.schedules, self.lessons, self._tree = fresh.schedules, fresh.lessons, fresh._tree
+            self._teachers = None
+            self._rooms = None
+
+
+Snapshot = Union[ScheduleSnapshot, StoreSnapshot]
+
+
+def load_snapshot(path: Path) -> Optional[Snapshot]:
+    """Open a snapshot by file type.
+
+    ``.json`` files are read fully into memory; anything else is treated as a
+    :class:`~parser.lesson_store.LessonStore` database queried per request.
+    """
+    if Path(path).suffix == ".json":
+        return ScheduleSnapshot.load(path)
+    return StoreSnapshot.load(path)
+
+
+__all__ = ["ScheduleSnapshot", "Snapshot", "SnapshotGroup", "load_snapshot"]
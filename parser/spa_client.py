@@ -2,13 +2,18 @@
 from __future__ import annotations
 
 import datetime as dt
-from dataclasses import dataclass
+import queue
+import time
 from typing import Dict, List, Optional
 
 import requests
-from bs4 import BeautifulSoup, Tag
 
-from .parse_html_schedule import parse_html_schedule
+from .form_page import FormPage, OptionItem, parse_form_page
+from .governor import GOVERNOR, UpstreamGovernor, current_lane, lane
+from .metrics import PARSE_LESSONS, PARSE_SECONDS, upstream_request
+from .parse_html_schedule import DEFAULT_BACKEND, parse_html_schedule
+from .timing import UPSTREAM, timed
+from .windows import DEFAULT_WORKERS, fetch_windowed, split_range
 
 BASE_URL = "https://cacs.spa.msu.ru/time-table/group?type=0"
 _HEADERS = {
@@ -20,39 +25,142 @@ _HEADERS = {
 }
 
 
-@dataclass
-class OptionItem:
-    id: str
-    name: str
+class _SpaFormState:
+    """Transport-agnostic part of the SPA timetable form workflow.
 
+    Holds the CSRF token, hidden inputs and selected form values, and knows
+    how to turn a response page into options or a schedule. Each response is
+    parsed once with ``backend`` (see :mod:`parser.form_page`). Subclasses
+    supply the actual HTTP round trips, each admitted by ``governor``.
+    """
 
-class SpaScheduleClient:
-    """Stateful helper that mimics the SPA timetable form workflow."""
-
-    def __init__(self, base_url: str = BASE_URL) -> None:
+    def __init__(
+        self,
+        base_url: str = BASE_URL,
+        governor: UpstreamGovernor = GOVERNOR,
+        backend: Optional[str] = None,
+    ) -> None:
         self.base_url = base_url
-        self.session = requests.Session()
+        self.governor = governor
+        self.backend = backend or DEFAULT_BACKEND
+        self._reset_state()
+
+    def _reset_state(self) -> None:
         self._csrf_token: Optional[str] = None
         self._hidden_inputs: Dict[str, str] = {}
         self._form_data: Dict[str, str] = {}
-        self._last_soup: Optional[BeautifulSoup] = None
+        self._last_page: Optional[FormPage] = None
+
+    def _set_faculty(self, faculty_id: str) -> None:
+        self._form_data = {"TimeTableForm[facultyId]": str(faculty_id)}
+
+    def _select_course(self, course: str) -> None:
+        if "TimeTableForm[facultyId]" not in self._form_data:
+            raise ValueError("Faculty must be selected before course")
+        self._form_data["TimeTableForm[course]"] = str(course)
+        self._form_data.pop("TimeTableForm[groupId]", None)
+
+    def _select_group(self, group_id: str) -> None:
+        if "TimeTableForm[course]" not in self._form_data:
+            raise ValueError("Course must be selected before group")
+        self._form_data["TimeTableForm[groupId]"] = str(group_id)
+
+    def _select_dates(self, date_from: Optional[dt.date], date_to: Optional[dt.date]) -> None:
+        if date_from:
+            self._form_data["TimeTableForm[dateStart]"] = date_from.strftime("%d.%m.%Y")
+        else:
+            self._form_data.pop("TimeTableForm[dateStart]", None)
+        if date_to:
+            self._form_data["TimeTableForm[dateEnd]"] = date_to.strftime("%d.%m.%Y")
+        else:
+            self._form_data.pop("TimeTableForm[dateEnd]", None)
+
+    def _form_payload(self, page: FormPage) -> Dict[str, str]:
+        if not page.has_form():
+            raise RuntimeError("Form not found on timetable page")
+        payload = dict(self._hidden_inputs)
+        payload.update(self._form_data)
+        payload.pop("_csrf-frontend", None)
+        payload["_csrf-frontend"] = self._csrf_token or ""
+        return payload
+
+    def _update_state(self, page: FormPage) -> None:
+        token = page.csrf_token()
+        if not token:
+            raise RuntimeError("CSRF token not found in response")
+        self._csrf_token = token
+        self._hidden_inputs = page.form_inputs()
+        self._last_page = page
+
+    def _schedule_result(
+        self,
+        page: FormPage,
+        group_id: str,
+        date_from: Optional[dt.date],
+        date_to: Optional[dt.date],
+    ) -> Dict[str, object]:
+        # The response tree from _submit_form is walked in place; serializing
+        # it back to markup would make parse_html_schedule parse it again.
+        selected = page.selected("groupid")
+        group_name = selected.name if selected else None
+        started = time.perf_counter()
+        lessons = parse_html_schedule(
+            page.tree,
+            group_id=group_name,
+            date_from=date_from,
+            date_to=date_to,
+        )
+        PARSE_SECONDS.observe(time.perf_counter() - started)
+        PARSE_LESSONS.observe(len(lessons))
+        return {
+            "group": {
+                "id": group_id,
+                "name": group_name,
+            },
+            "lessons": lessons,
+        }
+
+
+class SpaScheduleClient(_SpaFormState):
+    """Stateful helper that mimics the SPA timetable form workflow."""
+
+    def __init__(
+        self,
+        base_url: str = BASE_URL,
+        governor: UpstreamGovernor = GOVERNOR,
+        backend: Optional[str] = None,
+    ) -> None:
+        super().__init__(base_url, governor, backend)
+        self.session = requests.Session()
+        # Extra sessions of windowed fetches, kept for this client's next one.
+        self._siblings: List[SpaScheduleClient] = []
+
+    def __enter__(self) -> "SpaScheduleClient":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the HTTP session, and those of the window siblings."""
+        siblings, self._siblings = self._siblings, []
+        for sibling in siblings:
+            sibling.close()
+        self.session.close()
 
     # -- public API -----------------------------------------------------
 
     def list_faculties(self) -> List[OptionItem]:
-        soup = self._ensure_initial_state()
-        return self._extract_options(soup.select_one("#timetableform-facultyid"))
+        return self._ensure_initial_state().options("facultyid")
 
     def list_courses(self, faculty_id: str) -> List[OptionItem]:
         self._select_faculty(faculty_id)
-        soup = self._submit_form()
-        return self._extract_options(soup.select_one("#timetableform-course"))
+        return self._submit_form().options("course")
 
     def list_groups(self, faculty_id: str, course: str) -> List[OptionItem]:
         self._select_faculty(faculty_id)
         self._select_course(course)
-        soup = self._submit_form()
-        return self._extract_options(soup.select_one("#timetableform-groupid"))
+        return self._submit_form().options("groupid")
 
     def fetch_schedule(
         self,
@@ -62,106 +170,112 @@ class SpaScheduleClient:
         *,
         date_from: Optional[dt.date] = None,
         date_to: Optional[dt.date] = None,
+        window: Optional[str] = None,
+        workers: int = DEFAULT_WORKERS,
     ) -> Dict[str, object]:
+        """Fetch and parse a group's timetable.
+
+        With ``window`` ("month" or "week") and both dates given, the range
+        is requested window by window on up to ``workers`` sessions at once
+        (this client plus sibling clients it keeps for later windowed calls
+        and closes in :meth:`close`); see :mod:`parser.windows`.
+        The result is the same as for one request covering the whole range.
+        """
+        if window and date_from and date_to and len(split_range(date_from, date_to, window)) > 1:
+            return self._fetch_windowed(
+                faculty_id, course, group_id, date_from, date_to, window, workers
+            )
         self._select_faculty(faculty_id)
         self._select_course(course)
-        if date_from:
-            self._form_data["TimeTableForm[dateStart]"] = date_from.strftime("%d.%m.%Y")
-        else:
-            self._form_data.pop("TimeTableForm[dateStart]", None)
-        if date_to:
-            self._form_data["TimeTableForm[dateEnd]"] = date_to.strftime("%d.%m.%Y")
-        else:
-            self._form_data.pop("TimeTableForm[dateEnd]", None)
+        self._select_dates(date_from, date_to)
         self._select_group(group_id)
-        soup = self._submit_form()
-        html = str(soup)
-        lessons = parse_html_schedule(
-            html,
-            group_id=self._current_group_name(soup),
-            date_from=date_from,
-            date_to=date_to,
-        )
-        return {
-            "group": {
-                "id": group_id,
-                "name": self._current_group_name(soup),
-            },
-            "lessons": lessons,
-        }
+        page = self._submit_form()
+        return self._schedule_result(page, group_id, date_from, date_to)
+
+    def warm(self) -> None:
+        """Drop any form state and fetch a fresh CSRF token from upstream."""
+        self._reset_state()
+        self._ensure_initial_state()
 
     # -- internal helpers ----------------------------------------------
 
-    def _ensure_initial_state(self) -> BeautifulSoup:
-        if self._last_soup is None:
-            resp = self.session.get(self.base_url, timeout=30)
-            resp.raise_for_status()
-            soup = BeautifulSoup(resp.text, "html.parser")
-            self._update_state(soup)
-        assert self._last_soup is not None
-        return self._last_soup
+    def _fetch_windowed(
+        self,
+        faculty_id: str,
+        course: str,
+        group_id: str,
+        date_from: dt.date,
+        date_to: dt.date,
+        window: str,
+        workers: int,
+    ) -> Dict[str, object]:
+        # Each concurrent window needs its own session and form state.
+        idle: "queue.SimpleQueue[SpaScheduleClient]" = queue.SimpleQueue()
+        idle.put(self)
+        for sibling in self._siblings:
+            idle.put(sibling)
+        self._siblings = []
+        # Window threads keep the caller's priority lane.
+        caller_lane = current_lane()
 
-    def _select_faculty(self, faculty_id: str) -> None:
-        self._ensure_initial_state()
-        self._form_data = {"TimeTableForm[facultyId]": str(faculty_id)}
+        def fetch(start: dt.date, end: dt.date) -> Dict[str, object]:
+            try:
+                client = idle.get_nowait()
+            except queue.Empty:
+                client = SpaScheduleClient(self.base_url, self.governor, self.backend)
+            try:
+                with lane(caller_lane):
+                    result = client.fetch_schedule(
+                        faculty_id, course, group_id, date_from=start, date_to=end
+                    )
+            except Exception:
+                # The form state may be half-updated: start this client over,
+                # and give up on siblings altogether.
+                if client is self:
+                    self._reset_state()
+                    idle.put(self)
+                else:
+                    client.close()
+                raise
+            idle.put(client)
+            return result
 
-    def _select_course(self, course: str) -> None:
-        if "TimeTableForm[facultyId]" not in self._form_data:
-            raise ValueError("Faculty must be selected before course")
-        self._form_data["TimeTableForm[course]"] = str(course)
-        self._form_data.pop("TimeTableForm[groupId]", None)
+        try:
+            return fetch_windowed(
+                fetch, group_id, date_from, date_to, window=window, workers=workers
+            )
+        finally:
+            # Every window has finished here; the healthy siblings are idle.
+            while True:
+                try:
+                    client = idle.get_nowait()
+                except queue.Empty:
+                    break
+                if client is not self:
+                    self._siblings.append(client)
 
-    def _select_group(self, group_id: str) -> None:
-        if "TimeTableForm[course]" not in self._form_data:
-            raise ValueError("Course must be selected before group")
-        self._form_data["TimeTableForm[groupId]"] = str(group_id)
+    def _ensure_initial_state(self) -> FormPage:
+        if self._last_page is None:
+            with self.governor.request(), upstream_request("initial_get"), timed(UPSTREAM):
+                resp = self.session.get(self.base_url, timeout=30)
+                resp.raise_for_status()
+            self._update_state(parse_form_page(resp.text, self.backend))
+        assert self._last_page is not None
+        return self._last_page
 
-    def _submit_form(self) -> BeautifulSoup:
-        soup = self._last_soup or self._ensure_initial_state()
-        form = soup.select_one("#filter-form")
-        if not form:
-            raise RuntimeError("Form not found on timetable page")
-        payload = dict(self._hidden_inputs)
-        payload.update(self._form_data)
-        payload.pop("_csrf-frontend", None)
-        payload["_csrf-frontend"] = self._csrf_token or ""
-        resp = self.session.post(self.base_url, data=payload, headers=_HEADERS, timeout=30)
-        resp.raise_for_status()
-        soup = BeautifulSoup(resp.text, "html.parser")
-        self._update_state(soup)
-        return soup
-
-    def _update_state(self, soup: BeautifulSoup) -> None:
-        token = soup.select_one("meta[name='csrf-token']")
-        if not token or not token.get("content"):
-            raise RuntimeError("CSRF token not found in response")
-        self._csrf_token = token["content"]
-        form = soup.select_one("#filter-form")
-        hidden: Dict[str, str] = {}
-        if form:
-            for inp in form.find_all("input"):
-                name = inp.get("name")
-                if name:
-                    hidden[name] = inp.get("value", "")
-        self._hidden_inputs = hidden
-        self._last_soup = soup
-
-    @staticmethod
-    def _extract_options(select: Optional[Tag]) -> List[OptionItem]:
-        if select is None:
-            return []
-        items: List[OptionItem] = []
-        for option in select.find_all("option"):
-            value = option.get("value")
-            if value is None or not value.strip():
-                continue
-            items.append(OptionItem(id=value.strip(), name=option.get_text(strip=True)))
-        return items
-
-    @staticmethod
-    def _current_group_name(soup: BeautifulSoup) -> Optional[str]:
-        opt = soup.select_one("#timetableform-groupid option[selected]")
-        return opt.get_text(strip=True) if opt else None
+    def _select_faculty(self, faculty_id: str) -> None:
+        self._ensure_initial_state()
+        self._set_faculty(faculty_id)
+
+    def _submit_form(self) -> FormPage:
+        page = self._last_page or self._ensure_initial_state()
+        payload = self._form_payload(page)
+        with self.governor.request(), upstream_request("submit_form"), timed(UPSTREAM):
+            resp = self.session.post(self.base_url, data=payload, headers=_HEADERS, timeout=30)
+            resp.raise_for_status()
+        page = parse_form_page(resp.text, self.backend)
+        self._update_state(page)
+        return page
 
 
 __all__ = ["SpaScheduleClient", "OptionItem"]
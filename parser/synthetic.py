@@ -0,0 +1,233 @@
+"""Deterministic stand-in for the cacs.spa.msu.ru timetable pages.
+
+:class:`SyntheticSite` renders what the SPA returns for a form state: the
+CSRF meta tag, the filter form with faculty/course/group selects and, once
+a group is selected, ``table#timeTable`` with lesson popovers. The markup
+follows what :mod:`parser.parse_html_schedule` and ``SpaScheduleClient``
+read from the real site. Lessons are derived from the seed, date, pair
+and group (or course, for lectures) alone, so a day looks the same
+whichever range it is requested in. Some cells split a pair between
+subgroups, and lectures list the whole stream of groups, so every page
+mixes several groups.
+
+Used by :mod:`parser.bench` when no recorded pages are given.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import html
+import random
+from typing import Dict, List, Mapping, Optional, Tuple
+
+PAIRS: List[Tuple[str, str]] = [
+    ("09:00", "10:30"),
+    ("10:40", "12:10"),
+    ("12:55", "14:25"),
+    ("14:35", "16:05"),
+    ("16:15", "17:45"),
+    ("17:55", "19:25"),
+    ("19:35", "21:05"),
+]
+# Chance that a group has a lesson in a pair, by pair number.
+_BUSY = (0.75, 0.8, 0.7, 0.55, 0.35, 0.15, 0.05)
+# Chance that a busy pair is a lecture for the whole course.
+_LECTURE = 0.3
+
+_SUBJECTS = (
+    "Государственное управление",
+    "Экономическая теория",
+    "Публичное право",
+    "Математические методы в управлении",
+    "Иностранный язык",
+    "Социология управления",
+    "Стратегическое планирование",
+    "Информационные технологии в управлении",
+    "История государственного управления",
+    "Политология",
+    "Статистика",
+    "Управление проектами",
+)
+_TYPES = ("Семинар", "Практическое занятие", "Лабораторная работа")
+_TEACHERS = (
+    "Иванов И. И.",
+    "Петрова А. С.",
+    "Сидоров П. В.",
+    "Кузнецова Е. Н.",
+    "Смирнов Д. А.",
+    "Волкова О. Л.",
+    "Морозов К. Г.",
+    "Новикова Т. Р.",
+    "Фёдоров С. М.",
+    "Орлова Н. Б.",
+)
+_NOTES = (
+    "Перенос с 14:35",
+    "Замена преподавателя",
+    "Обновлено: занятие в дистанционном формате",
+    "Внимание: контрольная работа",
+)
+_FACULTY_NAMES = ("Бакалавриат", "Магистратура", "Аспирантура", "Второе высшее")
+
+
+class SyntheticSite:
+    """An option tree of faculties, courses and groups plus their lessons."""
+
+    def __init__(
+        self,
+        faculties: int = 2,
+        courses: int = 4,
+        groups_per_course: int = 6,
+        seed: int = 0,
+    ) -> None:
+        self.seed = seed
+        self.faculties: Dict[str, str] = {}
+        self.courses: Dict[str, Dict[str, str]] = {}
+        self.groups: Dict[Tuple[str, str], Dict[str, str]] = {}
+        for f in range(faculties):
+            faculty_id = str(5 + f)
+            self.faculties[faculty_id] = _FACULTY_NAMES[f % len(_FACULTY_NAMES)]
+            self.courses[faculty_id] = {str(c): f"{c} курс" for c in range(1, courses + 1)}
+            for c in range(1, courses + 1):
+                self.groups[(faculty_id, str(c))] = {
+                    f"{faculty_id}{c}{g:02d}": f"{c}{g:02d}гму-{faculty_id}"
+                    for g in range(1, groups_per_course + 1)
+                }
+
+    def first_group(self) -> Tuple[str, str, str]:
+        faculty_id = next(iter(self.faculties))
+        course = next(iter(self.courses[faculty_id]))
+        return faculty_id, course, next(iter(self.groups[(faculty_id, course)]))
+
+    # -- pages ------------------------------------------------------------
+
+    def page(self, form: Optional[Mapping[str, str]] = None, csrf: str = "synthetic-csrf") -> str:
+        """The page upstream returns for ``form`` (a POSTed TimeTableForm, or None for the GET)."""
+        form = form or {}
+        faculty_id = form.get("TimeTableForm[facultyId]", "")
+        course = form.get("TimeTableForm[course]", "")
+        group_id = form.get("TimeTableForm[groupId]", "")
+        date_start = form.get("TimeTableForm[dateStart]", "")
+        date_end = form.get("TimeTableForm[dateEnd]", "")
+
+        selects = [_select("facultyid", "facultyId", self.faculties, faculty_id)]
+        courses = self.courses.get(faculty_id)
+        if courses is not None:
+            selects.append(_select("course", "course", courses, course))
+        groups = self.groups.get((faculty_id, course))
+        if groups is not None:
+            selects.append(_select("groupid", "groupId", groups, group_id))
+        table = ""
+        if groups is not None and group_id in groups:
+            start, end = _form_range(date_start, date_end)
+            table = self.timetable(faculty_id, course, group_id, start, end)
+            date_start, date_end = f"{start:%d.%m.%Y}", f"{end:%d.%m.%Y}"
+        token = html.escape(csrf, quote=True)
+        return (
+            "<!DOCTYPE html><html lang=\"ru\"><head><meta charset=\"UTF-8\">"
+            f"<meta name=\"csrf-param\" content=\"_csrf-frontend\"><meta name=\"csrf-token\" content=\"{token}\">"
+            "<title>Расписание занятий</title></head><body><div class=\"container\">"
+            "<form id=\"filter-form\" action=\"/time-table/group?type=0\" method=\"post\">"
+            f"<input type=\"hidden\" name=\"_csrf-frontend\" value=\"{token}\">"
+            + "".join(selects)
+            + f"<input type=\"text\" id=\"timetableform-datestart\" name=\"TimeTableForm[dateStart]\" value=\"{date_start}\">"
+            f"<input type=\"text\" id=\"timetableform-dateend\" name=\"TimeTableForm[dateEnd]\" value=\"{date_end}\">"
+            "</form>"
+            + table
+            + "</div></body></html>"
+        )
+
+    def timetable(
+        self, faculty_id: str, course: str, group_id: str, start: dt.date, end: dt.date
+    ) -> str:
+        """``table#timeTable`` for whole Monday-Saturday weeks; days outside the range are empty."""
+        rows: List[str] = []
+        monday = start - dt.timedelta(days=start.weekday())
+        while monday <= end:
+            days = [monday + dt.timedelta(days=i) for i in range(6)]
+            rows.append(
+                "<tr><th class=\"headday\">Пара</th>"
+                + "".join(f"<th class=\"headdate\">{day:%d.%m.%Y}</th>" for day in days)
+                + "</tr>"
+            )
+            for number, (starts_at, ends_at) in enumerate(PAIRS, 1):
+                cells = [
+                    "<td>" + "".join(self._blocks(faculty_id, course, group_id, day, number)) + "</td>"
+                    if start <= day <= end
+                    else "<td></td>"
+                    for day in days
+                ]
+                rows.append(
+                    f"<tr><th class=\"headcol\"><span class=\"lesson\">{number} пара</span>"
+                    f"<span class=\"start\">{starts_at}</span><span class=\"end\">{ends_at}</span></th>"
+                    + "".join(cells)
+                    + "</tr>"
+                )
+            monday += dt.timedelta(days=7)
+        return "<table id=\"timeTable\" class=\"table\">" + "".join(rows) + "</table>"
+
+    def _blocks(
+        self, faculty_id: str, course: str, group_id: str, day: dt.date, number: int
+    ) -> List[str]:
+        stream = self.groups[(faculty_id, course)]
+        slot = f"{self.seed}:{faculty_id}:{course}:{day.isoformat()}:{number}"
+        rng = random.Random(slot)
+        if rng.random() < _BUSY[number - 1] * _LECTURE:
+            # Lectures are read to the whole course at once, so they are
+            # drawn per course and come out the same for every group.
+            subject, kind = rng.choice(_SUBJECTS), "Лекция"
+            names = [", ".join(stream.values())]
+        else:
+            rng = random.Random(f"{slot}:{group_id}")
+            if rng.random() >= _BUSY[number - 1] * (1 - _LECTURE):
+                return []
+            subject, kind = rng.choice(_SUBJECTS), rng.choice(_TYPES)
+            names = [stream[group_id]]
+        if kind == "Лабораторная работа" and rng.random() < 0.6:
+            names = [f"{stream[group_id]}/1", f"{stream[group_id]}/2"]
+        blocks = []
+        for name in names:
+            parts = [f"{subject} [{kind}]", f"ауд. {rng.randint(1, 6)}{rng.randint(0, 3)}{rng.randint(1, 9)}", name]
+            if rng.random() < 0.05:
+                parts.insert(0, "10:15-11:45")
+            parts.append(rng.choice(_TEACHERS))
+            if rng.random() < 0.1:
+                parts.append(rng.choice(_TEACHERS))
+            if rng.random() < 0.08:
+                parts.append(rng.choice(_NOTES))
+            content = html.escape("<br>".join(parts), quote=True)
+            blocks.append(
+                f"<div class=\"lesson-block\" data-toggle=\"popover\" data-trigger=\"hover\" "
+                f"data-html=\"true\" data-content=\"{content}\">"
+                f"<span class=\"subject\">{html.escape(subject)}</span> <b>[{kind}]</b>"
+                f"<br><i>{html.escape(parts[-1])}</i></div>"
+            )
+        return blocks
+
+
+def _select(suffix: str, field: str, options: Mapping[str, str], selected: str) -> str:
+    items = "".join(
+        f"<option value=\"{value}\"{' selected' if value == selected else ''}>{html.escape(name)}</option>"
+        for value, name in options.items()
+    )
+    return (
+        f"<select id=\"timetableform-{suffix}\" name=\"TimeTableForm[{field}]\">"
+        f"<option value=\"\">Выберите...</option>{items}</select>"
+    )
+
+
+def _form_range(date_start: str, date_end: str) -> Tuple[dt.date, dt.date]:
+    # Without dates upstream shows the current week.
+    today = dt.date.today()
+    start = _parse_date(date_start) or today - dt.timedelta(days=today.weekday())
+    end = _parse_date(date_end) or start + dt.timedelta(days=6 - start.weekday())
+    return start, max(start, end)
+
+
+def _parse_date(value: str) -> Optional[dt.date]:
+    try:
+        return dt.datetime.strptime(value, "%d.%m.%Y").date()
+    except ValueError:
+        return None
+
+
+__all__ = ["PAIRS", "SyntheticSite"]
@@ -0,0 +1,148 @@
+"""Inverted index from teacher name to lessons across all crawled groups."""
+from __future__ import annotations
+
+import bisect
+import datetime as dt
+import functools
+from array import array
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .lesson_table import LessonRows, LessonTable
+from .search_index import normalize
+
+
+@dataclass
+class Timeline:
+    """Lessons of one teacher (or room), sorted by date and time."""
+
+    name: str
+    lessons: LessonRows
+    _ordinals: Sequence[int] = field(repr=False)
+
+    def lessons_between(
+        self, date_from: Optional[dt.date] = None, date_to: Optional[dt.date] = None
+    ) -> List[dict]:
+        lo = bisect.bisect_left(self._ordinals, date_from.toordinal()) if date_from else 0
+        hi = (
+            bisect.bisect_right(self._ordinals, date_to.toordinal())
+            if date_to
+            else len(self._ordinals)
+        )
+        return self.lessons[lo:hi]
+
+    def day_ordinals(self) -> Sequence[int]:
+        return self._ordinals
+
+
+def build_timelines(
+    lessons: Iterable[Tuple[str, dict]],
+    names_of: Callable[[dict], List[str]],
+    key_of: Callable[[str], str] = normalize,
+) -> Dict[str, Timeline]:
+    """Group ``(group id, lesson)`` pairs into one :class:`Timeline` per key.
+
+    ``names_of`` extracts the display names a lesson belongs to and
+    ``key_of`` folds them into lookup keys; the first spelling seen becomes
+    the timeline's name. A lesson shared by several groups (e.g. a lecture
+    for a whole stream) carries the same id in each of them and is kept once.
+
+    Lessons are copied into one shared :class:`~parser.lesson_table.LessonTable`
+    and timelines hold row numbers, so an index does not keep the lesson
+    dicts it was built from alive.
+    """
+    table = LessonTable()
+    rows_of: Dict[str, int] = {}
+    seen: Dict[str, set] = {}
+    keyed: Dict[str, List[Tuple[int, str, int, int]]] = {}
+    names: Dict[str, str] = {}
+    keys: Dict[str, str] = {}
+    for _, lesson in lessons:
+        lesson_id = lesson.get("id")
+        row = None
+        for name in names_of(lesson):
+            key = keys.get(name)
+            if key is None:
+                key = keys[name] = key_of(name)
+            if not key:
+                continue
+            ids = seen.setdefault(key, set())
+            if lesson_id in ids:
+                continue
+            ids.add(lesson_id)
+            if row is None:
+                row = rows_of.get(lesson_id)  # type: ignore[arg-type]
+                if row is None:
+                    row = table.append(lesson)
+                    if lesson_id is not None:
+                        rows_of[lesson_id] = row
+            names.setdefault(key, name)
+            keyed.setdefault(key, []).append(
+                (
+                    lesson_ordinal(lesson),
+                    lesson.get("starts_at") or "",
+                    lesson.get("pair_number") or 0,
+                    row,
+                )
+            )
+    timelines: Dict[str, Timeline] = {}
+    for key, entries in keyed.items():
+        entries.sort(key=lambda entry: entry[:3])
+        timelines[key] = Timeline(
+            name=names[key],
+            lessons=table.rows(array("I", [entry[3] for entry in entries])),
+            _ordinals=array("i", [entry[0] for entry in entries]),
+        )
+    return timelines
+
+
+class TeacherIndex:
+    """Lessons of every teacher, sorted by date, keyed by normalized name.
+
+    Built from ``(group id, lesson)`` pairs as yielded by the snapshots'
+    ``iter_lessons``. Lessons taught by several teachers are listed under
+    each of them. Range lookups bisect the per-teacher day list, so a query
+    costs ``O(log n)`` plus the lessons returned.
+    """
+
+    def __init__(self, lessons: Iterable[Tuple[str, dict]]) -> None:
+        self._entries = build_timelines(lessons, _teachers)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, name: str) -> Optional[Timeline]:
+        return self._entries.get(normalize(name))
+
+    def teachers(self) -> List[Dict[str, object]]:
+        """All teachers by name with the number of lessons they give."""
+        return sorted(
+            ({"name": entry.name, "lessons": len(entry.lessons)} for entry in self._entries.values()),
+            key=lambda item: str(item["name"]),
+        )
+
+
+def lesson_ordinal(lesson: dict) -> int:
+    """Day ordinal of a lesson's ``DD.MM.YYYY`` date; undated lessons sort last."""
+    return date_ordinal(lesson.get("date"))
+
+
+# A semester has a few hundred distinct dates shared by every lesson.
+@functools.lru_cache(maxsize=4096)
+def date_ordinal(value: Optional[str]) -> int:
+    """Day ordinal of a ``DD.MM.YYYY`` date; missing or malformed dates sort last."""
+    try:
+        return dt.datetime.strptime(value, "%d.%m.%Y").date().toordinal()  # type: ignore[arg-type]
+    except (TypeError, ValueError):
+        return dt.date.max.toordinal()
+
+
+def _teachers(lesson: dict) -> List[str]:
+    # parse_html_schedule joins several teachers of one lesson with ", ".
+    value = lesson.get("teacher")
+    if not value:
+        return []
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+__all__ = ["TeacherIndex", "Timeline", "build_timelines", "date_ordinal", "lesson_ordinal"]
@@ -0,0 +1,134 @@
+"""Per-request timing breakdown reported in the ``Server-Timing`` header.
+
+:class:`ServerTimingMiddleware` opens a :class:`Timings` for every HTTP
+request in a context variable. Code anywhere below it wraps its work in
+:func:`timed`. This covers the clients' round trips, HTML tree
+building, lesson extraction, cache lookups and serialization. Threads
+started with ``asyncio.to_thread`` or Starlette's threadpool inherit the
+context, so their time is reported too.
+
+Spans nest: a span's time excludes the spans opened inside it, so a cache
+lookup that falls through to upstream reports only its own overhead under
+``cache``. Spans of the same name add up. Concurrent upstream fetches can
+therefore sum to more than the request's ``total``.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+# Span names used across the package.
+UPSTREAM = "upstream"
+HTML_TREE = "html_tree"
+EXTRACT = "extract"
+CACHE = "cache"
+SERIALIZE = "serialize"
+
+_DESCRIPTIONS = {
+    UPSTREAM: "cacs.spa.msu.ru",
+    HTML_TREE: "HTML tree",
+    EXTRACT: "lesson extraction",
+    CACHE: "cache lookup",
+    SERIALIZE: "serialization",
+}
+
+
+class Timings:
+    """Seconds spent per span name during one request."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.spans: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def header(self) -> str:
+        """``Server-Timing`` value: every span, then ``total`` wall time so far."""
+        total = time.perf_counter() - self.started
+        with self._lock:
+            # Known spans in a fixed order, any others after them.
+            spans = {name: self.spans[name] for name in _DESCRIPTIONS if name in self.spans}
+            spans.update(self.spans)
+        entries = [
+            f'{name};dur={seconds * 1000:.1f};desc="{_DESCRIPTIONS[name]}"'
+            if name in _DESCRIPTIONS
+            else f"{name};dur={seconds * 1000:.1f}"
+            for name, seconds in spans.items()
+        ]
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_timings: ContextVar[Optional[Timings]] = ContextVar("schedule_timings", default=None)
+# Child time of the innermost open span, subtracted from it when it closes.
+_open_span: ContextVar[Optional[List[float]]] = ContextVar("schedule_open_span", default=None)
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    """Add the block's own time to span ``name`` of the current request, if any."""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    children = [0.0]
+    token = _open_span.set(children)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        _open_span.reset(token)
+        parent = _open_span.get()
+        if parent is not None:
+            parent[0] += elapsed
+        # Children running concurrently can outlast the span itself.
+        timings.add(name, max(elapsed - children[0], 0.0))
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware adding ``Server-Timing`` to every HTTP response.
+
+    The header is written when the response starts, so a streamed body's
+    own time is not in it.
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = Timings()
+        token = _timings.set(timings)
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.header().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _timings.reset(token)
+
+
+__all__ = [
+    "CACHE",
+    "EXTRACT",
+    "HTML_TREE",
+    "SERIALIZE",
+    "ServerTimingMiddleware",
+    "Timings",
+    "UPSTREAM",
+    "timed",
+]
@@ -0,0 +1,323 @@
+"""Local stand-in for the cacs.spa.msu.ru timetable form.
+
+Serves :class:`parser.synthetic.SyntheticSite` pages over HTTP with the
+workflow ``SpaScheduleClient`` depends on. A GET of the form starts a
+session (``PHPSESSID`` cookie) and hands out a CSRF token, both in
+``meta[name='csrf-token']`` and in the ``_csrf-frontend`` input of
+``#filter-form``. Every POST must carry a token of a live session. As on
+the Yii site, a missing, foreign or expired token gets ``400 Bad
+Request``. Sessions expire ``token_ttl`` seconds after their last request.
+
+Latency, injected errors, session lifetime and the size of the option
+tree are configurable, so pools, retries, windows and whole crawls can be
+exercised without touching the real site::
+
+    python -m parser.upstream_sim --port 8765 --latency 0.2 --error-rate 0.02 --token-ttl 300
+    python -m parser.cache_builder -j 8 --base-url "http://127.0.0.1:8765/time-table/group?type=0"
+    SCHEDULE_UPSTREAM_URL="http://127.0.0.1:8765/time-table/group?type=0" uvicorn app.main:app
+
+``GET /__stats`` reports the simulator's counters as JSON.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from http.cookies import CookieError, SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from .synthetic import SyntheticSite
+
+FORM_PATH = "/time-table/group"
+STATS_PATH = "/__stats"
+SESSION_COOKIE = "PHPSESSID"
+# Tokens handed out earlier in a session stay valid, like Yii's masked tokens.
+_TOKENS_PER_SESSION = 8
+_MAX_SESSIONS = 10000
+
+_BAD_REQUEST = (
+    "<!DOCTYPE html><html><head><title>Bad Request (#400)</title></head><body>"
+    "<h1>Bad Request (#400)</h1><p>Не удалось проверить переданные данные.</p>"
+    "</body></html>"
+)
+_ERROR = "<!DOCTYPE html><html><head><title>{status}</title></head><body><h1>{status}</h1></body></html>"
+_NOT_FOUND = "<!DOCTYPE html><html><head><title>Not Found (#404)</title></head><body></body></html>"
+
+Response = Tuple[int, List[Tuple[str, str]], bytes]
+
+
+@dataclass
+class SimulatorConfig:
+    faculties: int = 2
+    courses: int = 4
+    groups_per_course: int = 6
+    seed: int = 0
+    # Seconds added to every form response, plus up to ``jitter`` more.
+    latency: float = 0.0
+    jitter: float = 0.0
+    # Extra seconds per rendered timetable week; long ranges are slow upstream.
+    week_latency: float = 0.0
+    # Share of form requests answered with ``error_status`` instead.
+    error_rate: float = 0.0
+    error_status: int = 502
+    # Seconds a session and its CSRF tokens live after the last request;
+    # None keeps them forever.
+    token_ttl: Optional[float] = None
+
+
+@dataclass
+class SimulatorStats:
+    requests: int = 0
+    in_flight: int = 0
+    gets: int = 0
+    posts: int = 0
+    timetables: int = 0
+    weeks: int = 0
+    sessions_created: int = 0
+    sessions_expired: int = 0
+    csrf_rejected: int = 0
+    errors_injected: int = 0
+
+
+@dataclass
+class _Session:
+    last_seen: float
+    tokens: List[str] = field(default_factory=list)
+
+
+class UpstreamSimulator:
+    """The timetable form's server side, independent of the HTTP server running it."""
+
+    def __init__(self, config: Optional[SimulatorConfig] = None) -> None:
+        self.config = config or SimulatorConfig()
+        self.site = SyntheticSite(
+            faculties=self.config.faculties,
+            courses=self.config.courses,
+            groups_per_course=self.config.groups_per_course,
+            seed=self.config.seed,
+        )
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._stats = SimulatorStats()
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            stats = asdict(self._stats)
+            stats["sessions"] = len(self._sessions)
+        return stats
+
+    def handle(self, method: str, target: str, cookie: str = "", body: bytes = b"") -> Response:
+        """Answer one request: ``target`` is the request path, ``cookie`` its Cookie header."""
+        path = urlsplit(target).path
+        if method == "GET" and path == STATS_PATH:
+            return 200, [("Content-Type", "application/json")], json.dumps(self.stats()).encode()
+        if path != FORM_PATH or method not in ("GET", "POST"):
+            return 404, [("Content-Type", "text/html; charset=UTF-8")], _NOT_FOUND.encode()
+
+        with self._lock:
+            self._stats.requests += 1
+            self._stats.in_flight += 1
+            if method == "GET":
+                self._stats.gets += 1
+            else:
+                self._stats.posts += 1
+            failed = self._random.random() < self.config.error_rate
+            delay = self.config.latency + self._random.random() * self.config.jitter
+        try:
+            if failed:
+                time.sleep(delay)
+                with self._lock:
+                    self._stats.errors_injected += 1
+                status = self.config.error_status
+                page = _ERROR.format(status=status)
+                return status, [("Content-Type", "text/html; charset=UTF-8")], page.encode()
+            status, headers, page = self._form(method, _session_id(cookie), body)
+            weeks = page.count('class="headday"')
+            if weeks:
+                with self._lock:
+                    self._stats.timetables += 1
+                    self._stats.weeks += weeks
+            time.sleep(delay + weeks * self.config.week_latency)
+            headers.append(("Content-Type", "text/html; charset=UTF-8"))
+            return status, headers, page.encode()
+        finally:
+            with self._lock:
+                self._stats.in_flight -= 1
+
+    def _form(
+        self, method: str, session_id: Optional[str], body: bytes
+    ) -> Tuple[int, List[Tuple[str, str]], str]:
+        now = time.monotonic()
+        with self._lock:
+            session = self._live_session(session_id, now)
+            if method == "POST":
+                fields = parse_qs(body.decode(), keep_blank_values=True)
+                form = {key: values[0] for key, values in fields.items()}
+                if session is None or form.get("_csrf-frontend") not in session.tokens:
+                    self._stats.csrf_rejected += 1
+                    return 400, [], _BAD_REQUEST
+            else:
+                form = None
+            headers: List[Tuple[str, str]] = []
+            if session is None:
+                session_id, session = self._new_session(now)
+                headers.append(("Set-Cookie", f"{SESSION_COOKIE}={session_id}; path=/; HttpOnly"))
+            session.last_seen = now
+            token = secrets.token_urlsafe(24)
+            session.tokens = session.tokens[-(_TOKENS_PER_SESSION - 1):] + [token]
+        return 200, headers, self.site.page(form, csrf=token)
+
+    def _live_session(self, session_id: Optional[str], now: float) -> Optional[_Session]:
+        session = self._sessions.get(session_id) if session_id else None
+        if session is None:
+            return None
+        ttl = self.config.token_ttl
+        if ttl is not None and now - session.last_seen > ttl:
+            del self._sessions[session_id]  # type: ignore[arg-type]
+            self._stats.sessions_expired += 1
+            return None
+        self._sessions.move_to_end(session_id)  # type: ignore[arg-type]
+        return session
+
+    def _new_session(self, now: float) -> Tuple[str, _Session]:
+        session_id = secrets.token_hex(16)
+        session = self._sessions[session_id] = _Session(last_seen=now)
+        self._stats.sessions_created += 1
+        while len(self._sessions) > _MAX_SESSIONS:
+            self._sessions.popitem(last=False)
+        return session_id, session
+
+
+def _session_id(cookie: str) -> Optional[str]:
+    try:
+        morsel = SimpleCookie(cookie).get(SESSION_COOKIE)
+    except CookieError:
+        return None
+    return morsel.value if morsel is not None else None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, as the clients reuse their connections.
+    protocol_version = "HTTP/1.1"
+    server: "_Server"
+
+    def do_GET(self) -> None:
+        self._respond("GET", b"")
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        self._respond("POST", self.rfile.read(length))
+
+    def _respond(self, method: str, body: bytes) -> None:
+        status, headers, payload = self.server.simulator.handle(
+            method, self.path, self.headers.get("Cookie", ""), body
+        )
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format: str, *args: object) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], simulator: UpstreamSimulator, verbose: bool) -> None:
+        super().__init__(address, _Handler)
+        self.simulator = simulator
+        self.verbose = verbose
+
+
+def make_server(
+    simulator: UpstreamSimulator, host: str = "127.0.0.1", port: int = 0, verbose: bool = False
+) -> ThreadingHTTPServer:
+    """An HTTP server for ``simulator``; port 0 picks a free one."""
+    return _Server((host, port), simulator, verbose)
+
+
+def start(
+    simulator: UpstreamSimulator, host: str = "127.0.0.1", port: int = 0
+) -> ThreadingHTTPServer:
+    """Serve ``simulator`` from a daemon thread; stop it with ``shutdown()``."""
+    server = make_server(simulator, host, port)
+    threading.Thread(target=server.serve_forever, name="upstream-sim", daemon=True).start()
+    return server
+
+
+def base_url(server: ThreadingHTTPServer) -> str:
+    """The ``base_url`` to give the clients for ``server``."""
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}{FORM_PATH}?type=0"
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    defaults = SimulatorConfig()
+    cli = argparse.ArgumentParser(description="Serve a synthetic cacs.spa.msu.ru timetable form locally")
+    cli.add_argument("--host", default="127.0.0.1")
+    cli.add_argument("--port", type=int, default=8765)
+    cli.add_argument("--faculties", type=int, default=defaults.faculties)
+    cli.add_argument("--courses", type=int, default=defaults.courses, help="courses per faculty")
+    cli.add_argument("--groups", type=int, default=defaults.groups_per_course, help="groups per course")
+    cli.add_argument("--seed", type=int, default=defaults.seed)
+    cli.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    cli.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds at random")
+    cli.add_argument("--week-latency", type=float, default=0.0, help="extra seconds per timetable week")
+    cli.add_argument("--error-rate", type=float, default=0.0, help="share of requests that fail (0..1)")
+    cli.add_argument("--error-status", type=int, default=defaults.error_status)
+    cli.add_argument(
+        "--token-ttl",
+        type=float,
+        help="seconds of inactivity after which a session's CSRF tokens are rejected (default: never)",
+    )
+    cli.add_argument("-v", "--verbose", action="store_true", help="log every request")
+    args = cli.parse_args(argv)
+
+    simulator = UpstreamSimulator(SimulatorConfig(
+        faculties=args.faculties,
+        courses=args.courses,
+        groups_per_course=args.groups,
+        seed=args.seed,
+        latency=args.latency,
+        jitter=args.jitter,
+        week_latency=args.week_latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        token_ttl=args.token_ttl,
+    ))
+    server = make_server(simulator, args.host, args.port, verbose=args.verbose)
+    groups = sum(len(groups) for groups in simulator.site.groups.values())
+    print(f"Serving {groups} synthetic groups at {base_url(server)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+__all__ = [
+    "FORM_PATH",
+    "SimulatorConfig",
+    "SimulatorStats",
+    "UpstreamSimulator",
+    "base_url",
+    "make_server",
+    "start",
+]
+
+
+if __name__ == "__main__":
+    main()
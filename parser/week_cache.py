@@ -0,0 +1,183 @@
+"""Per-week cache of live schedules, assembled into arbitrary date ranges.
+
+A request for ``from..to`` is answered from the ISO weeks it touches. Weeks
+that are cached and fresh are reused; the rest are grouped into runs of
+consecutive weeks, and each run is fetched upstream as one request covering
+whole weeks. The run's result is then split back into weeks and stored.
+
+Freshness is tracked per week. The current and next week change most often
+and expire quickly, later weeks less so, and past weeks are kept longest.
+Expired weeks stay until they are evicted or refetched, so
+:meth:`WeekCache.stale` can still answer while upstream is unavailable.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from .teacher_index import date_ordinal
+from .windows import Window, merge_windows, week_start
+
+DEFAULT_TTLS = {"current": 600.0, "future": 3600.0, "past": 86400.0}
+DEFAULT_MAX_WEEKS = 20000
+
+GroupKey = Tuple[str, str, str]
+_WEEK = dt.timedelta(days=7)
+# What date_ordinal gives for a missing or malformed date.
+_UNDATED = dt.date.max.toordinal()
+
+
+@dataclass
+class _Week:
+    group_name: Optional[str]
+    lessons: List[dict]
+    fetched_at: float
+
+
+@dataclass
+class WeekPlan:
+    """Outcome of :meth:`WeekCache.lookup` for one request."""
+
+    fresh: Dict[dt.date, _Week]
+    # Runs of consecutive weeks to fetch, Monday to Sunday.
+    missing: List[Window]
+
+
+class WeekCache:
+    """Lessons of ``(faculty, course, group)`` cached per ISO week.
+
+    At most ``max_weeks`` weeks are kept. The least recently used are
+    evicted first. ``ttls`` maps "current" (this and next week), "future"
+    and "past" to seconds.
+    """
+
+    def __init__(
+        self, ttls: Optional[Dict[str, float]] = None, max_weeks: int = DEFAULT_MAX_WEEKS
+    ) -> None:
+        self.ttls = dict(ttls or DEFAULT_TTLS)
+        self.max_weeks = max_weeks
+        self._entries: "OrderedDict[Tuple[GroupKey, dt.date], _Week]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "expired": 0,
+            "misses": 0,
+            "fetches": 0,
+            "evictions": 0,
+            "stale_served": 0,
+        }
+
+    def ttl(self, monday: dt.date, today: Optional[dt.date] = None) -> float:
+        current = week_start(today or dt.date.today())
+        if monday < current:
+            return self.ttls["past"]
+        if monday <= current + _WEEK:
+            return self.ttls["current"]
+        return self.ttls["future"]
+
+    def lookup(self, group: GroupKey, date_from: dt.date, date_to: dt.date) -> WeekPlan:
+        now = time.monotonic()
+        today = dt.date.today()
+        plan = WeekPlan(fresh={}, missing=[])
+        run_start: Optional[dt.date] = None
+        monday = week_start(date_from)
+        with self._lock:
+            while monday <= date_to:
+                entry = self._entries.get((group, monday))
+                if entry is not None and now - entry.fetched_at < self.ttl(monday, today):
+                    self._entries.move_to_end((group, monday))
+                    self._counters["hits"] += 1
+                    plan.fresh[monday] = entry
+                    if run_start is not None:
+                        plan.missing.append((run_start, monday - dt.timedelta(days=1)))
+                        run_start = None
+                else:
+                    self._counters["expired" if entry is not None else "misses"] += 1
+                    if run_start is None:
+                        run_start = monday
+                monday += _WEEK
+        if run_start is not None:
+            plan.missing.append((run_start, monday - dt.timedelta(days=1)))
+        return plan
+
+    def stale(
+        self, group: GroupKey, date_from: dt.date, date_to: dt.date
+    ) -> Optional[Dict[dt.date, _Week]]:
+        """Every week of the range whatever its age, or None if one was never cached."""
+        weeks: Dict[dt.date, _Week] = {}
+        monday = week_start(date_from)
+        with self._lock:
+            while monday <= date_to:
+                entry = self._entries.get((group, monday))
+                if entry is None:
+                    return None
+                weeks[monday] = entry
+                monday += _WEEK
+            self._counters["stale_served"] += 1
+        return weeks
+
+    def store(self, group: GroupKey, run: Window, result: Dict[str, object]) -> Dict[dt.date, _Week]:
+        """Split a fetched run into weeks and cache them, empty weeks included.
+
+        Lessons without a readable date are kept with the run's first week.
+        """
+        start, end = run
+        group_name = (result.get("group") or {}).get("name")  # type: ignore[union-attr]
+        now = time.monotonic()
+        weeks: Dict[dt.date, _Week] = {}
+        monday = start
+        while monday <= end:
+            weeks[monday] = _Week(group_name, [], now)
+            monday += _WEEK
+        for lesson in result.get("lessons") or []:  # type: ignore[union-attr]
+            ordinal = date_ordinal(lesson.get("date"))
+            monday = week_start(dt.date.fromordinal(ordinal)) if ordinal != _UNDATED else start
+            weeks.get(monday, weeks[start]).lessons.append(lesson)
+        with self._lock:
+            self._counters["fetches"] += 1
+            for monday, week in weeks.items():
+                self._entries[(group, monday)] = week
+                self._entries.move_to_end((group, monday))
+            while len(self._entries) > self.max_weeks:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+        return weeks
+
+    @staticmethod
+    def assemble(
+        group_id: str, weeks: Dict[dt.date, _Week], date_from: dt.date, date_to: dt.date
+    ) -> Dict[str, object]:
+        """The ``fetch_schedule`` result for ``date_from..date_to`` out of whole weeks."""
+        lo, hi = date_from.toordinal(), date_to.toordinal()
+
+        def in_range(lesson: dict) -> bool:
+            ordinal = date_ordinal(lesson.get("date"))
+            return lo <= ordinal <= hi or ordinal == _UNDATED
+
+        return merge_windows(
+            group_id,
+            (
+                {
+                    "group": {"name": weeks[monday].group_name},
+                    "lessons": [lesson for lesson in weeks[monday].lessons if in_range(lesson)],
+                }
+                for monday in sorted(weeks)
+            ),
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["expired"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "weeks": len(self._entries),
+                "hit_ratio": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+                "ttls": dict(self.ttls),
+            }
+
+
+__all__ = ["DEFAULT_MAX_WEEKS", "DEFAULT_TTLS", "WeekCache", "WeekPlan"]
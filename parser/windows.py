@@ -0,0 +1,124 @@
+"""Splitting long schedule requests into calendar windows.
+
+Upstream renders a whole date range as one page, which for a semester is
+slow to produce, slow to parse and lost entirely on a single timeout.
+:func:`fetch_windowed` asks for the range month by month (or week by week)
+on several sessions at once, retries only the windows that failed and
+merges the pages back into what one request for the whole range returns.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+WEEK = "week"
+MONTH = "month"
+WINDOWS = (WEEK, MONTH)
+
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 2
+
+Window = Tuple[dt.date, dt.date]
+
+
+def week_start(day: dt.date) -> dt.date:
+    """Monday of the ISO week containing ``day``."""
+    return day - dt.timedelta(days=day.weekday())
+
+
+def split_range(date_from: dt.date, date_to: dt.date, window: str) -> List[Window]:
+    """Cut ``[date_from, date_to]`` at ISO week or calendar month boundaries."""
+    if window not in WINDOWS:
+        raise ValueError(f"Unknown window: {window!r}")
+    windows: List[Window] = []
+    start = date_from
+    while start <= date_to:
+        if window == WEEK:
+            boundary = week_start(start) + dt.timedelta(days=7)
+        else:
+            boundary = (start.replace(day=1) + dt.timedelta(days=32)).replace(day=1)
+        end = min(boundary - dt.timedelta(days=1), date_to)
+        windows.append((start, end))
+        start = end + dt.timedelta(days=1)
+    return windows
+
+
+def merge_windows(group_id: str, results: Iterable[Dict[str, object]]) -> Dict[str, object]:
+    """Join per-window results, in window order, into one ``fetch_schedule`` result.
+
+    A lesson whose ``id`` already came with an earlier window is dropped.
+    Repeats within one window are kept, as a single request would keep them.
+    """
+    group_name: Optional[str] = None
+    lessons: List[dict] = []
+    seen: Set[Optional[str]] = set()
+    for result in results:
+        group = result.get("group") or {}
+        group_name = group_name or group.get("name")  # type: ignore[union-attr]
+        window_lessons = result.get("lessons") or []
+        lessons.extend(lesson for lesson in window_lessons if lesson.get("id") not in seen)  # type: ignore[union-attr]
+        seen.update(lesson.get("id") for lesson in window_lessons)  # type: ignore[union-attr]
+    return {"group": {"id": group_id, "name": group_name}, "lessons": lessons}
+
+
+def fetch_windowed(
+    fetch: Callable[[dt.date, dt.date], Dict[str, object]],
+    group_id: str,
+    date_from: dt.date,
+    date_to: dt.date,
+    *,
+    window: str = MONTH,
+    workers: int = DEFAULT_WORKERS,
+    retries: int = DEFAULT_RETRIES,
+) -> Dict[str, object]:
+    """Fetch a long range as concurrent windows and merge the results.
+
+    ``fetch(start, end)`` returns a ``fetch_schedule`` result for one window
+    and is called from up to ``workers`` threads at once, so each call must
+    use its own session. Windows that raise are retried up to ``retries``
+    more times; if any still fails, its last error is raised.
+    """
+    windows = split_range(date_from, date_to, window)
+    results: Dict[int, Dict[str, object]] = {}
+    pending = list(range(len(windows)))
+    errors: Dict[int, Exception] = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(windows)))) as pool:
+        for attempt in range(retries + 1):
+            futures = {index: pool.submit(fetch, *windows[index]) for index in pending}
+            pending = []
+            for index, future in futures.items():
+                try:
+                    results[index] = future.result()
+                except Exception as exc:  # noqa: BLE001
+                    errors[index] = exc
+                    pending.append(index)
+            if not pending:
+                break
+            logger.warning(
+                "%d of %d windows for group %s failed (attempt %d): %s",
+                len(pending),
+                len(windows),
+                group_id,
+                attempt + 1,
+                errors[pending[0]],
+            )
+    if pending:
+        raise errors[pending[0]]
+    return merge_windows(group_id, (results[index] for index in range(len(windows))))
+
+
+__all__ = [
+    "DEFAULT_RETRIES",
+    "DEFAULT_WORKERS",
+    "MONTH",
+    "WEEK",
+    "WINDOWS",
+    "fetch_windowed",
+    "merge_windows",
+    "split_range",
+    "week_start",
+]